@@ -0,0 +1,316 @@
+import numpy as np  # type: ignore
+import calendar, math
+from datetime import datetime, timezone
+from app.categories import RULEBOOK_VERSION, segment_categories, month_categories, merge_categories
+
+# incremental version of the old pandas analytics: running sums and counts, a mergeable
+# mean/variance pair for the balance and one small bucket per calendar year-month. The state
+# is a plain dict so it can be stored in mongo and folded into again on the next data
+# session. build_analytics also derives 3/6/12-month rolling features from the newest
+# buckets, which credit-engine scores on. Each bucket also counts and sums the transactions
+# of every category app/categories.py labelled in it
+
+# bump when the state layout changes; older states are re-folded from the archive
+STATE_VERSION = 3
+ROLLING_WINDOWS = (3, 6, 12)
+
+
+def parse_timestamp(value):
+    # python 3.10 fromisoformat does not accept the trailing "Z"
+    ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts
+
+
+def new_state():
+    return {
+        "version": STATE_VERSION,
+        "rulebook": RULEBOOK_VERSION,
+        "total_credit": 0.0,
+        "total_debit": 0.0,
+        "tx_count": 0,
+        "amount_sum": 0.0,
+        "cash_tx_count": 0,
+        # Welford running mean / sum of squared deviations of currentBalance
+        "balance_count": 0,
+        "balance_mean": 0.0,
+        "balance_m2": 0.0,
+        "balance_min": None,
+        "months": {},
+        # newest transaction folded in so far, and the txn ids seen at exactly that time
+        "watermark": None,
+        "watermark_txn_ids": [],
+    }
+
+
+def is_current(state):
+    return state is not None and state.get("version") == STATE_VERSION and state.get("rulebook") == RULEBOOK_VERSION
+
+
+def new_month():
+    return {
+        "inflow": 0.0,
+        "outflow": 0.0,
+        "has_inflow": False,
+        "has_outflow": False,
+        "tx_count": 0,
+        "amount_sum": 0.0,
+        "balance_sum": 0.0,
+        "balance_count": 0,
+        # sum of squared deviations from the month's mean balance, mergeable like balance_m2
+        "balance_m2": 0.0,
+        "balance_min": None,
+        # {category: {"count", "amount"}}
+        "categories": {},
+    }
+
+
+def month_key(index):
+    # months since 1970-01 -> "YYYY-MM"
+    return f"{1970 + index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def month_index(key):
+    year, month = key.split("-")
+    return (int(year) - 1970) * 12 + int(month) - 1
+
+
+def local_months(segment):
+    # calendar year-month of each transaction in the timezone it was reported in, as months
+    # since 1970-01
+    local = segment["ts"] + segment["utc_offset"].astype(np.int64) * 60_000_000
+    return local.astype("datetime64[us]").astype("datetime64[M]").astype(np.int64)
+
+
+def merge_month(target, month):
+    count = target["balance_count"] + month["balance_count"]
+    if month["balance_count"]:
+        # Chan merge of the two (count, mean, m2) balance triples
+        target_mean = target["balance_sum"] / target["balance_count"] if target["balance_count"] else 0.0
+        delta = month["balance_sum"] / month["balance_count"] - target_mean
+        target["balance_m2"] += month["balance_m2"] + delta * delta * target["balance_count"] * month["balance_count"] / count
+    target["inflow"] += month["inflow"]
+    target["outflow"] += month["outflow"]
+    target["has_inflow"] = target["has_inflow"] or month["has_inflow"]
+    target["has_outflow"] = target["has_outflow"] or month["has_outflow"]
+    target["tx_count"] += month["tx_count"]
+    target["amount_sum"] += month["amount_sum"]
+    target["balance_sum"] += month["balance_sum"]
+    target["balance_count"] = count
+    if month["balance_min"] is not None and (target["balance_min"] is None or month["balance_min"] < target["balance_min"]):
+        target["balance_min"] = month["balance_min"]
+    merge_categories(target["categories"], month["categories"])
+
+
+def new_rows(state, segment):
+    # rows after the watermark, or at it with a txn id not folded yet
+    ts = segment["ts"]
+    watermark = state["watermark"]
+    if watermark is None:
+        return np.ones(len(ts), dtype=bool)
+    watermark_us = round(watermark * 1_000_000)
+    mask = ts > watermark_us
+    at_watermark = np.flatnonzero(ts == watermark_us)
+    if len(at_watermark):
+        seen = set(state["watermark_txn_ids"])
+        mask[at_watermark] = [txn_id not in seen for txn_id in segment["txn_id"].take(at_watermark)]
+    return mask
+
+
+def fold_columns(state, segment):
+    # folds one archive segment (see app/txn_archive.py) into the state with array
+    # operations, the result matches adding its transactions one at a time
+    mask = new_rows(state, segment)
+    if not mask.any():
+        return 0
+    ts = segment["ts"][mask]
+    amount = segment["amount"][mask]
+    balance = segment["balance"][mask]
+    type_codes = segment["type"][mask]
+    credit = type_codes == segment.code("type", "CREDIT")
+    debit = type_codes == segment.code("type", "DEBIT")
+    months = local_months(segment)[mask]
+
+    state["total_credit"] += float(amount[credit].sum())
+    state["total_debit"] += float(amount[debit].sum())
+    state["tx_count"] += int(len(amount))
+    state["amount_sum"] += float(amount.sum())
+    state["cash_tx_count"] += int((segment["mode"][mask] == segment.code("mode", "CASH")).sum())
+
+    # Chan merge of this segment's balance mean / squared deviations into the running pair
+    count = int(len(balance))
+    mean = float(balance.mean())
+    m2 = float(((balance - mean) ** 2).sum())
+    total = state["balance_count"] + count
+    delta = mean - state["balance_mean"]
+    state["balance_m2"] += m2 + delta * delta * state["balance_count"] * count / total
+    state["balance_mean"] += delta * count / total
+    state["balance_count"] = total
+    balance_min = float(balance.min())
+    if state["balance_min"] is None or balance_min < state["balance_min"]:
+        state["balance_min"] = balance_min
+
+    # one bucket per year-month present in the segment
+    keys, group = np.unique(months, return_inverse=True)
+    inflow = np.bincount(group, weights=np.where(credit, amount, 0))
+    outflow = np.bincount(group, weights=np.where(debit, amount, 0))
+    credits = np.bincount(group, weights=credit)
+    debits = np.bincount(group, weights=debit)
+    amount_sum = np.bincount(group, weights=amount)
+    balance_sum = np.bincount(group, weights=balance)
+    balance_count = np.bincount(group)
+    balance_m2 = np.bincount(group, weights=(balance - (balance_sum / balance_count)[group]) ** 2)
+    balance_min = np.full(len(keys), np.inf)
+    np.minimum.at(balance_min, group, balance)
+    categories = month_categories(group, segment_categories(segment)[mask], amount, len(keys))
+    for i, key in enumerate(keys):
+        merge_month(state["months"].setdefault(month_key(int(key)), new_month()), {
+            "inflow": float(inflow[i]),
+            "outflow": float(outflow[i]),
+            "has_inflow": bool(credits[i]),
+            "has_outflow": bool(debits[i]),
+            "tx_count": int(balance_count[i]),
+            "amount_sum": float(amount_sum[i]),
+            "balance_sum": float(balance_sum[i]),
+            "balance_count": int(balance_count[i]),
+            "balance_m2": float(balance_m2[i]),
+            "balance_min": float(balance_min[i]),
+            "categories": categories[i],
+        })
+
+    max_ts = int(ts.max())
+    ids_at_max = segment["txn_id"].take(np.flatnonzero(mask & (segment["ts"] == max_ts)))
+    epoch = max_ts / 1_000_000
+    if state["watermark"] is None or epoch > state["watermark"]:
+        state["watermark"] = epoch
+        state["watermark_txn_ids"] = ids_at_max
+    else:
+        state["watermark_txn_ids"] += ids_at_max
+    return count
+
+
+def sample_std(values):
+    if len(values) < 2:
+        return math.nan
+    mean = sum(values) / len(values)
+    return math.sqrt(sum((v - mean) ** 2 for v in values) / (len(values) - 1))
+
+
+def build_analytics(state):
+    # same fields and semantics as the pandas version that used to live in main.py
+    bank_analytics = {}
+    total_credit = state["total_credit"]
+    total_debit = state["total_debit"]
+    bank_analytics["total_credit"] = total_credit
+    bank_analytics["total_debit"] = total_debit
+    bank_analytics["debit_to_credit_ratio"] = total_debit / total_credit if total_credit != 0 else 0
+    bank_analytics["average_tx_amount"] = state["amount_sum"] / state["tx_count"] if state["tx_count"] else math.nan
+
+    monthly_data = []
+    cashflow_months = []
+    # "YYYY-MM" keys sort chronologically
+    for key in sorted(state["months"]):
+        month = state["months"][key]
+        year, number = key.split("-")
+        monthly_data.append({
+            "month": key,
+            "month_name": f"{calendar.month_name[int(number)]} {year}",
+            "monthly_inflow": month["inflow"],
+            "monthly_outflow": month["outflow"],
+            "monthly_balance": month["balance_sum"] / month["balance_count"] if month["balance_count"] else 0,
+            "monthly_categories": {category: dict(totals) for category, totals in month["categories"].items()},
+        })
+        if month["has_inflow"] or month["has_outflow"]:
+            cashflow_months.append(month)
+    bank_analytics["monthly_data"] = monthly_data
+
+    n_months = len(cashflow_months)
+    bank_analytics["average_monthly_inflow"] = sum(m["inflow"] for m in cashflow_months) / n_months if n_months else math.nan
+    bank_analytics["average_monthly_outflow"] = sum(m["outflow"] for m in cashflow_months) / n_months if n_months else math.nan
+
+    net_cashflow = [m["inflow"] - m["outflow"] for m in cashflow_months]
+    mean_ncf = sum(net_cashflow) / n_months if n_months else math.nan
+    bank_analytics["average_monthly_cashflow"] = mean_ncf
+    std_ncf = sample_std(net_cashflow)
+    bank_analytics["cash_flow_stability"] = 1 - (std_ncf / mean_ncf) if mean_ncf > 0 else 0 # if negetive cashflow then do not use
+
+    bank_analytics["minmum_maintained_balance"] = state["balance_min"] if state["balance_min"] is not None else math.nan
+    balance_std = math.sqrt(state["balance_m2"] / (state["balance_count"] - 1)) if state["balance_count"] > 1 else math.nan
+    bank_analytics["balance_voltality"] = balance_std / state["balance_mean"] if state["balance_mean"] else math.nan # lower the volatility is good 0.2 < is good
+    bank_analytics["average_maintained_balance"] = state["balance_mean"] if state["balance_count"] else math.nan
+    bank_analytics["cash_tx_ratio"] = state["cash_tx_count"] / state["tx_count"] if state["tx_count"] else math.nan
+    category_totals = {}
+    for month in state["months"].values():
+        merge_categories(category_totals, month["categories"])
+    bank_analytics["category_totals"] = category_totals
+    bank_analytics["rolling"] = rolling_features(state["months"])
+    return bank_analytics
+
+
+def window_features(months):
+    # features over a run of month buckets (months without transactions are simply absent)
+    window = new_month()
+    for month in months:
+        merge_month(window, month)
+    flow_months = [m for m in months if m["has_inflow"] or m["has_outflow"]]
+    net_cashflow = [m["inflow"] - m["outflow"] for m in flow_months]
+    mean_ncf = sum(net_cashflow) / len(flow_months) if flow_months else math.nan
+    std_ncf = sample_std(net_cashflow)
+    balance_mean = window["balance_sum"] / window["balance_count"] if window["balance_count"] else math.nan
+    balance_std = math.sqrt(window["balance_m2"] / (window["balance_count"] - 1)) if window["balance_count"] > 1 else math.nan
+    return {
+        "months": len(months),
+        "inflow": window["inflow"],
+        "outflow": window["outflow"],
+        "net_cashflow": window["inflow"] - window["outflow"],
+        "debit_to_credit_ratio": window["outflow"] / window["inflow"] if window["inflow"] != 0 else 0,
+        "average_tx_amount": window["amount_sum"] / window["tx_count"] if window["tx_count"] else math.nan,
+        "positive_cashflow_months": sum(1 for m in months if m["inflow"] - m["outflow"] > 0),
+        "cash_flow_stability": 1 - (std_ncf / mean_ncf) if mean_ncf > 0 else 0,
+        "balance_mean": balance_mean,
+        "balance_min": window["balance_min"] if window["balance_min"] is not None else math.nan,
+        "balance_volatility": balance_std / balance_mean if balance_mean else math.nan,
+        "categories": window["categories"],
+    }
+
+
+def rolling_features(months):
+    # trailing windows ending at the newest month with transactions, at most 12 buckets
+    # each, so the features cost the same however long the account history gets
+    if not months:
+        return {}
+    latest = max(month_index(key) for key in months)
+    rolling = {"as_of": month_key(latest)}
+    for n in ROLLING_WINDOWS:
+        keys = (month_key(index) for index in range(latest - n + 1, latest + 1))
+        rolling[f"{n}m"] = window_features([months[key] for key in keys if key in months])
+    return rolling
+
+
+def merge_states(states):
+    # combines per-account states into one, every field is a sum, a min or a Welford
+    # pair, so the merged analytics are the same as if all transactions were in one account
+    merged = new_state()
+    for state in states:
+        merged["total_credit"] += state["total_credit"]
+        merged["total_debit"] += state["total_debit"]
+        merged["tx_count"] += state["tx_count"]
+        merged["amount_sum"] += state["amount_sum"]
+        merged["cash_tx_count"] += state["cash_tx_count"]
+
+        count = merged["balance_count"] + state["balance_count"]
+        if count:
+            delta = state["balance_mean"] - merged["balance_mean"]
+            merged["balance_m2"] += state["balance_m2"] + delta * delta * merged["balance_count"] * state["balance_count"] / count
+            merged["balance_mean"] += delta * state["balance_count"] / count
+            merged["balance_count"] = count
+        if state["balance_min"] is not None and (merged["balance_min"] is None or state["balance_min"] < merged["balance_min"]):
+            merged["balance_min"] = state["balance_min"]
+
+        for key, month in state["months"].items():
+            merge_month(merged["months"].setdefault(key, new_month()), month)
+
+        if state["watermark"] is not None and (merged["watermark"] is None or state["watermark"] > merged["watermark"]):
+            merged["watermark"] = state["watermark"]
+    return merged
@@ -0,0 +1,114 @@
+import numpy as np  # type: ignore
+import re
+
+# labels transactions from their narration and reference text (GST payments, EMIs, salary,
+# bounced cheques, loan disbursals). Every rule's patterns are compiled into one regex and
+# run once over an archive column's utf-8 blob (see app/txn_archive.py), so a segment is
+# labelled with one scan in C plus array operations, not a regex call per transaction.
+# A transaction gets the first category in RULEBOOK order that matched it; rows no rule
+# matched are left uncategorized. The labels are computed when a segment is appended and
+# stored with it as the "category" column
+
+# bump when RULEBOOK changes: analytics states folded with another rulebook are re-folded
+# from the archive, and segments labelled with another one are labelled again on read
+RULEBOOK_VERSION = 1
+
+# (category, transaction type it applies to or None for both, upper case regex patterns).
+# A pattern only matches at the start of a word, the text is upper-cased before matching
+# and groups inside a pattern must be non-capturing
+RULEBOOK = [
+    ("bounce", None, [r"BOUNCE", r"RTN\b", r"RET(?:URN)?\b", r"INSUFF", r"DISHONO", r"UNPAID\b"]),
+    ("gst", "DEBIT", [r"GST", r"CBIC\b"]),
+    ("loan_disbursal", "CREDIT", [r"LOAN DISB", r"DISB(?:URSAL|URSEMENT|T)?\b"]),
+    ("emi", "DEBIT", [r"EMI\b", r"NACH\b", r"ECS\b", r"ACH\b"]),
+    ("salary", "CREDIT", [r"SALARY", r"SAL\b", r"PAYROLL"]),
+]
+CATEGORIES = [category for category, _, _ in RULEBOOK]
+# label of a transaction no rule matched
+UNCATEGORIZED = len(CATEGORIES)
+TEXT_COLUMNS = ("narration", "reference")
+
+
+def compile_rulebook(rulebook):
+    # one alternative group per category, the number of the group that matched is the
+    # category's index + 1. The leading \b lets the scan skip every position inside a word,
+    # which is most of them; that and matching upper-cased text instead of IGNORECASE make
+    # it about 5x faster than the plain alternation
+    alternatives = [b"(" + b"|".join(pattern.encode() for pattern in patterns) + b")" for _, _, patterns in rulebook]
+    matcher = re.compile(rb"\b(?:" + b"|".join(alternatives) + b")")
+    if matcher.groups != len(rulebook):
+        raise ValueError("rulebook patterns must not contain capturing groups")
+    return matcher
+
+
+MATCHER = compile_rulebook(RULEBOOK)
+
+
+def match_column(column):
+    # (row, category) of every match in a StringColumn. A newline is put after every row
+    # so that no match runs from one row into the next
+    offsets = np.asarray(column.offsets)
+    n = len(offsets) - 1
+    blob = np.insert(np.asarray(column.data), offsets[1:], ord("\n")).tobytes().upper()
+    starts = offsets[:-1] + np.arange(n)
+    positions = []
+    groups = []
+    for match in MATCHER.finditer(blob):
+        positions.append(match.start())
+        groups.append(match.lastindex)
+    rows = np.searchsorted(starts, np.array(positions, dtype=np.int64), side="right") - 1
+    return rows, np.array(groups, dtype=np.int64) - 1
+
+
+def categorize(columns, dictionaries):
+    # the category index of every row of a segment's columns, UNCATEGORIZED where no
+    # rule applies
+    type_codes = np.asarray(columns["type"]).astype(np.int64)
+    labels = np.full(len(type_codes), UNCATEGORIZED, dtype=np.uint8)
+    if not len(labels):
+        return labels
+    # the type code each category is restricted to, -2 for any type (-1 is a type that
+    # never occurs in these rows)
+    types = dictionaries["type"]
+    required = np.array([(types.index(kind) if kind in types else -1) if kind else -2 for _, kind, _ in RULEBOOK], dtype=np.int64)
+    for name in TEXT_COLUMNS:
+        rows, categories = match_column(columns[name])
+        if not len(rows):
+            continue
+        need = required[categories]
+        applies = (need == -2) | (type_codes[rows] == need)
+        # lower index wins: the earlier rule in RULEBOOK
+        np.minimum.at(labels, rows[applies], categories[applies].astype(np.uint8))
+    return labels
+
+
+def segment_categories(segment):
+    # the labels stored with the segment, or fresh ones if it was written with another
+    # rulebook (or before there was one)
+    if segment.meta.get("rulebook") == RULEBOOK_VERSION:
+        return segment["category"]
+    return categorize(segment, segment.dictionaries)
+
+
+def month_categories(group, labels, amount, n_months):
+    # {category: {"count", "amount"}} for each of n_months month groups, only the
+    # categories that occur in the month
+    categorized = labels != UNCATEGORIZED
+    cells = group[categorized] * len(CATEGORIES) + labels[categorized]
+    size = n_months * len(CATEGORIES)
+    counts = np.bincount(cells, minlength=size).reshape(n_months, len(CATEGORIES))
+    amounts = np.bincount(cells, weights=amount[categorized], minlength=size).reshape(n_months, len(CATEGORIES))
+    return [
+        {
+            CATEGORIES[c]: {"count": int(counts[m, c]), "amount": float(amounts[m, c])}
+            for c in np.flatnonzero(counts[m])
+        }
+        for m in range(n_months)
+    ]
+
+
+def merge_categories(target, categories):
+    for category, totals in categories.items():
+        current = target.setdefault(category, {"count": 0, "amount": 0.0})
+        current["count"] += totals["count"]
+        current["amount"] += totals["amount"]
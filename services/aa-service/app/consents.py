@@ -0,0 +1,148 @@
+import asyncio, hmac, os
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument  # type: ignore
+
+# local consent state: Setu posts consent and data session status changes to
+# /setu-notifications (set that url as the notification url of the Setu product), and the
+# consents collection keeps the latest state of each consent. The UI long-polls
+# /consents/{id}/wait instead of asking Setu every few seconds. Waiters in this process are
+# woken as soon as the record changes, waiters on another replica see it at their next re-read
+
+# longest a single long-poll may hang, clients just call again
+CONSENT_WAIT_MAX_SECONDS = float(os.getenv("CONSENT_WAIT_MAX_SECONDS", 25))
+# waiters re-read the record this often, for changes written by another replica
+CONSENT_RECHECK_SECONDS = float(os.getenv("CONSENT_RECHECK_SECONDS", 2))
+# without notifications a long-poll on a PENDING consent asks Setu this often; with them it
+# asks once, when the long-poll times out, in case a notification got lost
+SETU_CHECK_SECONDS = float(os.getenv("SETU_CHECK_SECONDS", 3))
+# a data session claim that is this old without a session_id belongs to a process that died
+# while opening it, and may be claimed again
+SESSION_CLAIM_SECONDS = float(os.getenv("SESSION_CLAIM_SECONDS", 60))
+# notifications must carry it as ?token=..., put it in the url configured on Setu. Without
+# it every notification is refused, anyone could otherwise mark a consent ACTIVE
+SETU_NOTIFICATION_TOKEN = os.getenv("SETU_NOTIFICATION_TOKEN")
+
+# Setu consent statuses
+PENDING_CONSENT_STATUS = "PENDING"
+ACTIVE_CONSENT_STATUS = "ACTIVE"
+
+# Setu notification types
+CONSENT_NOTIFICATION = "CONSENT_STATUS_UPDATE"
+SESSION_NOTIFICATIONS = {"SESSION_STATUS_UPDATE", "FI_DATA_READY"}
+
+
+def notifications_configured():
+    return bool(SETU_NOTIFICATION_TOKEN)
+
+
+def notification_authorized(token):
+    if not SETU_NOTIFICATION_TOKEN:
+        return False
+    return token is not None and hmac.compare_digest(token, SETU_NOTIFICATION_TOKEN)
+
+
+def consent_view(consent):
+    view = {
+        "id": consent["_id"],
+        "status": consent.get("status"),
+        "version": consent.get("version", 0),
+        "session_id": consent.get("session_id"),
+        "session_status": consent.get("session_status"),
+        "job_id": consent.get("job_id"),
+        "job_status": consent.get("job_status"),
+        "updated_at": consent["updated_at"].isoformat(),
+    }
+    if consent.get("ids"):
+        view["ids"] = consent["ids"]
+    if consent.get("error"):
+        view["error"] = consent["error"]
+    return view
+
+
+class ConsentStore:
+    def __init__(self, consents):
+        self.consents = consents
+        self._changed = {}
+        self._waiters = {}
+        self._tasks = set()
+        self.metrics = {"notifications": 0, "unauthorized": 0, "waits": 0, "wakeups": 0, "setu_checks": 0}
+
+    async def get(self, consent_id):
+        return await self.consents.find_one({"_id": consent_id})
+
+    async def find_by_session(self, session_id):
+        return await self.consents.find_one({"session_id": session_id})
+
+    async def update(self, consent_id, **fields):
+        # every change bumps version, a waiter returns once it differs from the one it saw
+        now = datetime.now(timezone.utc)
+        fields["updated_at"] = now
+        consent = await self.consents.find_one_and_update(
+            {"_id": consent_id},
+            {"$set": fields, "$inc": {"version": 1}, "$setOnInsert": {"created_at": now}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self._wake(consent_id)
+        return consent
+
+    async def claim_session(self, consent_id):
+        # only one of concurrent notifications / status checks creates the data session;
+        # failures release the claim, a crash leaves it to expire after SESSION_CLAIM_SECONDS
+        now = datetime.now(timezone.utc)
+        result = await self.consents.update_one(
+            {"_id": consent_id, "$or": [
+                {"session_requested_at": {"$exists": False}},
+                {"session_id": {"$exists": False}, "session_requested_at": {"$lt": now - timedelta(seconds=SESSION_CLAIM_SECONDS)}},
+            ]},
+            {"$set": {"session_requested_at": now}},
+        )
+        return result.modified_count == 1
+
+    async def release_session(self, consent_id, error):
+        await self.consents.update_one({"_id": consent_id}, {"$unset": {"session_requested_at": ""}})
+        return await self.update(consent_id, error=error)
+
+    def _wake(self, consent_id):
+        event = self._changed.pop(consent_id, None)
+        if event:
+            self.metrics["wakeups"] += 1
+            event.set()
+
+    async def wait(self, consent_id, version, timeout):
+        # returns the record as soon as its version differs from `version`, or as it is when
+        # the timeout runs out; None for a consent this service has never seen
+        self.metrics["waits"] += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(timeout, CONSENT_WAIT_MAX_SECONDS)
+        self._waiters[consent_id] = self._waiters.get(consent_id, 0) + 1
+        try:
+            while True:
+                event = self._changed.setdefault(consent_id, asyncio.Event())
+                consent = await self.get(consent_id)
+                remaining = deadline - loop.time()
+                if consent is None or consent.get("version", 0) != version or remaining <= 0:
+                    return consent
+                try:
+                    await asyncio.wait_for(event.wait(), min(remaining, CONSENT_RECHECK_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiters[consent_id] -= 1
+            if not self._waiters[consent_id]:
+                del self._waiters[consent_id]
+                self._changed.pop(consent_id, None)
+
+    def spawn(self, coro):
+        # background work started by a notification, which Setu expects answered quickly
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def get_metrics(self):
+        return {**self.metrics, "waiting": len(self._waiters), "background_tasks": len(self._tasks)}
+
+    def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
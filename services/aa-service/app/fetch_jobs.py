@@ -0,0 +1,241 @@
+import asyncio, logging, os, socket, time
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId  # type: ignore
+from pymongo.errors import DuplicateKeyError  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# FI fetches run as jobs: /fetch-data records a job in mongo and returns its id, and a fixed
+# pool of worker tasks polls Setu until the data session is ready, then folds and stores the
+# analytics (the folding itself runs in the analytics process pool). The in-memory queue is
+# bounded, a full queue turns new fetches away instead of piling up sessions. Every active job
+# is leased to the process that queued it, which keeps renewing the lease; the jobs of a
+# process that stopped renewing (crashed, redeployed) are taken over by whichever replica
+# notices first, the ones a live sibling is still running are left alone
+
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", 8))
+FETCH_QUEUE_SIZE = int(os.getenv("FETCH_QUEUE_SIZE", 100))
+FETCH_POLL_INTERVAL_SECONDS = float(os.getenv("FETCH_POLL_INTERVAL_SECONDS", 2))
+FETCH_POLL_MAX_INTERVAL_SECONDS = float(os.getenv("FETCH_POLL_MAX_INTERVAL_SECONDS", 15))
+# a data session that is not ready by then is given up on
+FETCH_TIMEOUT_SECONDS = float(os.getenv("FETCH_TIMEOUT_SECONDS", 300))
+# a job whose owner has not renewed its lease for this long is re-queued by another process;
+# leases are renewed, and expired ones looked for, every third of it
+FETCH_LEASE_SECONDS = float(os.getenv("FETCH_LEASE_SECONDS", 60))
+
+# Setu data session statuses
+READY_STATUSES = {"COMPLETED", "PARTIAL"}
+FAILED_STATUSES = {"FAILED", "EXPIRED", "REJECTED"}
+ACTIVE_JOB_STATUSES = ["queued", "waiting", "processing"]
+
+
+class QueueFull(Exception):
+    pass
+
+
+class SessionFailed(Exception):
+    pass
+
+
+def job_view(job):
+    view = {
+        "job_id": str(job["_id"]),
+        "session_id": job["session_id"],
+        "status": job["status"],
+        "setu_status": job.get("setu_status"),
+        "polls": job.get("polls", 0),
+        "created_at": job["created_at"].isoformat(),
+        "updated_at": job["updated_at"].isoformat(),
+    }
+    if job.get("result"):
+        view["ids"] = job["result"]
+    if job.get("error"):
+        view["error"] = job["error"]
+    return view
+
+
+class FetchJobQueue:
+    def __init__(self, jobs, setu, process, workers=FETCH_WORKERS, maxsize=FETCH_QUEUE_SIZE, on_finished=None):
+        # process(data) stores the analytics of one FI session response and returns the ids;
+        # on_finished(job), when given, is awaited with every job that is done or failed
+        self.jobs = jobs
+        self.setu = setu
+        self.process = process
+        self.on_finished = on_finished
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize)
+        self._admitting = 0
+        self._session_ready = {}
+        self._tasks = []
+        # unique per process, a restarted container can get its old pid back
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{ObjectId()}"
+        self.metrics = {"accepted": 0, "rejected": 0, "done": 0, "failed": 0, "busy_workers": 0, "recovered": 0}
+
+    def _lease(self):
+        return datetime.now(timezone.utc) + timedelta(seconds=FETCH_LEASE_SECONDS)
+
+    async def _update(self, job_id, **fields):
+        fields["updated_at"] = datetime.now(timezone.utc)
+        await self.jobs.update_one({"_id": job_id}, {"$set": fields})
+
+    async def _finish(self, job, **fields):
+        fields["updated_at"] = datetime.now(timezone.utc)
+        # no longer the session's active job, a new fetch of the session may start one
+        await self.jobs.update_one({"_id": job["_id"]}, {"$set": fields, "$unset": {"active": ""}})
+        if self.on_finished:
+            await self.on_finished({**job, **fields})
+
+    async def submit(self, session_id):
+        # one active job per session, a client that retries gets the same job back. Jobs are
+        # flagged active until they finish and the unique index on (session_id, active) in
+        # common/db.py settles concurrent submits of one session
+        existing = await self.jobs.find_one({"session_id": session_id, "status": {"$in": ACTIVE_JOB_STATUSES}})
+        if existing:
+            return existing
+        # slots being admitted count as taken, the insert below yields to other requests
+        if self.queue.qsize() + self._admitting >= self.queue.maxsize:
+            self.metrics["rejected"] += 1
+            raise QueueFull()
+        self._admitting += 1
+        try:
+            now = datetime.now(timezone.utc)
+            job = {
+                "session_id": session_id, "status": "queued", "active": True, "polls": 0,
+                "owner": self.owner, "lease_expires_at": self._lease(), "created_at": now, "updated_at": now,
+            }
+            try:
+                await self.jobs.insert_one(job)
+            except DuplicateKeyError:
+                # another request of the same session got its job in first
+                return await self.jobs.find_one({"session_id": session_id}, sort=[("created_at", -1)])
+            self.queue.put_nowait(job["_id"])
+        finally:
+            self._admitting -= 1
+        self.metrics["accepted"] += 1
+        return job
+
+    async def get(self, job_id):
+        return await self.jobs.find_one({"_id": ObjectId(job_id)})
+
+    async def wait_until_ready(self, job_id, session_id):
+        deadline = time.monotonic() + FETCH_TIMEOUT_SECONDS
+        interval = FETCH_POLL_INTERVAL_SECONDS
+        polls = 0
+        ready = self._session_ready.setdefault(session_id, asyncio.Event())
+        try:
+            while True:
+                res = await self.setu.get(f"/sessions/{session_id}")
+                data = res.json()
+                polls += 1
+                status = data.get("status")
+                if res.status_code < 400 and status in READY_STATUSES:
+                    await self._update(job_id, status="processing", setu_status=status, polls=polls)
+                    return data
+                if status in FAILED_STATUSES:
+                    raise SessionFailed(f"data session {status}")
+                if time.monotonic() + interval > deadline:
+                    raise SessionFailed(f"data session not ready after {FETCH_TIMEOUT_SECONDS:.0f}s (last status {status})")
+                await self._update(job_id, status="waiting", setu_status=status, polls=polls)
+                # a session notification (notify_session) cuts the wait short
+                try:
+                    await asyncio.wait_for(ready.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+                ready.clear()
+                interval = min(interval * 2, FETCH_POLL_MAX_INTERVAL_SECONDS)
+        finally:
+            self._session_ready.pop(session_id, None)
+
+    def notify_session(self, session_id):
+        # Setu said the data session changed, poll it now instead of after the backoff
+        ready = self._session_ready.get(session_id)
+        if ready:
+            ready.set()
+            return True
+        return False
+
+    async def run_job(self, job_id):
+        job = await self.jobs.find_one({"_id": job_id})
+        if not job or job["status"] not in ACTIVE_JOB_STATUSES:
+            return
+        if job.get("owner") != self.owner:
+            # our lease ran out while the job sat in the queue and another replica took it
+            return
+        try:
+            data = await self.wait_until_ready(job_id, job["session_id"])
+            result = await self.process(data)
+        except Exception as e:
+            self.metrics["failed"] += 1
+            logger.warning("fetch job failed", extra={"job_id": str(job_id), "session_id": job["session_id"], "error": str(e)})
+            await self._finish(job, status="failed", error=str(e))
+            return
+        self.metrics["done"] += 1
+        logger.info("fetch job done", extra={"job_id": str(job_id), **result})
+        await self._finish(job, status="done", result=result)
+
+    async def worker(self):
+        while True:
+            job_id = await self.queue.get()
+            self.metrics["busy_workers"] += 1
+            try:
+                await self.run_job(job_id)
+            except Exception as e:
+                # the job record could not be updated, keep the worker alive
+                logger.error("fetch worker error", extra={"job_id": str(job_id), "error": str(e)})
+            finally:
+                self.metrics["busy_workers"] -= 1
+                self.queue.task_done()
+
+    async def renew_leases(self):
+        # one write for every job this process has queued or is running
+        await self.jobs.update_many({"owner": self.owner, "active": True}, {"$set": {"lease_expires_at": self._lease()}})
+
+    async def recover(self):
+        # active jobs whose owner stopped renewing start over here, each taken with a single
+        # find_one_and_update so two replicas never both take the same job. Jobs from before
+        # leases have none, they count as expired once untouched for a lease. Only as many as
+        # there is room for are taken, the rest wait for the next round or another replica
+        while self.queue.qsize() + self._admitting < self.queue.maxsize:
+            now = datetime.now(timezone.utc)
+            expired = {
+                "status": {"$in": ACTIVE_JOB_STATUSES},
+                "$or": [
+                    {"lease_expires_at": {"$lt": now}},
+                    {"lease_expires_at": {"$exists": False}, "updated_at": {"$lt": now - timedelta(seconds=FETCH_LEASE_SECONDS)}},
+                ],
+            }
+            # the slot is held while the update is in flight, like in submit
+            self._admitting += 1
+            try:
+                job = await self.jobs.find_one_and_update(
+                    expired,
+                    {"$set": {"status": "queued", "owner": self.owner, "lease_expires_at": self._lease(), "updated_at": now}},
+                    sort=[("created_at", 1)],
+                )
+                if not job:
+                    return
+                self.queue.put_nowait(job["_id"])
+            finally:
+                self._admitting -= 1
+            self.metrics["recovered"] += 1
+            logger.info("recovering fetch job", extra={"job_id": str(job["_id"]), "previous_owner": job.get("owner")})
+
+    async def keep_leases(self):
+        while True:
+            try:
+                await self.renew_leases()
+                await self.recover()
+            except Exception as e:
+                logger.error("fetch job lease error", extra={"error": str(e)})
+            await asyncio.sleep(FETCH_LEASE_SECONDS / 3)
+
+    def get_metrics(self):
+        return {**self.metrics, "queued": self.queue.qsize(), "capacity": self.queue.maxsize, "workers": self.workers}
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self.keep_leases()))
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
@@ -2,133 +2,219 @@ from fastapi import FastAPI, Request # type: ignore
 from fastapi.responses import JSONResponse # type: ignore
 from fastapi.middleware.cors import CORSMiddleware # type: ignore
 from pydantic import BaseModel # type: ignore
-import httpx # type: ignore
-import os
+from typing import Optional
+import asyncio, os
 from dotenv import load_dotenv # type: ignore
 from datetime import datetime, timedelta, timezone
-import json 
-import pandas as pd  # type: ignore
-import motor.motor_asyncio  # type: ignore
+from pymongo import ReturnDocument  # type: ignore
+from pymongo.errors import DuplicateKeyError  # type: ignore
+from bson import ObjectId  # type: ignore
+from app.analytics import build_analytics, merge_states, is_current
+from app.data_process import iter_accounts, get_holder, fold_accounts, rebuild_accounts, shutdown_pool
+from app.setu_client import SetuClient
+from app.fetch_jobs import FetchJobQueue, QueueFull, job_view, FETCH_POLL_INTERVAL_SECONDS, READY_STATUSES, FAILED_STATUSES
+from app.consents import (
+    ConsentStore, consent_view, notification_authorized, notifications_configured, CONSENT_WAIT_MAX_SECONDS, SETU_CHECK_SECONDS,
+    PENDING_CONSENT_STATUS, ACTIVE_CONSENT_STATUS, CONSENT_NOTIFICATION, SESSION_NOTIFICATIONS,
+)
+from common.db import Database
+from common.observability import install_observability, timed
+from common.serialization import to_native
 
 load_dotenv()
 URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME")
-client = motor.motor_asyncio.AsyncIOMotorClient(URI)
-db = client[DB_NAME]
-user_profiles = db["user_profiles"]
-bank_analytics_list = db["bank_analytics"]
+db = Database(URI, DB_NAME, appname="aa-service")
+user_profiles = db.collection("user_profiles")
+bank_analytics_list = db.collection("bank_analytics")
+bank_analytics_state = db.collection("bank_analytics_state")
+fetch_jobs = db.collection("fetch_jobs")
+consents = db.collection("consents")
 
-async def set_analytics():
+async def get_or_create_user(user_profile):
+    # the same holder coming back through a new data session keeps its user id. Holders are
+    # recognised by PAN, or by mobile when there is no PAN; the unique indexes in common/db.py
+    # make concurrent sessions of one holder end up with a single profile
+    profile = {field: value for field, value in user_profile.items() if field != "_id"}
+    if profile.get("pan"):
+        key = {"pan": profile["pan"]}
+    elif profile.get("mobile"):
+        key = {"mobile": profile["mobile"], "keyed_by": "mobile"}
+    else:
+        # nothing to recognise the holder by, it must not be merged into someone else
+        result = await user_profiles.insert_one(profile)
+        return result.inserted_id
+    try:
+        doc = await user_profiles.find_one_and_update(
+            key, {"$setOnInsert": {**profile, **key}}, projection={"_id": 1}, upsert=True, return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # a concurrent session of the same holder inserted it between our lookup and insert
+        doc = await user_profiles.find_one(key, {"_id": 1})
+    return doc["_id"]
 
-    
-    bank_analytics = {}
-    with open("raw_txns.json","r") as f:
-        data = json.load(f)
-    
-    user_profile = data.get("fips")[0].get("accounts")[0].get("data").get("account").get("profile").get("holders").get("holder")[0]
+async def set_analytics(data):
+    user_profile = get_holder(data)
+    user_id = await get_or_create_user(user_profile)
 
-    result = await user_profiles.insert_one(user_profile)
+    # every account of every FIP in the consent, archived and folded in parallel in the
+    # analytics process pool
+    accounts = {
+        account_key: account_data.get("transactions").get("transaction")
+        for account_key, account_data in iter_accounts(data)
+    }
+    state_docs = await bank_analytics_state.find({"user_id": user_id}).to_list(length=None)
+    states = {doc["account_key"]: doc["state"] for doc in state_docs}
+    for account_key, state in states.items():
+        # states from before the year-month buckets are folded again from the archive
+        if not is_current(state):
+            accounts.setdefault(account_key, [])
+    states = {account_key: state for account_key, state in states.items() if is_current(state)}
+    with timed("analytics"):
+        results = await fold_accounts(user_id, accounts, states)
+    return await store_analytics(user_id, results, states)
 
-    # creating bank transactions analytics 
-    transaction_list = data.get("fips")[0].get("accounts")[0].get("data").get("account").get("transactions").get("transaction")
-    df = pd.DataFrame(transaction_list)
-    df["amount"] = df["amount"].astype(float)
-    df["currentBalance"] = df["currentBalance"].astype(float)
+async def store_analytics(user_id, results, states):
+    # documents are written with plain python numbers (no numpy scalars), so every reader
+    # and the response encoders get native types back
+    for account_key, (state, account_analytics, added) in results.items():
+        state, account_analytics = to_native(state), to_native(account_analytics)
+        logger.info("folded new transactions", extra={"user_id": str(user_id), "account_key": account_key, "added": added})
+        states[account_key] = state
+        await bank_analytics_state.replace_one(
+            {"user_id": user_id, "account_key": account_key},
+            {"user_id": user_id, "account_key": account_key, "state": state, "analytics": account_analytics},
+            upsert=True,
+        )
 
-    total_credit = df[df["type"]=="CREDIT"]["amount"].sum()
-    bank_analytics["total_credit"] = total_credit
+    # consolidated per-user view over all accounts, including ones from earlier consents
+    bank_analytics = to_native(build_analytics(merge_states(states.values())))
+    bank_analytics["user_id"] = user_id
+    # credit-engine re-materializes risk data for analytics written after its last run
+    bank_analytics["updated_at"] = datetime.now(timezone.utc)
+    result_analytics = await bank_analytics_list.find_one_and_replace(
+        {"user_id": user_id},
+        bank_analytics,
+        projection={"_id": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return { "user_id" : str(user_id) , "bank_analytics_id" : str(result_analytics["_id"])}
 
-    total_debit = df[df["type"]=="DEBIT"]["amount"].sum()
-    bank_analytics["total_debit"] = total_debit
 
-    debit_to_credit_ratio = total_debit / total_credit if total_credit != 0 else 0
-    bank_analytics["debit_to_credit_ratio"] = debit_to_credit_ratio
+app = FastAPI()
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+db.install(app)
+logger = install_observability(app, "aa-service")
 
-    average_tx_amount = df["amount"].mean()
-    bank_analytics["average_tx_amount"] = average_tx_amount
+@app.on_event("shutdown")
+async def stop_analytics_pool():
+    shutdown_pool()
 
-    df['txn_date'] = pd.to_datetime(df['transactionTimestamp'])
-    df['month_name'] = df['txn_date'].dt.strftime('%B')
+setu = SetuClient()
 
-    df_credit = df[df["type"]=="CREDIT"]
-    df_debit = df[df["type"]=="DEBIT"]
+@app.on_event("shutdown")
+async def close_setu_client():
+    await setu.close()
 
-    monthly_inflow = df_credit.groupby('month_name')['amount'].sum().reset_index(name='monthly_inflow')
-    monthly_outflow = df_debit.groupby('month_name')['amount'].sum().reset_index(name='monthly_outflow')
-    monthly_balance = df.groupby('month_name')['currentBalance'].mean().reset_index(name='monthly_balance')
-    monthly_cashflow = pd.merge(monthly_inflow, monthly_outflow, on='month_name', how='outer').fillna(0)
-    monthly_data = pd.merge(monthly_cashflow, monthly_balance, on='month_name', how='outer').fillna(0)
-    obj = monthly_data.to_dict(orient='records')
-    bank_analytics["monthly_data"] = obj
+async def record_job_finished(job):
+    # the onboarding long-poll returns with the analytics ids as soon as the fetch is done
+    consent = await consent_store.find_by_session(job["session_id"])
+    if consent:
+        await consent_store.update(consent["_id"], job_status=job["status"], ids=job.get("result"), error=job.get("error"))
 
-    average_monthly_inflow = monthly_cashflow['monthly_inflow'].mean()
-    bank_analytics["average_monthly_inflow"] = average_monthly_inflow
-    average_monthly_outflow = monthly_cashflow['monthly_outflow'].mean()
-    bank_analytics["average_monthly_outflow"] = average_monthly_outflow
+fetch_queue = FetchJobQueue(fetch_jobs, setu, set_analytics, on_finished=record_job_finished)
 
-    monthly_cashflow['monthly_cashflow'] = monthly_cashflow['monthly_inflow'] - monthly_cashflow['monthly_outflow'] 
-# print(monthly_cashflow)
+@app.on_event("startup")
+async def start_fetch_queue():
+    fetch_queue.start()
 
-    average_monthly_cashflow = monthly_cashflow['monthly_cashflow'].mean()
-    bank_analytics["average_monthly_cashflow"] = average_monthly_cashflow
+@app.on_event("shutdown")
+async def stop_fetch_queue():
+    fetch_queue.stop()
 
-    std_ncf = monthly_cashflow['monthly_cashflow'].std()
-    mean_ncf = monthly_cashflow['monthly_cashflow'].mean()
-    cash_flow_stability = 1 - (std_ncf/mean_ncf) if mean_ncf > 0 else 0 # if negetive cashflow then do not use 
-    bank_analytics["cash_flow_stability"] = cash_flow_stability
+consent_store = ConsentStore(consents)
+# how long /create-session waits for a data session that is already being opened
+SESSION_WAIT_SECONDS = 10
 
-    minimum_maintained_balance = df["currentBalance"].min()
-    bank_analytics["minmum_maintained_balance"] = minimum_maintained_balance
+@app.on_event("shutdown")
+async def stop_consent_tasks():
+    consent_store.stop()
 
-    balance_voltality = df["currentBalance"].std() / df["currentBalance"].mean()
-    bank_analytics["balance_voltality"] = balance_voltality# lower the volatility is good 0.2 < is good 
+async def create_data_session(consent_id):
+    now = datetime.now(timezone.utc) - timedelta(days=1)
+    one_year_ago = now - timedelta(days=363)
+    from_timestamp = one_year_ago.isoformat(timespec='seconds').replace('+00:00', 'Z')
+    to_timestamp = now.isoformat(timespec='seconds').replace('+00:00', 'Z')
+    session_create_payload = {
+            "consentId": consent_id,
+            "dataRange": {
+                "from": from_timestamp,
+                "to": to_timestamp
+            },
+            "format": "json"
+        }
+    return await setu.post("/sessions", json=session_create_payload)
 
-    average_maintained_balance = df["currentBalance"].mean()
-    bank_analytics["average_maintained_balance"] = average_maintained_balance
+async def start_data_fetch(consent_id):
+    # the consent went ACTIVE: open the data session and queue its fetch, the fetch job
+    # picks the data up once Setu notifies that the session is ready
+    try:
+        res = await create_data_session(consent_id)
+        session = res.json()
+        if res.status_code >= 400 or not session.get("id"):
+            raise ValueError(f"data session not created: {session}")
+        await consent_store.update(consent_id, session_id=session["id"], session_status=session.get("status"))
+        while True:
+            try:
+                job = await fetch_queue.submit(session["id"])
+                break
+            except QueueFull:
+                await asyncio.sleep(FETCH_POLL_INTERVAL_SECONDS * 5)
+        await consent_store.update(consent_id, job_id=str(job["_id"]))
+    except Exception as e:
+        # the next ACTIVE notification or status check tries again
+        logger.warning("could not start data fetch", extra={"consent_id": consent_id, "error": str(e)})
+        await consent_store.release_session(consent_id, str(e))
 
-    cash_txns = df[df['mode']=="CASH"]
-    bank_analytics["cash_tx_ratio"] = len(cash_txns)/len(df)
-    bank_analytics["user_id"] = result.inserted_id 
-    result_analytics = await bank_analytics_list.insert_one(bank_analytics)
-    return { "user_id" : str(result.inserted_id) , "bank_analytics_id" : str(result_analytics.inserted_id)}
+async def wait_for_session(consent_id, timeout=SESSION_WAIT_SECONDS):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    consent = await consent_store.get(consent_id)
+    while consent and not consent.get("session_id") and loop.time() < deadline:
+        consent = await consent_store.wait(consent_id, consent.get("version", 0), deadline - loop.time())
+    return consent
 
+async def record_consent_status(consent_id, status):
+    consent = await consent_store.get(consent_id)
+    if consent is None or consent.get("status") != status:
+        # a check that finds the status unchanged is no change, long-polls keep waiting
+        consent = await consent_store.update(consent_id, status=status)
+    if status == ACTIVE_CONSENT_STATUS and await consent_store.claim_session(consent_id):
+        consent_store.spawn(start_data_fetch(consent_id))
+    return consent
+
+async def check_consent_with_setu(consent_id):
+    consent_store.metrics["setu_checks"] += 1
+    res = await setu.get(f"/consents/{consent_id}")
+    consent_obj = res.json()
+    if res.status_code < 400 and consent_obj.get("status"):
+        await record_consent_status(consent_id, consent_obj["status"])
+    return res, consent_obj
 
-app = FastAPI()
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-SETU_TOKEN_URL = os.getenv("SETU_TOKEN_URL") 
-SETU_BASE_URL = os.getenv("SETU_BASE_URL")
-SETU_PRODUCT_ID = os.getenv("SETU_PRODUCT_ID")
 class PhoneInput(BaseModel):
     phone: str
 
 # create consent endpoint 
 @app.post("/create-consent")
 async def create_consent(data : PhoneInput):
-   phone = data.phone
-   async with httpx.AsyncClient() as client:
-       # Step 1 : Get Auth Token 
-        res = await client.post(
-            f"{SETU_TOKEN_URL}",
-            headers = {"client": "bridge"},
-            json = {
-                "clientID": os.getenv("SETU_CLIENT_ID"),
-	            "grant_type": "client_credentials",
-	            "secret": os.getenv("SETU_CLIENT_SECRET")
-            }
-        )
-        if res.text :
-            print("got the token")
-            with open("token.json","w") as f:
-                f.write(res.text)
-            with open("token.json","r") as f:
-                token=json.load(f)
-
-        # Step 2: Create Consent
+        phone = data.phone
+        # the auth token comes from the shared in-memory cache in app/setu_client.py
         now = datetime.now(timezone.utc)
         one_year_ago = now - timedelta(days=365)
         from_timestamp = one_year_ago.isoformat(timespec='seconds').replace('+00:00', 'Z')
@@ -152,15 +238,11 @@ async def create_consent(data : PhoneInput):
             ]
         }
 
-        consent_resp = await client.post(
-            f"{SETU_BASE_URL}/consents",
-            headers={
-                "Authorization" : "Bearer "+ token["access_token"],
-                "x-product-instance-id": SETU_PRODUCT_ID
-            },
-            json=consent_payload
-        )
-        consent_obj = json.loads(consent_resp.text)
+        consent_resp = await setu.post("/consents", json=consent_payload)
+        consent_obj = consent_resp.json()
+        if consent_resp.status_code < 400 and consent_obj.get("id"):
+            # from here on Setu notifications keep the local record current
+            await consent_store.update(consent_obj["id"], status=consent_obj.get("status", PENDING_CONSENT_STATUS), phone=phone)
         res = {
             "id":consent_obj.get("id"),
             "url":consent_obj.get("url")
@@ -169,70 +251,138 @@ async def create_consent(data : PhoneInput):
 
 @app.get("/get-consent-status/{consent_id}")
 async def get_consent_status(consent_id : str):
-    async with httpx.AsyncClient() as client:
-        with open("token.json","r") as f:
-            token = json.load(f)
-        consent_check_res = await client.get(
-            f"{SETU_BASE_URL}/consents/{consent_id}",
-            headers={
-                "Authorization" : "Bearer "+ token["access_token"],
-                "x-product-instance-id": SETU_PRODUCT_ID
-            }
-        )
-        consent_check_obj = json.loads(consent_check_res.text)
-        return JSONResponse(content=consent_check_obj)
+        # answered from the local record once a notification moved the consent on; a pending
+        # or unknown consent is still checked with Setu, for setups without notifications
+        consent = await consent_store.get(consent_id)
+        if consent and consent.get("status") != PENDING_CONSENT_STATUS:
+            return JSONResponse(content=consent_view(consent))
+        consent_check_res, consent_check_obj = await check_consent_with_setu(consent_id)
+        return JSONResponse(status_code=consent_check_res.status_code, content=consent_check_obj)
+
+# long-poll: answers as soon as the consent record moves past `version` (status, data
+# session or fetch job), or with the current record after `timeout` seconds
+@app.get("/consents/{consent_id}/wait")
+async def wait_for_consent(consent_id : str, version : int = 0, timeout : float = CONSENT_WAIT_MAX_SECONDS):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(timeout, CONSENT_WAIT_MAX_SECONDS)
+        # a pending consent is checked with Setu every SETU_CHECK_SECONDS when no notification
+        # will tell us it was approved, otherwise once as the long-poll runs out
+        check_every = CONSENT_WAIT_MAX_SECONDS if notifications_configured() else SETU_CHECK_SECONDS
+        while True:
+            consent = await consent_store.wait(consent_id, version, min(check_every, max(deadline - loop.time(), 0)))
+            if consent is None:
+                res, consent_obj = await check_consent_with_setu(consent_id)
+                if res.status_code >= 400:
+                    return JSONResponse(status_code=404, content={"error": "Consent not found"})
+                consent = await consent_store.get(consent_id)
+                if consent is None:
+                    # Setu answered without a status, so nothing was recorded locally
+                    return JSONResponse(status_code=res.status_code, content=consent_obj)
+                return JSONResponse(content=consent_view(consent))
+            if consent.get("version", 0) == version and consent.get("status") == PENDING_CONSENT_STATUS:
+                await check_consent_with_setu(consent_id)
+                consent = await consent_store.get(consent_id)
+            if consent.get("version", 0) != version or loop.time() >= deadline:
+                return JSONResponse(content=consent_view(consent))
+
+# Setu consent / data session notifications
+@app.post("/setu-notifications")
+async def setu_notification(request : Request, token : Optional[str] = None):
+        if not notification_authorized(token):
+            consent_store.metrics["unauthorized"] += 1
+            return JSONResponse(status_code=401, content={"success": False, "error": "Unauthorized"})
+        consent_store.metrics["notifications"] += 1
+        notification = await request.json()
+        kind = notification.get("type")
+        status = (notification.get("data") or {}).get("status")
+        consent_id = notification.get("consentId")
+        logger.info("setu notification", extra={"type": kind, "consent_id": consent_id, "status": status})
+        if kind == CONSENT_NOTIFICATION and consent_id and status:
+            await record_consent_status(consent_id, status)
+        elif kind in SESSION_NOTIFICATIONS:
+            session_id = notification.get("dataSessionId")
+            consent = await consent_store.find_by_session(session_id) if session_id else None
+            if consent:
+                await consent_store.update(consent["_id"], session_status=status)
+            if status in READY_STATUSES or status in FAILED_STATUSES:
+                fetch_queue.notify_session(session_id)
+        return {"success": True}
+
+@app.get("/consent-metrics")
+async def get_consent_metrics():
+        return consent_store.get_metrics()
     
 @app.get("/create-session/{consent_id}")
 async def fetch_data(consent_id : str):
-    async with httpx.AsyncClient() as client:
-        with open("token.json","r") as f:
-            token = json.load(f)
+        # a consent that went ACTIVE already has its data session opened by start_data_fetch,
+        # hand that one back instead of opening a second
+        claimed = await consent_store.claim_session(consent_id)
+        if not claimed:
+            consent = await wait_for_session(consent_id)
+            if consent and consent.get("session_id"):
+                return JSONResponse(content={"id": consent["session_id"], "status": consent.get("session_status")})
+            if consent:
+                # the other creator is still at it, a second Setu session would orphan one of them
+                return JSONResponse(
+                    status_code=409,
+                    headers={"Retry-After": str(SESSION_WAIT_SECONDS)},
+                    content={"error": "A data session is already being created for this consent, retry shortly"},
+                )
+            # no local record of this consent (never seen by /create-consent), nothing to claim
         # create new data session 
-        now = datetime.now(timezone.utc) - timedelta(days=1)
-        one_year_ago = now - timedelta(days=363)
-        from_timestamp = one_year_ago.isoformat(timespec='seconds').replace('+00:00', 'Z')
-        to_timestamp = now.isoformat(timespec='seconds').replace('+00:00', 'Z')
-        session_create_payload = {
-                "consentId": consent_id,
-                "dataRange": {
-                    "from": from_timestamp,
-                    "to": to_timestamp
-                },
-                "format": "json"
-            }
-        session_create_res = await client.post(
-                f"{SETU_BASE_URL}/sessions",
-                headers={
-                    "Authorization" : "Bearer "+ token["access_token"],
-                    "x-product-instance-id": SETU_PRODUCT_ID
-                },
-                json=session_create_payload
-            )
-        session_create_obj = json.loads(session_create_res.text)
-        print(session_create_obj)
+        try:
+            session_create_res = await create_data_session(consent_id)
+            session_create_obj = session_create_res.json()
+        except Exception as e:
+            if claimed:
+                await consent_store.release_session(consent_id, str(e))
+            raise
+        if session_create_res.status_code < 400 and session_create_obj.get("id"):
+            await consent_store.update(consent_id, session_id=session_create_obj["id"], session_status=session_create_obj.get("status"))
+        elif claimed:
+            # let the next /create-session or ACTIVE notification try again
+            await consent_store.release_session(consent_id, f"data session not created: {session_create_obj}")
+        logger.debug("session created: %s", session_create_obj)
         return JSONResponse(content=session_create_obj)
 
 
 @app.get("/fetch-data/{session_id}")
 async def fetch_data(session_id :str):
-    async with httpx.AsyncClient() as client:
-        with open("token.json","r") as f:
-            token = json.load(f)
-        # fetch data using the session id 
-        FI_data_res =await client.get(
-                f"{SETU_BASE_URL}/sessions/{session_id}",
-                headers={
-                    "Authorization" : "Bearer "+ token["access_token"],
-                    "x-product-instance-id": SETU_PRODUCT_ID
-                }
+        # queue the fetch, a worker waits for the data session and stores the analytics
+        # (app/fetch_jobs.py); poll /fetch-jobs/{job_id} for the result
+        try:
+            job = await fetch_queue.submit(session_id)
+        except QueueFull:
+            return JSONResponse(
+                status_code=503,
+                headers={"Retry-After": str(int(FETCH_POLL_INTERVAL_SECONDS * 5))},
+                content={"error": "Too many fetches in progress, retry shortly"},
             )
-        print(FI_data_res.text)
-        with open("raw_txns.json","w") as f:
-            f.write(FI_data_res.text)
-        print(FI_data_res.text)
-        res = await set_analytics() 
-        print(res) 
-        return JSONResponse(content={"message" : "Data Fetched Successfully , Analytics Available in database...","ids":res})
+        return JSONResponse(status_code=202, content={"message" : "Fetch queued", "job_id": str(job["_id"]), "status": job["status"]})
+
+@app.get("/fetch-jobs/{job_id}")
+async def get_fetch_job(job_id : str):
+        job = await fetch_queue.get(job_id)
+        if not job:
+            return JSONResponse(status_code=404, content={"error": "Job not found"})
+        return JSONResponse(content=job_view(job))
+
+@app.get("/fetch-job-metrics")
+async def get_fetch_job_metrics():
+        return fetch_queue.get_metrics()
+
+# recompute a user's analytics from the archived transactions, without a new data session
+@app.post("/reanalyze/{user_id}")
+async def reanalyze(user_id : str):
+        user_obj_id = ObjectId(user_id)
+        state_docs = await bank_analytics_state.find({"user_id": user_obj_id}).to_list(length=None)
+        states = {doc["account_key"]: doc["state"] for doc in state_docs if is_current(doc["state"])}
+        with timed("analytics"):
+            results = await rebuild_accounts(user_obj_id)
+        if not results:
+            return JSONResponse(status_code=404, content={"error": "No archived transactions for this user"})
+        res = await store_analytics(user_obj_id, results, states)
+        return JSONResponse(content={"message" : "Analytics recomputed from the archive","ids":res})
         
 @app.get("/")
 async def check_aa_service():
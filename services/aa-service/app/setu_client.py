@@ -0,0 +1,107 @@
+import asyncio, base64, json, logging, os, time
+from common.observability import httpx_event_hooks
+
+# one long-lived, pooled httpx client for every Setu call, and the client-credentials token
+# kept in memory. The token is refreshed shortly before it expires, and concurrent callers
+# that find it stale wait on the same refresh instead of each fetching their own
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_TTL_SECONDS = 1800
+TOKEN_REFRESH_MARGIN_SECONDS = 60
+
+
+def token_expiry(token):
+    # prefer expires_in, fall back to the exp claim of the JWT, then to a fixed ttl
+    if token.get("expires_in"):
+        return time.time() + float(token["expires_in"])
+    try:
+        payload = token["access_token"].split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, ValueError):
+        return time.time() + DEFAULT_TOKEN_TTL_SECONDS
+
+
+class SetuClient:
+    def __init__(self, base_url=None, token_url=None, product_id=None, client_id=None, client_secret=None):
+        # settings are read when the client is built, after main.py has called load_dotenv
+        self.base_url = base_url or os.getenv("SETU_BASE_URL")
+        self.token_url = token_url or os.getenv("SETU_TOKEN_URL")
+        self.product_id = product_id or os.getenv("SETU_PRODUCT_ID")
+        self.client_id = client_id or os.getenv("SETU_CLIENT_ID")
+        self.client_secret = client_secret or os.getenv("SETU_CLIENT_SECRET")
+        self.max_connections = int(os.getenv("SETU_MAX_CONNECTIONS", 100))
+        self.max_keepalive_connections = int(os.getenv("SETU_MAX_KEEPALIVE", 20))
+        self.timeout = float(os.getenv("SETU_TIMEOUT_SECONDS", 30))
+        self._client = None
+        self._token = None
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            # imported here so the service starts without paying for httpx before the first Setu call
+            import httpx  # type: ignore
+
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_keepalive_connections),
+                timeout=self.timeout,
+                event_hooks=httpx_event_hooks(),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _token_valid(self):
+        return self._token is not None and time.time() < self._token_expires_at - TOKEN_REFRESH_MARGIN_SECONDS
+
+    async def get_token(self, rejected=None):
+        # rejected is a token Setu answered 401 to, it is refreshed even if not expired yet
+        if self._token_valid() and self._token != rejected:
+            return self._token
+        async with self._token_lock:
+            # someone else refreshed while we were waiting for the lock
+            if self._token_valid() and self._token != rejected:
+                return self._token
+            res = await self.client.post(
+                self.token_url,
+                headers={"client": "bridge"},
+                json={
+                    "clientID": self.client_id,
+                    "grant_type": "client_credentials",
+                    "secret": self.client_secret,
+                },
+            )
+            res.raise_for_status()
+            token = res.json()
+            self._token = token["access_token"]
+            self._token_expires_at = token_expiry(token)
+            logger.info("got the token", extra={"expires_at": self._token_expires_at})
+            return self._token
+
+    async def request(self, method, path, **kwargs):
+        token = await self.get_token()
+        res = await self._send(method, path, token, **kwargs)
+        if res.status_code == 401:
+            # token revoked or expired early, refresh once and retry
+            token = await self.get_token(rejected=token)
+            res = await self._send(method, path, token, **kwargs)
+        return res
+
+    async def _send(self, method, path, token, **kwargs):
+        headers = {
+            "Authorization": "Bearer " + token,
+            "x-product-instance-id": self.product_id,
+        }
+        return await self.client.request(method, f"{self.base_url}{path}", headers=headers, **kwargs)
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
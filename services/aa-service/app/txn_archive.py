@@ -0,0 +1,219 @@
+import numpy as np  # type: ignore
+import fcntl, json, os, shutil, uuid
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+from app.analytics import parse_timestamp
+from app.categories import RULEBOOK_VERSION, categorize
+
+# per-user, per-account archive of every transaction received from Setu, in place of the
+# single raw_txns.json that each fetch used to overwrite. Each append writes one immutable
+# segment directory of .npy columns: typed amounts, timestamps as epoch microseconds plus
+# the original utc offset, type/mode dictionary-encoded to uint8 and the free-text columns
+# as one utf-8 blob with offsets, plus the category of every row (app/categories.py).
+# Segments are opened with mmap, so folding analytics over them reads the pages directly
+# instead of parsing anything
+#
+#   <TXN_ARCHIVE_DIR>/<user_id>/<quoted account_key>/seg-000001/{meta.json, ts.npy, ...}
+
+TXN_ARCHIVE_DIR = os.getenv("TXN_ARCHIVE_DIR", "txn_archive")
+
+CODED_COLUMNS = ("type", "mode")
+STRING_COLUMNS = ("txn_id", "narration", "reference")
+
+
+class StringColumn:
+    # arrow-style variable width strings: row i is data[offsets[i]:offsets[i + 1]]
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode()
+
+    def take(self, indices):
+        return [self[i] for i in indices]
+
+    def tolist(self):
+        return self.take(range(len(self)))
+
+    @classmethod
+    def from_strings(cls, values):
+        encoded = [value.encode() for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+
+def to_columns(transactions):
+    # the only place a transaction's JSON is parsed; rows are sorted by time
+    rows = []
+    for txn in transactions:
+        ts = parse_timestamp(txn["transactionTimestamp"])
+        rows.append((ts, txn))
+    rows.sort(key=lambda row: row[0])
+
+    columns = {
+        "ts": np.array([round(ts.timestamp() * 1_000_000) for ts, _ in rows], dtype=np.int64),
+        "utc_offset": np.array([ts.utcoffset().total_seconds() // 60 for ts, _ in rows], dtype=np.int16),
+        "amount": np.array([float(txn["amount"]) for _, txn in rows], dtype=np.float64),
+        "balance": np.array([float(txn["currentBalance"]) for _, txn in rows], dtype=np.float64),
+    }
+    dictionaries = {}
+    for name in CODED_COLUMNS:
+        values = [txn.get(name) or "" for _, txn in rows]
+        dictionaries[name] = sorted(set(values))
+        codes = {value: code for code, value in enumerate(dictionaries[name])}
+        columns[name] = np.array([codes[value] for value in values], dtype=np.uint8)
+    for name, key in zip(STRING_COLUMNS, ("txnId", "narration", "reference")):
+        columns[name] = StringColumn.from_strings([str(txn.get(key) or "") for _, txn in rows])
+    return columns, dictionaries
+
+
+def take_rows(columns, mask):
+    indices = np.flatnonzero(mask)
+    taken = {}
+    for name, column in columns.items():
+        taken[name] = StringColumn.from_strings(column.take(indices)) if isinstance(column, StringColumn) else column[indices]
+    return taken
+
+
+class Segment:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.dictionaries = self.meta["dictionaries"]
+        self._columns = {}
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            self._columns[name] = self._open(name)
+        return self._columns[name]
+
+    def _open(self, name):
+        if name in STRING_COLUMNS:
+            offsets = np.load(os.path.join(self.path, f"{name}.offsets.npy"), mmap_mode="r")
+            data_path = os.path.join(self.path, f"{name}.bytes")
+            # mmap cannot map an empty file
+            data = np.memmap(data_path, dtype=np.uint8, mode="r") if os.path.getsize(data_path) else np.empty(0, dtype=np.uint8)
+            return StringColumn(offsets, data)
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+
+    def code(self, column, value):
+        # the uint8 code of a dictionary value in this segment, -1 if it never occurs
+        dictionary = self.dictionaries[column]
+        return dictionary.index(value) if value in dictionary else -1
+
+
+def write_segment(path, columns, dictionaries, previous=None):
+    # written to a temporary directory and renamed, a reader never sees half a segment
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp_path)
+    try:
+        for name, column in columns.items():
+            if isinstance(column, StringColumn):
+                np.save(os.path.join(tmp_path, f"{name}.offsets.npy"), column.offsets)
+                with open(os.path.join(tmp_path, f"{name}.bytes"), "wb") as f:
+                    f.write(column.data.tobytes())
+            else:
+                np.save(os.path.join(tmp_path, f"{name}.npy"), column)
+        ts = columns["ts"]
+        max_ts = int(ts[-1])
+        max_ts_txn_ids = columns["txn_id"].take(np.flatnonzero(ts == max_ts))
+        if previous and previous["max_ts"] == max_ts:
+            # still the same instant as the segment before, keep every id seen at it
+            max_ts_txn_ids = previous["max_ts_txn_ids"] + max_ts_txn_ids
+        meta = {
+            "rows": len(ts),
+            "min_ts": int(ts[0]),
+            "max_ts": max_ts,
+            "max_ts_txn_ids": max_ts_txn_ids,
+            "dictionaries": dictionaries,
+            "rulebook": RULEBOOK_VERSION,
+        }
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        os.rename(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+class TransactionArchive:
+    def __init__(self, root=TXN_ARCHIVE_DIR):
+        self.root = root
+
+    def account_dir(self, user_id, account_key):
+        return os.path.join(self.root, str(user_id), quote(account_key, safe=""))
+
+    def accounts(self, user_id):
+        user_dir = os.path.join(self.root, str(user_id))
+        if not os.path.isdir(user_dir):
+            return []
+        return sorted(unquote(name) for name in os.listdir(user_dir) if not name.startswith("."))
+
+    def segment_paths(self, user_id, account_key):
+        account_dir = self.account_dir(user_id, account_key)
+        if not os.path.isdir(account_dir):
+            return []
+        names = sorted(name for name in os.listdir(account_dir) if name.startswith("seg-") and ".tmp-" not in name)
+        return [os.path.join(account_dir, name) for name in names]
+
+    def segments(self, user_id, account_key, since=None):
+        # since is an epoch in seconds (an analytics state watermark); segments that end
+        # before it are skipped without opening any column
+        since_us = None if since is None else round(since * 1_000_000)
+        for path in self.segment_paths(user_id, account_key):
+            segment = Segment(path)
+            if since_us is None or segment.meta["max_ts"] >= since_us:
+                yield segment
+
+    @contextmanager
+    def _locked(self, account_dir):
+        # one writer per account at a time, across worker processes as well
+        os.makedirs(account_dir, exist_ok=True)
+        with open(os.path.join(account_dir, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def append(self, user_id, account_key, transactions):
+        # every data session re-sends the whole consent range; only transactions after the
+        # newest archived one (or at that instant with an unseen txn id) become a segment
+        if not transactions:
+            return 0
+        columns, dictionaries = to_columns(transactions)
+        account_dir = self.account_dir(user_id, account_key)
+        with self._locked(account_dir):
+            paths = self.segment_paths(user_id, account_key)
+            last = None
+            if paths:
+                last = Segment(paths[-1]).meta
+                ts = columns["ts"]
+                mask = ts > last["max_ts"]
+                at_watermark = np.flatnonzero(ts == last["max_ts"])
+                if len(at_watermark):
+                    seen = set(last["max_ts_txn_ids"])
+                    mask[at_watermark] = [txn_id not in seen for txn_id in columns["txn_id"].take(at_watermark)]
+                if not mask.any():
+                    return 0
+                if not mask.all():
+                    columns = take_rows(columns, mask)
+            columns["category"] = categorize(columns, dictionaries)
+            sequence = int(os.path.basename(paths[-1])[4:]) + 1 if paths else 1
+            write_segment(os.path.join(account_dir, f"seg-{sequence:06d}"), columns, dictionaries, last)
+        return len(columns["ts"])
+
+    def size_bytes(self, user_id, account_key):
+        total = 0
+        for path in self.segment_paths(user_id, account_key):
+            total += sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        return total
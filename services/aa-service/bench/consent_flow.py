@@ -0,0 +1,114 @@
+import httpx  # type: ignore
+import argparse, asyncio, os, statistics, sys, threading, time
+import uvicorn  # type: ignore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# onboarding from consent to stored analytics, the way the UI drives it, against
+# bench/setu_stub.py. "poll" is the old flow (the UI polls /get-consent-status, then opens the
+# session and queues the fetch itself), "notify" has the stub post Setu notifications to
+# aa-service and the UI long-polls /consents/{id}/wait until the analytics are in, and
+# "longpoll" is the same UI without notifications, where the long-poll checks Setu. Reports
+# Setu calls per onboarding and the time from consent approval to the analytics being stored
+# cd services/aa-service && python bench/consent_flow.py --users 50
+
+STUB_PORT = 9101
+AA_PORT = 9102
+STUB_URL = f"http://127.0.0.1:{STUB_PORT}"
+AA_URL = f"http://127.0.0.1:{AA_PORT}"
+
+
+def serve(app, port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def wait_for_job(client, job_id, interval):
+    while True:
+        job = (await client.get(f"/fetch-jobs/{job_id}")).json()
+        if job["status"] in ("done", "failed"):
+            return job
+        await asyncio.sleep(interval)
+
+
+async def onboard_polling(client, phone, args):
+    consent = (await client.post("/create-consent", json={"phone": phone})).json()
+    while (await client.get(f"/get-consent-status/{consent['id']}")).json().get("status") != "ACTIVE":
+        await asyncio.sleep(args.poll_interval)
+    session = (await client.get(f"/create-session/{consent['id']}")).json()
+    job = (await client.get(f"/fetch-data/{session['id']}")).json()
+    return await wait_for_job(client, job["job_id"], args.poll_interval)
+
+
+async def onboard_notified(client, phone, args):
+    consent = (await client.post("/create-consent", json={"phone": phone})).json()
+    view = {"version": 0}
+    while view.get("job_status") not in ("done", "failed"):
+        view = (await client.get(f"/consents/{consent['id']}/wait", params={"version": view["version"]})).json()
+    return {"status": view["job_status"], "ids": view.get("ids")}
+
+
+async def run(flow, args):
+    import bench.setu_stub as stub
+    import app.consents as consents
+
+    stub.STUB_NOTIFICATION_URL = f"{AA_URL}/setu-notifications?token=bench" if flow == "notify" else None
+    consents.SETU_NOTIFICATION_TOKEN = "bench" if flow == "notify" else None
+    async with httpx.AsyncClient(base_url=STUB_URL) as setu, httpx.AsyncClient(base_url=AA_URL, timeout=60) as client:
+        before = (await setu.get("/stats")).json()
+        onboard = onboard_polling if flow == "poll" else onboard_notified
+
+        async def timed(i):
+            start = time.perf_counter()
+            job = await onboard(client, f"98{i:08d}", args)
+            assert job["status"] == "done", job
+            return time.perf_counter() - start - args.approve_after
+
+        latencies = await asyncio.gather(*(timed(i) for i in range(args.users)))
+        after = (await setu.get("/stats")).json()
+    calls = {name: after.get(name, 0) - before.get(name, 0) for name in after if name not in ("token", "notification")}
+    total = sum(calls.values())
+    print(
+        f"{flow:<7} setu calls/onboarding {total / args.users:6.1f}   after approval p50 {statistics.median(latencies) * 1000:7.0f} ms"
+        f"   max {max(latencies) * 1000:7.0f} ms   {calls}"
+    )
+
+
+def main(args):
+    from mongomock_motor import AsyncMongoMockClient  # type: ignore
+    import bench.setu_stub as stub
+    import app.main as main
+
+    main.db._client = AsyncMongoMockClient()
+    serve(stub.app, STUB_PORT)
+    serve(main.app, AA_PORT)
+    for flow in args.flows.split(","):
+        asyncio.run(run(flow, args))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="consent to analytics onboarding against the Setu stub")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--flows", default="poll,longpoll,notify")
+    parser.add_argument("--approve-after", type=float, default=6, help="seconds until the user approves the consent")
+    parser.add_argument("--ready-after", type=float, default=3, help="seconds a data session stays PENDING")
+    parser.add_argument("--poll-interval", type=float, default=3, help="UI polling interval of the old flow")
+    args = parser.parse_args()
+
+    # read by the stub, SetuClient and app/fetch_jobs.py at import
+    os.environ.update({
+        "STUB_CONSENT_APPROVE_SECONDS": str(args.approve_after),
+        "STUB_SESSION_READY_SECONDS": str(args.ready_after),
+        "SETU_BASE_URL": STUB_URL,
+        "SETU_TOKEN_URL": f"{STUB_URL}/token",
+        "SETU_PRODUCT_ID": "bench",
+        "SETU_NOTIFICATION_TOKEN": "bench",
+        "DB_NAME": "consent_flow_bench",
+        "LOG_LEVEL": "WARNING",
+    })
+    os.environ.setdefault("TXN_ARCHIVE_DIR", os.path.join("/tmp", "consent-flow-archive"))
+    main(args)
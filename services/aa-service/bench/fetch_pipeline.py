@@ -0,0 +1,106 @@
+import httpx  # type: ignore
+import argparse, asyncio, os, statistics, sys, threading, time
+import uvicorn  # type: ignore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# end to end run of the fetch job pipeline: aa-service (in process, on mongomock) against
+# bench/setu_stub.py with data sessions that stay PENDING for a while. Reports how long
+# /fetch-data takes to answer, how long until each job is done, and how many fetches the
+# queue turned away
+# cd services/aa-service && python bench/fetch_pipeline.py --sessions 200 --queue-size 50
+
+PORT = 9101
+STUB_URL = f"http://127.0.0.1:{PORT}"
+
+
+def start_stub():
+    from bench.setu_stub import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def percentiles(values):
+    values = sorted(values)
+    return statistics.median(values) * 1000, values[max(int(len(values) * 0.99) - 1, 0)] * 1000
+
+
+async def main(n_sessions):
+    from mongomock_motor import AsyncMongoMockClient  # type: ignore
+    import app.main as main
+
+    main.db._client = AsyncMongoMockClient()
+    transport = httpx.ASGITransport(app=main.app)
+    # lifespan_context runs the startup / shutdown hooks, which ASGITransport does not
+    async with main.app.router.lifespan_context(main.app), httpx.AsyncClient(transport=transport, base_url="http://aa-service") as client:
+        session_ids = []
+        for i in range(n_sessions):
+            res = await client.get(f"/create-session/consent-{i}")
+            session_ids.append(res.json()["id"])
+
+        submit_latencies = []
+        submitted_at = {}
+        rejected = 0
+        start = time.perf_counter()
+        for session_id in session_ids:
+            t = time.perf_counter()
+            res = await client.get(f"/fetch-data/{session_id}")
+            submit_latencies.append(time.perf_counter() - t)
+            if res.status_code == 503:
+                rejected += 1
+                continue
+            assert res.status_code == 202, res.text
+            submitted_at[res.json()["job_id"]] = t
+
+        done_latencies = []
+        failed = 0
+        pending = set(submitted_at)
+        while pending:
+            await asyncio.sleep(0.05)
+            for job_id in list(pending):
+                job = (await client.get(f"/fetch-jobs/{job_id}")).json()
+                if job["status"] in ("done", "failed"):
+                    pending.discard(job_id)
+                    failed += job["status"] == "failed"
+                    done_latencies.append(time.perf_counter() - submitted_at[job_id])
+        elapsed = time.perf_counter() - start
+        metrics = (await client.get("/fetch-job-metrics")).json()
+
+    p50, p99 = percentiles(submit_latencies)
+    print(f"/fetch-data       p50 {p50:8.1f} ms   p99 {p99:8.1f} ms   accepted {len(submitted_at)}   rejected {rejected}")
+    if done_latencies:
+        p50, p99 = percentiles(done_latencies)
+        print(f"job done after    p50 {p50:8.1f} ms   p99 {p99:8.1f} ms   failed {failed}")
+    print(f"{len(submitted_at) / elapsed:.1f} fetches/s   metrics {metrics}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FI fetch job pipeline against the Setu stub")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--queue-size", type=int, default=100)
+    parser.add_argument("--ready-after", type=float, default=0.5, help="seconds a data session stays PENDING")
+    parser.add_argument("--transactions", type=int, default=1000, help="per account in every session")
+    args = parser.parse_args()
+
+    # read by the stub, SetuClient and app/fetch_jobs.py at import
+    os.environ.update({
+        "STUB_SESSION_READY_SECONDS": str(args.ready_after),
+        "STUB_TRANSACTIONS": str(args.transactions),
+        "SETU_BASE_URL": STUB_URL,
+        "SETU_TOKEN_URL": f"{STUB_URL}/token",
+        "SETU_PRODUCT_ID": "bench",
+        "FETCH_WORKERS": str(args.workers),
+        "FETCH_QUEUE_SIZE": str(args.queue_size),
+        "FETCH_POLL_INTERVAL_SECONDS": "0.1",
+        "DB_NAME": "fetch_pipeline_bench",
+        "LOG_LEVEL": "WARNING",
+    })
+    os.environ.setdefault("TXN_ARCHIVE_DIR", os.path.join("/tmp", "fetch-pipeline-archive"))
+    start_stub()
+    asyncio.run(main(args.sessions))
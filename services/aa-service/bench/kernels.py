@@ -0,0 +1,103 @@
+import itertools, os, shutil, sys, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+ARCHIVE_ROOT = tempfile.mkdtemp(prefix="aa-bench-")
+os.environ["TXN_ARCHIVE_DIR"] = ARCHIVE_ROOT
+os.environ.setdefault("DB_NAME", "kernel_bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from mongomock_motor import AsyncMongoMockClient  # type: ignore  # noqa: E402
+from common.bench.fi_payload import fi_payload  # noqa: E402
+from common.bench.harness import Benchmark, run  # noqa: E402
+from app.analytics import new_state, fold_columns, build_analytics  # noqa: E402
+from app.categories import categorize  # noqa: E402
+from app.data_process import fold_account  # noqa: E402
+from app.txn_archive import TransactionArchive  # noqa: E402
+import app.main as main  # noqa: E402
+
+# analytics kernels of aa-service, sized by transactions per account
+# cd services/aa-service && PYTHONPATH=..:. python bench/kernels.py --sizes 100,1000,10000
+
+_users = itertools.count()
+
+
+def account_transactions(size):
+    return fi_payload(seed=size, transactions=size)["fips"][0]["accounts"][0]["data"]["account"]["transactions"]["transaction"]
+
+
+def setup_fold_account(size):
+    return {"root": tempfile.mkdtemp(dir=ARCHIVE_ROOT), "transactions": account_transactions(size)}
+
+
+def run_fold_account(inputs):
+    # a first data session for a new account: archive append, fold and build_analytics
+    return fold_account(inputs["root"], f"user-{next(_users)}", "setu-fip-2:link-0", None, inputs["transactions"])
+
+
+def setup_fold_archive(size):
+    root = tempfile.mkdtemp(dir=ARCHIVE_ROOT)
+    TransactionArchive(root).append("user", "setu-fip-2:link-0", account_transactions(size))
+    return {"root": root}
+
+
+def run_fold_archive(inputs):
+    # what /reanalyze does per account: mmap the segments and fold them from a fresh state
+    state = new_state()
+    for segment in TransactionArchive(inputs["root"]).segments("user", "setu-fip-2:link-0"):
+        fold_columns(state, segment)
+    return build_analytics(state)
+
+
+def setup_categorize(size):
+    root = tempfile.mkdtemp(dir=ARCHIVE_ROOT)
+    archive = TransactionArchive(root)
+    archive.append("user", "setu-fip-2:link-0", account_transactions(size))
+    segment = next(archive.segments("user", "setu-fip-2:link-0"))
+    return {"root": root, "segment": segment}
+
+
+def run_categorize(inputs):
+    # labelling one segment from its narration and reference columns, done once on append
+    return categorize(inputs["segment"], inputs["segment"].dictionaries)
+
+
+def setup_set_analytics(size):
+    main.db._client = AsyncMongoMockClient()
+    return {"payload": fi_payload(seed=size, transactions=size)}
+
+
+async def run_set_analytics(inputs):
+    # end to end on mongomock, through the analytics process pool; a new holder every call
+    # so each run is a first session rather than a no-op re-send
+    user = next(_users)
+    for fip in inputs["payload"]["fips"]:
+        for account in fip["accounts"]:
+            for holder in account["data"]["account"]["profile"]["holders"]["holder"]:
+                holder["pan"] = f"BENCH{user:05d}"
+                # insert_one sets _id on the document it is given
+                holder.pop("_id", None)
+    return await main.set_analytics(inputs["payload"])
+
+
+def remove_root(inputs):
+    if "root" in inputs:
+        shutil.rmtree(inputs["root"], ignore_errors=True)
+
+
+# fold_account writes a new archive every call and set_analytics goes through the process
+# pool, both swing with the disk and the scheduler more than the reference kernel does
+BENCHMARKS = [
+    Benchmark("fold_account", setup_fold_account, run_fold_account, "txns", teardown=remove_root, tolerance=0.6),
+    Benchmark("fold_archive", setup_fold_archive, run_fold_archive, "txns", teardown=remove_root),
+    Benchmark("categorize", setup_categorize, run_categorize, "txns", teardown=remove_root),
+    Benchmark("set_analytics", setup_set_analytics, run_set_analytics, "txns", tolerance=0.6),
+]
+
+
+if __name__ == "__main__":
+    try:
+        run("aa-service", BENCHMARKS)
+    finally:
+        main.shutdown_pool()
+        shutil.rmtree(ARCHIVE_ROOT, ignore_errors=True)
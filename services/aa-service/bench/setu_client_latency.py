@@ -0,0 +1,71 @@
+import httpx  # type: ignore
+import argparse, asyncio, os, statistics, sys, threading, time
+import uvicorn  # type: ignore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.setu_client import SetuClient  # noqa: E402
+
+# consent-status latency under concurrent load against bench/setu_stub.py:
+# the old per-request client + token fetch versus the shared pooled SetuClient
+# python bench/setu_client_latency.py --requests 2000 --concurrency 100
+
+PORT = 9100
+BASE_URL = f"http://127.0.0.1:{PORT}"
+
+
+def start_stub():
+    from bench.setu_stub import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def per_request_client(consent_id):
+    # what every aa-service handler used to do: new client, new connection, new token
+    async with httpx.AsyncClient() as client:
+        token = (await client.post(f"{BASE_URL}/token", json={})).json()
+        return await client.get(
+            f"{BASE_URL}/consents/{consent_id}",
+            headers={"Authorization": "Bearer " + token["access_token"]},
+        )
+
+
+async def run(label, call, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            res = await call(f"consent-{i}")
+            latencies.append(time.perf_counter() - start)
+            assert res.status_code == 200, res.text
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"{label:<20} {requests / elapsed:>8.0f} req/s   p50 {p50:>7.1f} ms   p99 {p99:>7.1f} ms")
+
+
+async def main(requests, concurrency):
+    await run("per-request client", per_request_client, requests, concurrency)
+    setu = SetuClient(base_url=BASE_URL, token_url=f"{BASE_URL}/token", product_id="bench")
+    await run("shared SetuClient", lambda consent_id: setu.get(f"/consents/{consent_id}"), requests, concurrency)
+    await setu.close()
+    async with httpx.AsyncClient() as client:
+        print("stub calls:", (await client.get(f"{BASE_URL}/stats")).json())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+    start_stub()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,138 @@
+from fastapi import FastAPI, Request  # type: ignore
+from fastapi.responses import JSONResponse  # type: ignore
+import httpx  # type: ignore
+import asyncio, functools, os, sys, time, uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+from common.bench.fi_payload import fi_payload, holder  # noqa: E402
+
+# minimal stand-in for the Setu AA bridge, enough for aa-service to run end to end locally
+# uvicorn bench.setu_stub:app --port 9000
+# SETU_TOKEN_URL=http://localhost:9000/token SETU_BASE_URL=http://localhost:9000
+
+STUB_LATENCY_SECONDS = float(os.getenv("STUB_LATENCY_SECONDS", 0.005))
+STUB_TOKEN_TTL_SECONDS = int(os.getenv("STUB_TOKEN_TTL_SECONDS", 1800))
+# shape of the FI data every session returns, see common/bench/fi_payload.py
+STUB_ACCOUNTS = int(os.getenv("STUB_ACCOUNTS", 1))
+STUB_TRANSACTIONS = int(os.getenv("STUB_TRANSACTIONS", 120))
+# every data session belongs to a new account holder (same transactions), so each onboarding
+# creates its own user instead of all of them updating the one holder of the payload
+STUB_DISTINCT_HOLDERS = os.getenv("STUB_DISTINCT_HOLDERS", "false").lower() == "true"
+# a new data session stays PENDING this long, like a slow FIP
+STUB_SESSION_READY_SECONDS = float(os.getenv("STUB_SESSION_READY_SECONDS", 0))
+# a new consent is approved by the "user" after this long
+STUB_CONSENT_APPROVE_SECONDS = float(os.getenv("STUB_CONSENT_APPROVE_SECONDS", 0))
+# when set, consent and session status changes are posted here like Setu notifications,
+# e.g. http://localhost:8000/setu-notifications?token=<aa-service's SETU_NOTIFICATION_TOKEN>
+STUB_NOTIFICATION_URL = os.getenv("STUB_NOTIFICATION_URL")
+
+app = FastAPI()
+app.state.calls = {}
+app.state.tokens = {}
+app.state.consents = {}
+app.state.sessions = {}
+app.state.notifying = set()
+
+
+@functools.lru_cache(maxsize=1)
+def session_payload():
+    # generated once, a large payload takes longer to build than to serve
+    return fi_payload(accounts=STUB_ACCOUNTS, transactions=STUB_TRANSACTIONS)
+
+
+def with_holder(payload, seed):
+    # shallow copies down to the account, the transactions are shared
+    profile = {"holders": {"type": "SINGLE", "holder": [holder(seed)]}}
+    fips = [
+        {**fip, "accounts": [{**acc, "data": {"account": {**acc["data"]["account"], "profile": profile}}} for acc in fip["accounts"]]}
+        for fip in payload["fips"]
+    ]
+    return {**payload, "fips": fips}
+
+
+def count(name):
+    app.state.calls[name] = app.state.calls.get(name, 0) + 1
+
+
+async def notify_later(delay, notification):
+    await asyncio.sleep(delay)
+    async with httpx.AsyncClient() as client:
+        await client.post(STUB_NOTIFICATION_URL, json={**notification, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())})
+    count("notification")
+
+
+def schedule_notification(delay, notification):
+    if STUB_NOTIFICATION_URL:
+        task = asyncio.create_task(notify_later(delay, notification))
+        app.state.notifying.add(task)
+        task.add_done_callback(app.state.notifying.discard)
+
+
+@app.middleware("http")
+async def check_token(request: Request, call_next):
+    if request.url.path not in ("/token", "/stats"):
+        token = request.headers.get("authorization", "").removeprefix("Bearer ")
+        if app.state.tokens.get(token, 0) <= time.time():
+            count("unauthorized")
+            return JSONResponse(status_code=401, content={"errorCode": "Unauthorized"})
+    return await call_next(request)
+
+
+@app.post("/token")
+async def token():
+    count("token")
+    await asyncio.sleep(STUB_LATENCY_SECONDS)
+    access_token = uuid.uuid4().hex
+    app.state.tokens[access_token] = time.time() + STUB_TOKEN_TTL_SECONDS
+    return {"access_token": access_token, "expires_in": STUB_TOKEN_TTL_SECONDS}
+
+
+@app.post("/consents")
+async def create_consent():
+    count("create_consent")
+    await asyncio.sleep(STUB_LATENCY_SECONDS)
+    consent_id = str(uuid.uuid4())
+    app.state.consents[consent_id] = time.time() + STUB_CONSENT_APPROVE_SECONDS
+    schedule_notification(STUB_CONSENT_APPROVE_SECONDS, {
+        "type": "CONSENT_STATUS_UPDATE", "consentId": consent_id, "success": True, "data": {"status": "ACTIVE"},
+    })
+    return {"id": consent_id, "url": f"http://localhost/consents/{consent_id}", "status": "PENDING"}
+
+
+@app.get("/consents/{consent_id}")
+async def get_consent(consent_id: str):
+    count("get_consent")
+    await asyncio.sleep(STUB_LATENCY_SECONDS)
+    status = "PENDING" if app.state.consents.get(consent_id, 0) > time.time() else "ACTIVE"
+    return {"id": consent_id, "status": status}
+
+
+@app.post("/sessions")
+async def create_session(request: Request):
+    count("create_session")
+    await asyncio.sleep(STUB_LATENCY_SECONDS)
+    session_id = str(uuid.uuid4())
+    app.state.sessions[session_id] = (time.time() + STUB_SESSION_READY_SECONDS, len(app.state.sessions) + 1)
+    consent_id = (await request.json()).get("consentId")
+    schedule_notification(STUB_SESSION_READY_SECONDS, {
+        "type": "SESSION_STATUS_UPDATE", "consentId": consent_id, "dataSessionId": session_id, "success": True,
+        "data": {"status": "COMPLETED"},
+    })
+    return {"id": session_id, "status": "PENDING"}
+
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    count("get_session")
+    await asyncio.sleep(STUB_LATENCY_SECONDS)
+    # sessions the stub did not create are always ready
+    ready_at, seed = app.state.sessions.get(session_id, (0, 0))
+    if ready_at > time.time():
+        return {"id": session_id, "status": "PENDING", "fips": []}
+    payload = with_holder(session_payload(), seed) if STUB_DISTINCT_HOLDERS else session_payload()
+    return {**payload, "id": session_id}
+
+
+@app.get("/stats")
+async def stats():
+    return app.state.calls
@@ -0,0 +1,71 @@
+import argparse, json, random, shutil, sys, tempfile, time
+from app.analytics import new_state, parse_timestamp, fold_columns, build_analytics
+from app.txn_archive import TransactionArchive
+
+# storage and read cost of one account's history: the raw FI JSON that fetch-data used to
+# dump into raw_txns.json against the columnar archive segments, and the time to get from
+# each to the account's analytics
+#
+#   cd services/aa-service && PYTHONPATH=..:. python bench/txn_archive.py --transactions 20000
+
+
+def transactions(n, seed=0):
+    rng = random.Random(seed)
+    balance = 50000.0
+    txns = []
+    for i in range(n):
+        kind = "CREDIT" if rng.random() < 0.4 else "DEBIT"
+        amount = round(rng.uniform(10, 25000), 2)
+        balance += amount if kind == "CREDIT" else -amount
+        day = i * 365 // n
+        txns.append({
+            "type": kind,
+            "mode": rng.choice(["UPI", "CARD", "CASH", "FT", "OTHERS"]),
+            "amount": f"{amount:.2f}",
+            "currentBalance": f"{balance:.2f}",
+            "transactionTimestamp": f"2025-{day // 31 % 12 + 1:02d}-{day % 28 + 1:02d}T{i % 24:02d}:{i % 60:02d}:00+05:30",
+            "valueDate": f"2025-{day // 31 % 12 + 1:02d}-{day % 28 + 1:02d}",
+            "txnId": f"M{seed:04d}{i:08d}",
+            "narration": rng.choice(["UPI/SWIGGY/food", "NEFT/SALARY/ACME LTD", "ATM WDL", "POS/AMAZON", "IMPS/RENT"]),
+            "reference": f"REF{rng.randrange(10**9):09d}",
+        })
+    return txns
+
+
+def main(n):
+    payload = json.dumps({"fips": [{"accounts": [{"data": {"account": {"transactions": {"transaction": transactions(n)}}}}]}]})
+
+    start = time.perf_counter()
+    parsed = json.loads(payload)["fips"][0]["accounts"][0]["data"]["account"]["transactions"]["transaction"]
+    for txn in parsed:
+        parse_timestamp(txn["transactionTimestamp"])
+        float(txn["amount"]), float(txn["currentBalance"])
+    json_seconds = time.perf_counter() - start
+
+    root = tempfile.mkdtemp()
+    try:
+        archive = TransactionArchive(root)
+        start = time.perf_counter()
+        archive.append("bench-user", "bench-fip:acc", parsed)
+        append_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        state = new_state()
+        for segment in archive.segments("bench-user", "bench-fip:acc"):
+            fold_columns(state, segment)
+        build_analytics(state)
+        archive_seconds = time.perf_counter() - start
+        archive_bytes = archive.size_bytes("bench-user", "bench-fip:acc")
+    finally:
+        shutil.rmtree(root)
+
+    print(f"{n} transactions")
+    print(f"  json blob        {len(payload):>12,} bytes | parse {json_seconds * 1000:8.1f} ms")
+    print(f"  archive segment  {archive_bytes:>12,} bytes | append {append_seconds * 1000:7.1f} ms (once per session)")
+    print(f"  analytics from archive (mmap + fold) {archive_seconds * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JSON blob vs columnar archive for one account")
+    parser.add_argument("--transactions", type=int, default=20000)
+    sys.exit(main(parser.parse_args().transactions))
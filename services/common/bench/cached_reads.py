@@ -0,0 +1,135 @@
+import argparse, asyncio, os, random, statistics, sys, time
+
+# load test of the cached read endpoints (common/cache.py): profile and analytics in
+# user-service, matched offers in loan-matching. The service runs in process on mongomock
+# with an artificial delay per mongo round trip; every phase sends the same random mix of
+# requests from concurrent dashboard clients and reports mongo round trips per second and
+# request latency, with the cache off, on, and on with clients revalidating by If-None-Match
+# cd services && python common/bench/cached_reads.py --service user-service --users 1000
+
+SERVICES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+
+class CountingCollection:
+    def __init__(self, collection, delay, counter):
+        self.collection = collection
+        self.delay = delay
+        self.counter = counter
+
+    async def find_one(self, *args, **kwargs):
+        self.counter["round_trips"] += 1
+        await asyncio.sleep(self.delay)
+        return await self.collection.find_one(*args, **kwargs)
+
+
+async def seed_user_service(main, n_users):
+    from bson import ObjectId  # type: ignore
+
+    profiles, analytics = [], []
+    for i in range(n_users):
+        user_id = ObjectId()
+        profiles.append({"_id": user_id, "name": f"user {i}", "email": f"user{i}@example.com", "mobile": f"98{i:08d}", "pan": f"BENCH{i:05d}"})
+        analytics.append({
+            "_id": ObjectId(), "user_id": user_id, "average_monthly_inflow": 50000.0 + i,
+            "monthly_inflow": {str(m): 40000.0 + m for m in range(1, 13)},
+            "monthly_outflow": {str(m): 30000.0 + m for m in range(1, 13)},
+        })
+    await main.user_profiles_list.insert_many(profiles)
+    await main.bank_analytics.insert_many(analytics)
+    return (
+        [f"/get-profile/{p['_id']}" for p in profiles] + [f"/get-analytics/{a['_id']}" for a in analytics],
+        ["user_profiles_list", "bank_analytics"],
+        [main.profile_cache, main.analytics_cache],
+    )
+
+
+async def seed_loan_matching(main, n_users):
+    from bson import ObjectId  # type: ignore
+
+    products = [{"_id": ObjectId(), "name": f"product-{i}", "interest_rate": 8.0 + i % 16} for i in range(200)]
+    await main.loan_products_list.insert_many(products)
+    await main.loan_product_params.insert_many([
+        {"loan_product_id": p["_id"], "min_credit_score": 300 + 5 * i, "min_monthly_inflow": 1000.0 * i}
+        for i, p in enumerate(products)
+    ])
+    await main.matching_engine.load()
+    user_ids = [ObjectId() for _ in range(n_users)]
+    await main.bank_analytics_list.insert_many([
+        {"user_id": u, "average_monthly_inflow": 1000.0 * (i % 300), "average_maintained_balance": 20000.0}
+        for i, u in enumerate(user_ids)
+    ])
+    await main.risk_data_list.insert_many([{"user_id": u, "credit_score": 300 + i % 600} for i, u in enumerate(user_ids)])
+    return [f"/get-matched-offers/{u}" for u in user_ids], ["bank_analytics_list", "risk_data_list"], [main.offers_cache]
+
+
+async def phase(label, client, paths, counter, args, revalidate):
+    rng = random.Random(0)
+    requests = [rng.choice(paths) for _ in range(args.requests)]
+    etags = {}
+    latencies = []
+    counter["round_trips"] = 0
+    queue = asyncio.Queue()
+    for path in requests:
+        queue.put_nowait(path)
+
+    async def dashboard():
+        while not queue.empty():
+            path = queue.get_nowait()
+            headers = {"If-None-Match": etags[path]} if revalidate and path in etags else {}
+            start = time.perf_counter()
+            res = await client.get(path, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            assert res.status_code in (200, 304), res.text
+            if "etag" in res.headers:
+                etags[path] = res.headers["etag"]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(dashboard() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(
+        f"{label:<22} {len(requests) / elapsed:>8.0f} req/s   mongo {counter['round_trips'] / elapsed:>8.0f} qps"
+        f"   p50 {statistics.median(latencies) * 1000:>6.2f} ms   p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:>6.2f} ms"
+    )
+
+
+async def main(args):
+    import httpx  # type: ignore
+    from mongomock_motor import AsyncMongoMockClient  # type: ignore
+    import app.main as main
+
+    main.db._client = AsyncMongoMockClient()
+    seed = seed_user_service if args.service == "user-service" else seed_loan_matching
+    paths, collections, caches = await seed(main, args.users)
+    counter = {"round_trips": 0}
+    for name in collections:
+        setattr(main, name, CountingCollection(getattr(main, name), args.round_trip_ms / 1000, counter))
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url=f"http://{args.service}") as client:
+        sizes = [cache.maxsize for cache in caches]
+        for cache in caches:
+            cache.maxsize = 0
+        await phase("no cache", client, paths, counter, args, revalidate=False)
+        for cache, size in zip(caches, sizes):
+            cache.maxsize = size
+        await phase("cache, cold", client, paths, counter, args, revalidate=False)
+        await phase("cache, warm", client, paths, counter, args, revalidate=False)
+        await phase("warm + If-None-Match", client, paths, counter, args, revalidate=True)
+        print({cache.name: cache.get_metrics() for cache in caches})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="cached read endpoints under load")
+    parser.add_argument("--service", choices=["user-service", "loan-matching"], default="user-service")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--round-trip-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DB_NAME", "cached_reads_bench")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, SERVICES_DIR)
+    sys.path.insert(0, os.path.join(SERVICES_DIR, args.service))
+    asyncio.run(main(args))
@@ -0,0 +1,125 @@
+import argparse, json, random, sys
+from datetime import datetime, timedelta, timezone
+
+# deterministic Setu-shaped FI session payloads (fips -> accounts -> profile / summary /
+# transactions) for the stub, the benchmarks and local runs. The same arguments always give
+# the same payload, byte for byte
+# python common/bench/fi_payload.py --accounts 2 --transactions 5000 > payload.json
+
+IST = timezone(timedelta(hours=5, minutes=30))
+OTHER_MODES = ["FT", "CARD", "ATM", "OTHERS"]
+NARRATIONS = {
+    "UPI": ["UPI/{ref}/SWIGGY/food", "UPI/{ref}/ZOMATO/food", "UPI/{ref}/BIGBASKET/groceries", "UPI/{ref}/PAYTM/recharge"],
+    "CASH": ["CASH DEPOSIT/{ref}", "CASH WDL/{ref}"],
+    "FT": ["NEFT/{ref}/ACME LTD/salary", "IMPS/{ref}/RENT", "RTGS/{ref}/SUPPLIER PAYMENT", "GST PMT/{ref}/CBIC", "NEFT/{ref}/LOAN DISB"],
+    "CARD": ["POS/{ref}/AMAZON", "POS/{ref}/FLIPKART", "POS/{ref}/FUEL STATION"],
+    "ATM": ["ATM/{ref}/WDL"],
+    "OTHERS": ["EMI/{ref}/HOME LOAN", "INT CREDIT/{ref}", "CHQ/{ref}", "CHQ RTN/{ref}/INSUFFICIENT FUNDS", "NACH/{ref}/BAJAJ FIN"],
+}
+
+
+def holder(seed):
+    rng = random.Random(f"holder-{seed}")
+    letters = "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(5))
+    return {
+        "name": f"Bench Holder {seed}",
+        "dob": f"19{rng.randint(60, 99)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "mobile": f"9{rng.randrange(10**9):09d}",
+        "nominee": "NOT-REGISTERED",
+        "landline": "",
+        "address": f"{rng.randint(1, 999)} MG Road, Bengaluru",
+        "email": f"holder{seed}@example.com",
+        "pan": f"{letters}{rng.randrange(10**4):04d}{rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')}",
+        "ckycCompliance": "true",
+    }
+
+
+def transactions(seed, n, months=12, end=None, cash_ratio=0.1, upi_ratio=0.6, credit_ratio=0.35, opening_balance=50000.0):
+    # n transactions spread evenly over the months before `end`, oldest first, with a running
+    # balance; mode is CASH / UPI / other in the given mix, amounts are log-normal
+    rng = random.Random(f"txns-{seed}")
+    end = end or datetime(2025, 12, 31, 18, 0, tzinfo=IST)
+    span = timedelta(days=30.4 * months)
+    start = end - span
+    step = span / max(n, 1)
+    balance = opening_balance
+    txns = []
+    for i in range(n):
+        draw = rng.random()
+        mode = "CASH" if draw < cash_ratio else "UPI" if draw < cash_ratio + upi_ratio else rng.choice(OTHER_MODES)
+        kind = "CREDIT" if rng.random() < credit_ratio else "DEBIT"
+        amount = round(min(rng.lognormvariate(7.5, 1.2), 500000), 2)
+        balance += amount if kind == "CREDIT" else -amount
+        ts = start + step * i
+        ref = f"{seed % 10000:04d}{i:010d}"
+        txns.append({
+            "type": kind,
+            "mode": mode,
+            "amount": f"{amount:.2f}",
+            "currentBalance": f"{balance:.2f}",
+            "transactionTimestamp": ts.isoformat(timespec="seconds"),
+            "valueDate": ts.date().isoformat(),
+            "txnId": f"T{ref}",
+            "narration": rng.choice(NARRATIONS[mode]).format(ref=ref),
+            "reference": f"R{ref}",
+        })
+    return txns
+
+
+def account(seed, index, n_transactions, **options):
+    account_seed = seed * 1000 + index
+    txns = transactions(account_seed, n_transactions, **options)
+    masked = f"XXXXXXXX{account_seed % 10000:04d}"
+    return {
+        "linkRefNumber": f"link-{seed}-{index}",
+        "maskedAccNumber": masked,
+        "FIstatus": "READY",
+        "status": "READY",
+        "data": {"account": {
+            "type": "deposit",
+            "maskedAccNumber": masked,
+            "linkedAccRef": f"link-{seed}-{index}",
+            "version": "1.1",
+            "profile": {"holders": {"type": "SINGLE", "holder": [holder(seed)]}},
+            "summary": {
+                "type": "SAVINGS",
+                "currency": "INR",
+                "status": "ACTIVE",
+                "currentBalance": txns[-1]["currentBalance"] if txns else "0.00",
+                "branch": "BENCH",
+                "ifscCode": "BENC0000001",
+            },
+            "transactions": {
+                "startDate": txns[0]["valueDate"] if txns else None,
+                "endDate": txns[-1]["valueDate"] if txns else None,
+                "transaction": txns,
+            },
+        }},
+    }
+
+
+def fi_payload(seed=0, accounts=1, transactions=120, fips=1, **options):
+    # accounts are dealt round robin across `fips` FIPs; options go to transactions()
+    payload = {"id": f"session-{seed}", "status": "COMPLETED", "format": "json", "fips": []}
+    for f in range(fips):
+        payload["fips"].append({"fipID": f"setu-fip-{f + 2}", "accounts": []})
+    for index in range(accounts):
+        payload["fips"][index % fips]["accounts"].append(account(seed, index, transactions, **options))
+    return payload
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic Setu FI session payload")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fips", type=int, default=1)
+    parser.add_argument("--accounts", type=int, default=1)
+    parser.add_argument("--transactions", type=int, default=120, help="per account")
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--cash-ratio", type=float, default=0.1)
+    parser.add_argument("--upi-ratio", type=float, default=0.6)
+    parser.add_argument("--credit-ratio", type=float, default=0.35)
+    args = parser.parse_args()
+    json.dump(fi_payload(
+        args.seed, args.accounts, args.transactions, args.fips,
+        months=args.months, cash_ratio=args.cash_ratio, upi_ratio=args.upi_ratio, credit_ratio=args.credit_ratio,
+    ), sys.stdout)
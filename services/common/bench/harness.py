@@ -0,0 +1,193 @@
+import argparse, asyncio, gc, json, os, statistics, sys, time, tracemalloc
+
+# a small pytest-benchmark style runner for the hot-path kernels. Each service has a
+# bench/kernels.py that lists Benchmark objects and calls main(); results are compared with
+# common/bench/budgets.json and the run exits non-zero when a kernel got slower, or uses
+# more memory, than its recorded budget allows
+# cd services/aa-service && PYTHONPATH=..:. python bench/kernels.py --sizes 100,1000,10000
+#
+# Throughput budgets are relative to the machine they were recorded on: every run also times
+# a fixed reference kernel, and a budget is scaled by how fast the reference ran here compared
+# to when the budget was recorded (budgets["reference"][service]). A slower laptop or a busy
+# CI runner moves the reference and the kernels together, a slower kernel only moves itself.
+# Re-record after an intended change with --update-budgets; that stores the reference of the
+# same run, so it can be done on any machine
+
+SIZES = (100, 1_000, 10_000, 100_000, 1_000_000)
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "budgets.json")
+# a kernel fails when its throughput drops, or its peak memory grows, by more than this
+DEFAULT_TOLERANCE = float(os.getenv("BENCH_TOLERANCE", 0.3))
+
+
+class Benchmark:
+    # setup(size) builds the inputs once per size and is not timed; run(inputs) is the timed
+    # call and may be a coroutine function. unit names what size counts, throughput is
+    # size * scale / seconds per call (scale for kernels that repeat the work per call).
+    # tolerance widens the budget of a kernel whose timing is dominated by the filesystem or a
+    # process pool, which the reference kernel cannot account for
+    def __init__(self, name, setup, run, unit, sizes=SIZES, teardown=None, scale=1, tolerance=None):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.unit = unit
+        self.sizes = sizes
+        self.teardown = teardown
+        self.scale = scale
+        self.tolerance = tolerance
+
+
+def reference_kernel(size):
+    # fixed pure python work of the kind the kernels do (dicts, float sums, a sort); it never
+    # changes, so its throughput says how fast this interpreter on this machine is right now
+    rows = [{"amount": (i * 7919 % 10007) * 1.5, "month": i % 12} for i in range(size)]
+    totals = {}
+    for row in rows:
+        totals[row["month"]] = totals.get(row["month"], 0.0) + row["amount"]
+    rows.sort(key=lambda row: row["amount"])
+    return totals
+
+
+REFERENCE = Benchmark("reference", lambda size: size, reference_kernel, "rows", sizes=(20_000,))
+
+
+def call(benchmark, inputs, loop):
+    result = benchmark.run(inputs)
+    if asyncio.iscoroutine(result):
+        result = loop.run_until_complete(result)
+    return result
+
+
+def measure(benchmark, size, loop, min_time=0.5, max_rounds=50):
+    inputs = benchmark.setup(size)
+    try:
+        call(benchmark, inputs, loop)  # warm up: imports, pools, caches
+
+        gc.collect()
+        tracemalloc.start()
+        call(benchmark, inputs, loop)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        rounds = []
+        started = time.perf_counter()
+        while len(rounds) < max_rounds and (len(rounds) < 3 or time.perf_counter() - started < min_time):
+            start = time.perf_counter()
+            call(benchmark, inputs, loop)
+            rounds.append(time.perf_counter() - start)
+    finally:
+        if benchmark.teardown:
+            benchmark.teardown(inputs)
+    median = statistics.median(rounds)
+    return {
+        "name": benchmark.name,
+        "size": size,
+        "unit": benchmark.unit,
+        "rounds": len(rounds),
+        "min_s": min(rounds),
+        "median_s": median,
+        "throughput": size * benchmark.scale / median,
+        "peak_mb": peak / 2**20,
+    }
+
+
+def load_budgets(path):
+    if not os.path.exists(path):
+        return {"tolerance": DEFAULT_TOLERANCE, "reference": {}, "kernels": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def budget_key(service, result):
+    return f"{service}/{result['name']}/{result['size']}"
+
+
+def machine_speed(service, budgets, reference):
+    # how much faster (> 1) or slower this run is than the one that recorded the budgets
+    recorded = budgets.get("reference", {}).get(service)
+    return reference / recorded if recorded else 1.0
+
+
+def check(service, results, budgets, tolerance, speed=1.0, tolerances=None):
+    failures = []
+    for result in results:
+        budget = budgets["kernels"].get(budget_key(service, result))
+        if not budget:
+            continue
+        allowed = max(tolerance, (tolerances or {}).get(result["name"], 0))
+        throughput = budget["throughput"] * speed
+        if result["throughput"] < throughput * (1 - allowed):
+            failures.append(f"{budget_key(service, result)}: {result['throughput']:,.0f} {result['unit']}/s, budget {throughput:,.0f} on this machine")
+        # tiny allocations are noise, only hold memory to a budget above 1MB
+        if budget["peak_mb"] > 1 and result["peak_mb"] > budget["peak_mb"] * (1 + allowed):
+            failures.append(f"{budget_key(service, result)}: peak {result['peak_mb']:.1f}MB, budget {budget['peak_mb']:.1f}MB")
+    return failures
+
+
+def update_budgets(service, results, budgets, path, reference):
+    budgets.setdefault("reference", {})[service] = round(reference, 1)
+    budgets["reference"] = dict(sorted(budgets["reference"].items()))
+    for result in results:
+        budgets["kernels"][budget_key(service, result)] = {
+            "throughput": round(result["throughput"], 1),
+            "peak_mb": round(result["peak_mb"], 2),
+        }
+    budgets["kernels"] = dict(sorted(budgets["kernels"].items()))
+    with open(path, "w") as f:
+        json.dump(budgets, f, indent=2)
+        f.write("\n")
+
+
+def main(service, benchmarks):
+    parser = argparse.ArgumentParser(description=f"{service} kernel benchmarks")
+    parser.add_argument("--sizes", help="comma separated, default per kernel up to 1M")
+    parser.add_argument("--only", help="comma separated kernel names")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds of timed rounds per kernel and size")
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--budgets", default=BUDGETS_PATH)
+    parser.add_argument("--tolerance", type=float)
+    parser.add_argument("--update-budgets", action="store_true", help="record these results as the new budgets")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")] if args.sizes else None
+    only = set(args.only.split(",")) if args.only else None
+    budgets = load_budgets(args.budgets)
+    tolerance = args.tolerance if args.tolerance is not None else budgets.get("tolerance", DEFAULT_TOLERANCE)
+
+    loop = asyncio.new_event_loop()
+    results = []
+    print(f"{'kernel':<28} {'size':>9} {'rounds':>6} {'median':>10} {'throughput':>20} {'peak':>9}")
+    # the reference runs before and after the kernels, so a machine that speeds up or slows
+    # down during the run is averaged out
+    references = [measure(REFERENCE, REFERENCE.sizes[0], loop)["throughput"]]
+    for benchmark in benchmarks:
+        if only and benchmark.name not in only:
+            continue
+        for size in sizes or benchmark.sizes:
+            result = measure(benchmark, size, loop, min_time=args.min_time)
+            results.append(result)
+            print(
+                f"{result['name']:<28} {size:>9,} {result['rounds']:>6} {result['median_s'] * 1000:>8.2f}ms "
+                f"{result['throughput']:>12,.0f} {result['unit'] + '/s':<7} {result['peak_mb']:>7.1f}MB"
+            )
+    references.append(measure(REFERENCE, REFERENCE.sizes[0], loop)["throughput"])
+    loop.close()
+    reference = statistics.mean(references)
+    speed = machine_speed(service, budgets, reference)
+    print(f"reference {reference:,.0f} rows/s, {speed:.2f}x the machine that recorded the budgets")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"service": service, "reference": reference, "results": results}, f, indent=2)
+    if args.update_budgets:
+        update_budgets(service, results, budgets, args.budgets, reference)
+        print(f"budgets updated in {args.budgets}")
+        return 0
+    tolerances = {benchmark.name: benchmark.tolerance for benchmark in benchmarks if benchmark.tolerance}
+    failures = check(service, results, budgets, tolerance, speed, tolerances)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+
+def run(service, benchmarks):
+    sys.exit(main(service, benchmarks))
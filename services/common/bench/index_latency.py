@@ -0,0 +1,55 @@
+import argparse, asyncio, os, random, statistics, sys, time
+from bson import ObjectId  # type: ignore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+from common.db import Database  # noqa: E402
+
+# bank_analytics lookup latency by user_id with and without the declared indexes, against a
+# local mongod. Uses its own scratch database, which is dropped at the end
+# MONGO_URI=mongodb://localhost:27017 python common/bench/index_latency.py --documents 1000000
+
+
+async def lookups(collection, user_ids, n):
+    latencies = []
+    for user_id in random.sample(user_ids, n):
+        start = time.perf_counter()
+        await collection.find_one({"user_id": user_id})
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.99) - 1] * 1000
+
+
+async def main(n_documents, n_lookups):
+    db = Database(db_name="index_latency_bench", appname="index-latency-bench")
+    bank_analytics = db.collection("bank_analytics")
+    await bank_analytics.drop()
+
+    user_ids = []
+    batch = []
+    for _ in range(n_documents):
+        user_id = ObjectId()
+        user_ids.append(user_id)
+        batch.append({"user_id": user_id, "total_credit": random.uniform(0, 1e6), "monthly_data": []})
+        if len(batch) == 10000:
+            await bank_analytics.insert_many(batch)
+            batch = []
+    if batch:
+        await bank_analytics.insert_many(batch)
+
+    p50, p99 = await lookups(bank_analytics, user_ids, n_lookups)
+    print(f"without indexes  p50 {p50:>9.2f} ms   p99 {p99:>9.2f} ms")
+    await db.ensure_indexes()
+    p50, p99 = await lookups(bank_analytics, user_ids, n_lookups)
+    print(f"with indexes     p50 {p50:>9.2f} ms   p99 {p99:>9.2f} ms")
+    print(db.query_stats())
+
+    await db.client.drop_database("index_latency_bench")
+    db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.documents, args.lookups))
@@ -0,0 +1,418 @@
+import argparse, asyncio, importlib, json, os, platform, statistics, subprocess, sys, tempfile, time
+from datetime import datetime, timezone
+
+# end-to-end load test of the four python services together. Virtual users run the whole
+# onboarding journey the way the UI does: consent -> long-poll until the FI fetch stored the
+# analytics (aa-service, against aa-service/bench/setu_stub.py posting notifications) ->
+# risk (credit-engine) -> offers (loan-matching) -> apply and list applications
+# (user-service, admin emails go to an SMTP sink in this process).
+#
+# With --mongo-uri every service runs as its own uvicorn process, and the run is repeated
+# for every --workers and --pool-sizes combination (uvicorn workers, MONGO_MAX_POOL_SIZE).
+# Without it the services run in this process on one shared mongomock database: handy for
+# checking the harness and the journeys, not for capacity numbers (mongomock 4.3 needs
+# pymongo < 4.9 there, newer ones pass a sort to bulk_write that it does not accept).
+# Every combination is driven at each --concurrency level (concurrent virtual users, closed
+# loop) for --duration seconds. The report has journeys/s and latency percentiles per route,
+# and per combination the concurrency where throughput stopped growing (the saturation point).
+# It is written as JSON with --json; --baseline compares it with the report of an earlier release.
+# cd services && python common/bench/load.py --concurrency 5,20,50 --duration 20 --json load.json
+# cd services && python common/bench/load.py --mongo-uri mongodb://localhost:27017 --workers 1,2,4 --pool-sizes 10,50
+
+SERVICES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+SERVICES = ["credit-engine", "loan-matching", "user-service", "aa-service"]
+# a level whose journeys/s is less than this much above the previous one is saturated
+SATURATION_GAIN = 1.1
+SATURATION_ERROR_RATE = 0.01
+
+
+class SMTPSink:
+    # just enough SMTP for smtplib.sendmail without STARTTLS or auth; counts the messages
+    def __init__(self):
+        self.messages = 0
+        self.server = None
+
+    async def _session(self, reader, writer):
+        writer.write(b"220 load-test smtp sink\r\n")
+        while line := await reader.readline():
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                writer.write(b"250 load-test\r\n")
+            elif command == b"DATA":
+                writer.write(b"354 end with <CRLF>.<CRLF>\r\n")
+                await writer.drain()
+                while (await reader.readline()) not in (b".\r\n", b""):
+                    pass
+                self.messages += 1
+                writer.write(b"250 queued\r\n")
+            elif command == b"QUIT":
+                writer.write(b"221 bye\r\n")
+                break
+            else:
+                writer.write(b"250 OK\r\n")
+            await writer.drain()
+        writer.close()
+
+    async def start(self, port):
+        self.server = await asyncio.start_server(self._session, "127.0.0.1", port)
+
+    def stop(self):
+        if self.server:
+            self.server.close()
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p90": None, "p99": None, "max": None}
+    values = sorted(values)
+
+    def at(q):
+        return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 2)
+
+    return {"p50": round(statistics.median(values) * 1000, 2), "p90": at(0.9), "p99": at(0.99), "max": round(values[-1] * 1000, 2)}
+
+
+class Recorder:
+    def __init__(self):
+        self.routes = {}
+        self.journeys = []
+        self.failed_journeys = 0
+
+    def add(self, route, seconds, ok):
+        entry = self.routes.setdefault(route, {"latencies": [], "errors": 0})
+        entry["latencies"].append(seconds)
+        if not ok:
+            entry["errors"] += 1
+
+    def report(self, elapsed):
+        return {
+            "journeys": len(self.journeys),
+            "failed_journeys": self.failed_journeys,
+            "journeys_per_second": round(len(self.journeys) / elapsed, 2),
+            "journey_ms": percentiles(self.journeys),
+            "routes": {
+                route: {
+                    "requests": len(entry["latencies"]),
+                    "errors": entry["errors"],
+                    "requests_per_second": round(len(entry["latencies"]) / elapsed, 2),
+                    **percentiles(entry["latencies"]),
+                }
+                for route, entry in sorted(self.routes.items())
+            },
+        }
+
+
+class Journey:
+    def __init__(self, clients, recorder, wait_timeout):
+        self.clients = clients
+        self.recorder = recorder
+        self.wait_timeout = wait_timeout
+
+    async def call(self, service, method, path, route, **kwargs):
+        start = time.perf_counter()
+        try:
+            res = await self.clients[service].request(method, path, **kwargs)
+            ok = res.status_code < 400 and not (res.headers.get("content-type", "").startswith("application/json") and "error" in res.json())
+        except Exception:
+            self.recorder.add(f"{service} {method} {route}", time.perf_counter() - start, False)
+            raise
+        self.recorder.add(f"{service} {method} {route}", time.perf_counter() - start, ok)
+        if not ok:
+            raise RuntimeError(f"{service} {method} {path}: {res.status_code} {res.text[:200]}")
+        return res.json()
+
+    async def run(self, phone):
+        start = time.perf_counter()
+        consent = await self.call("aa-service", "POST", "/create-consent", "/create-consent", json={"phone": phone})
+        view = {"version": 0}
+        while view.get("job_status") not in ("done", "failed"):
+            view = await self.call(
+                "aa-service", "GET", f"/consents/{consent['id']}/wait", "/consents/{consent_id}/wait",
+                params={"version": view["version"], "timeout": self.wait_timeout},
+            )
+        if view["job_status"] != "done":
+            raise RuntimeError(f"fetch failed: {view.get('error')}")
+        user_id = view["ids"]["user_id"]
+        await self.call("credit-engine", "GET", f"/get-risk-data/{user_id}", "/get-risk-data/{user_id}")
+        offers = await self.call("loan-matching", "GET", f"/get-matched-offers/{user_id}", "/get-matched-offers/{user_id}")
+        await self.call("user-service", "GET", f"/get-analytics/{view['ids']['bank_analytics_id']}", "/get-analytics/{analytics_id}")
+        if offers:
+            await self.call("user-service", "POST", "/add-application", "/add-application", json={"user_id": user_id, "loan_name": offers[0]["name"]})
+        await self.call("user-service", "GET", f"/get-applications/{user_id}", "/get-applications/{user_id}")
+        return time.perf_counter() - start
+
+
+async def drive(clients, concurrency, duration, wait_timeout, phones):
+    recorder = Recorder()
+    journey = Journey(clients, recorder, wait_timeout)
+    deadline = time.perf_counter() + duration
+
+    async def virtual_user():
+        while time.perf_counter() < deadline:
+            try:
+                recorder.journeys.append(await journey.run(f"9{next(phones):09d}"))
+            except Exception:
+                recorder.failed_journeys += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(virtual_user() for _ in range(concurrency)))
+    return recorder.report(time.perf_counter() - start)
+
+
+async def seed_catalogue(db):
+    # lenders and products; half of the products have no lender params and match every user
+    from bson import ObjectId  # type: ignore
+
+    admins = [{"_id": ObjectId(), "name": f"Lender {i}", "email": f"lender{i}@example.com"} for i in range(5)]
+    products = [
+        {
+            "_id": ObjectId(), "name": f"Load Test Loan {i}", "description": "load test product", "admin_id": str(admins[i % 5]["_id"]),
+            "max_amount": 100000 * (i + 1), "max_tenure_months": 12 * (1 + i % 3), "interest_rate": 10.0 + i,
+        }
+        for i in range(10)
+    ]
+    await db.admins.insert_many(admins)
+    await db.loanproducts.insert_many(products)
+    await db.lenderparamsandproducts.insert_many([
+        {"loan_product_id": p["_id"], "min_credit_score": 300 + 50 * i, "min_monthly_inflow": 5000.0 * i}
+        for i, p in enumerate(products) if i % 2
+    ])
+
+
+def ports(base):
+    return {name: base + i for i, name in enumerate(SERVICES + ["setu-stub", "smtp"])}
+
+
+def service_env(args, port_of, db_name, pool_size):
+    return {
+        "DB_NAME": db_name,
+        "LOG_LEVEL": "WARNING",
+        "MONGO_MAX_POOL_SIZE": str(pool_size),
+        "SETU_BASE_URL": f"http://127.0.0.1:{port_of['setu-stub']}",
+        "SETU_TOKEN_URL": f"http://127.0.0.1:{port_of['setu-stub']}/token",
+        "SETU_PRODUCT_ID": "load-test",
+        "SETU_NOTIFICATION_TOKEN": "load-test",
+        "STUB_NOTIFICATION_URL": f"http://127.0.0.1:{port_of['aa-service']}/setu-notifications?token=load-test",
+        "STUB_CONSENT_APPROVE_SECONDS": str(args.approve_after),
+        "STUB_SESSION_READY_SECONDS": str(args.ready_after),
+        "STUB_DISTINCT_HOLDERS": "true",
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(port_of["smtp"]),
+        "SMTP_STARTTLS": "false",
+        "TXN_ARCHIVE_DIR": os.path.join(tempfile.gettempdir(), f"{db_name}-archive"),
+    }
+
+
+class ProcessStack:
+    # each service in its own uvicorn process with `workers` workers, on a real mongod
+    def __init__(self, args, workers, pool_size, db_name):
+        self.args = args
+        self.workers = workers
+        self.pool_size = pool_size
+        self.db_name = db_name
+        self.port_of = ports(args.base_port)
+        self.processes = []
+
+    def _spawn(self, service, target, port, workers, env):
+        service_dir = os.path.join(SERVICES_DIR, service)
+        env = {**os.environ, **env, "MONGO_URI": self.args.mongo_uri, "PYTHONPATH": os.pathsep.join([SERVICES_DIR, service_dir])}
+        command = [sys.executable, "-m", "uvicorn", target, "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+        self.processes.append(subprocess.Popen(command, cwd=service_dir, env=env))
+
+    async def start(self, http):
+        env = service_env(self.args, self.port_of, self.db_name, self.pool_size)
+        self._spawn("aa-service", "bench.setu_stub:app", self.port_of["setu-stub"], 1, env)
+        for service in SERVICES:
+            self._spawn(service, "app.main:app", self.port_of[service], self.workers, env)
+        for name, port in self.port_of.items():
+            if name == "smtp":
+                continue
+            while True:
+                try:
+                    await http.get(f"http://127.0.0.1:{port}/docs")
+                    break
+                except Exception:
+                    await asyncio.sleep(0.2)
+
+    async def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            await asyncio.to_thread(process.wait)
+
+
+class InProcessStack:
+    # all four apps and the Setu stub in this process, on one mongomock database. Every
+    # service has its own `app` package, so each is imported with its directory first on
+    # sys.path and its modules taken out of sys.modules again; aa-service comes last and keeps
+    # them (and its path), its analytics process pool pickles its functions by module name
+    def __init__(self, args, db_name):
+        self.args = args
+        self.db_name = db_name
+        self.port_of = ports(args.base_port)
+        self.modules = {}
+        self.servers = []
+
+    def _import(self, service, module, keep):
+        service_dir = os.path.join(SERVICES_DIR, service)
+        for name in [n for n in sys.modules if n.split(".")[0] in ("app", "bench")]:
+            del sys.modules[name]
+        sys.path.insert(0, service_dir)
+        try:
+            loaded = importlib.import_module(module)
+        finally:
+            if not keep:
+                sys.path.remove(service_dir)
+                for name in [n for n in sys.modules if n.split(".")[0] in ("app", "bench")]:
+                    del sys.modules[name]
+        return loaded
+
+    async def start(self, http):
+        import uvicorn  # type: ignore
+        from mongomock_motor import AsyncMongoMockClient  # type: ignore
+
+        os.environ.update(service_env(self.args, self.port_of, self.db_name, 0))
+        client = AsyncMongoMockClient()
+        self.modules["setu-stub"] = self._import("aa-service", "bench.setu_stub", keep=False)
+        for service in SERVICES:
+            self.modules[service] = self._import(service, "app.main", keep=service == "aa-service")
+            self.modules[service].db._client = client
+        await seed_catalogue(client[self.db_name])
+        for name, module in self.modules.items():
+            config = uvicorn.Config(module.app, host="127.0.0.1", port=self.port_of[name], log_level="warning")
+            server = uvicorn.Server(config)
+            self.servers.append((server, asyncio.create_task(server.serve())))
+        while not all(server.started for server, _ in self.servers):
+            await asyncio.sleep(0.05)
+
+    async def stop(self):
+        for server, _ in self.servers:
+            server.should_exit = True
+        await asyncio.gather(*(task for _, task in self.servers), return_exceptions=True)
+
+
+def saturation(levels):
+    # the first level that did not add SATURATION_GAIN journeys/s over the previous one, or
+    # failed more than SATURATION_ERROR_RATE of its journeys
+    peak = max(levels, key=lambda level: level["journeys_per_second"])
+    saturated_at = None
+    previous = None
+    for level in levels:
+        done = level["journeys"] + level["failed_journeys"]
+        if done and level["failed_journeys"] / done > SATURATION_ERROR_RATE:
+            saturated_at = level["concurrency"]
+            break
+        if previous and level["journeys_per_second"] < previous["journeys_per_second"] * SATURATION_GAIN:
+            saturated_at = level["concurrency"]
+            break
+        previous = level
+    return {"saturated_at_concurrency": saturated_at, "peak_journeys_per_second": peak["journeys_per_second"], "peak_concurrency": peak["concurrency"]}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SERVICES_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_level(config, level):
+    print(
+        f"workers {config['workers']:>2}  pool {config['pool_size']:>3}  users {level['concurrency']:>4}"
+        f"   {level['journeys_per_second']:>7.2f} journeys/s   failed {level['failed_journeys']:>4}"
+        f"   journey p50 {level['journey_ms']['p50']} ms   p99 {level['journey_ms']['p99']} ms",
+        flush=True,
+    )
+
+
+def compare(report, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    key = lambda run: (run["workers"], run["pool_size"])  # noqa: E731
+    previous = {key(run): run for run in baseline["runs"]}
+    print(f"against {baseline_path} (revision {baseline.get('revision')})")
+    for run in report["runs"]:
+        before = previous.get(key(run))
+        if before:
+            peak, peak_before = run["saturation"]["peak_journeys_per_second"], before["saturation"]["peak_journeys_per_second"]
+            change = (peak - peak_before) / peak_before * 100 if peak_before else 0.0
+            print(f"workers {run['workers']:>2}  pool {run['pool_size']:>3}   peak {peak_before} -> {peak} journeys/s ({change:+.1f}%)")
+
+
+async def main(args):
+    import httpx  # type: ignore
+
+    concurrency_levels = [int(c) for c in args.concurrency.split(",")]
+    if args.mongo_uri:
+        configs = [(int(w), int(p)) for w in args.workers.split(",") for p in args.pool_sizes.split(",")]
+    else:
+        configs = [(1, 0)]
+    smtp = SMTPSink()
+    await smtp.start(ports(args.base_port)["smtp"])
+    report = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "mode": "processes" if args.mongo_uri else "in-process",
+        "host": {"python": platform.python_version(), "cpus": os.cpu_count()},
+        "options": {"duration": args.duration, "concurrency": concurrency_levels, "approve_after": args.approve_after, "ready_after": args.ready_after},
+        "runs": [],
+    }
+    phones = iter(range(10**9))
+    limits = httpx.Limits(max_connections=max(concurrency_levels) * 2, max_keepalive_connections=max(concurrency_levels))
+    async with httpx.AsyncClient(timeout=120, limits=limits) as http:
+        for workers, pool_size in configs:
+            db_name = f"load_test_{int(time.time())}_{workers}_{pool_size}"
+            stack = ProcessStack(args, workers, pool_size, db_name) if args.mongo_uri else InProcessStack(args, db_name)
+            if args.mongo_uri:
+                from motor.motor_asyncio import AsyncIOMotorClient  # type: ignore
+
+                mongo = AsyncIOMotorClient(args.mongo_uri)
+                await seed_catalogue(mongo[db_name])
+            await stack.start(http)
+            clients = {service: httpx.AsyncClient(base_url=f"http://127.0.0.1:{stack.port_of[service]}", timeout=120, limits=limits) for service in SERVICES}
+            run = {"workers": workers, "pool_size": pool_size, "levels": []}
+            try:
+                for concurrency in concurrency_levels:
+                    level = {"concurrency": concurrency, **await drive(clients, concurrency, args.duration, args.wait_timeout, phones)}
+                    run["levels"].append(level)
+                    print_level(run, level)
+            finally:
+                for client in clients.values():
+                    await client.aclose()
+                await stack.stop()
+                if args.mongo_uri:
+                    await mongo.drop_database(db_name)
+                    mongo.close()
+            run["saturation"] = saturation(run["levels"])
+            report["runs"].append(run)
+    smtp.stop()
+    report["emails_sent"] = smtp.messages
+
+    for run in report["runs"]:
+        print(f"workers {run['workers']:>2}  pool {run['pool_size']:>3}   {run['saturation']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.json}")
+    if args.baseline:
+        compare(report, args.baseline)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="end-to-end load test of aa-service, credit-engine, loan-matching and user-service")
+    parser.add_argument("--mongo-uri", help="run every service as its own process against this mongod; default in-process on mongomock")
+    parser.add_argument("--workers", default="1", help="comma separated uvicorn workers per service (with --mongo-uri)")
+    parser.add_argument("--pool-sizes", default="50", help="comma separated MONGO_MAX_POOL_SIZE values (with --mongo-uri)")
+    parser.add_argument("--concurrency", default="1,5,20,50", help="comma separated concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per concurrency level")
+    parser.add_argument("--approve-after", type=float, default=0, help="seconds until the stub approves a consent")
+    parser.add_argument("--ready-after", type=float, default=0, help="seconds a data session stays PENDING")
+    parser.add_argument("--wait-timeout", type=float, default=25, help="long-poll timeout of /consents/{id}/wait")
+    parser.add_argument("--base-port", type=int, default=9200)
+    parser.add_argument("--json", help="write the report here")
+    parser.add_argument("--baseline", help="an earlier --json report to compare peak throughput with")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, SERVICES_DIR)
+    asyncio.run(main(args))
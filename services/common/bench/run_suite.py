@@ -0,0 +1,28 @@
+import os, subprocess, sys
+
+# runs every service's bench/kernels.py in its own interpreter (each service has its own
+# `app` package) with the same arguments, and fails if any of them reports a regression
+# cd services && python common/bench/run_suite.py --sizes 100,1000,10000
+# cd services && python common/bench/run_suite.py --update-budgets   (all default sizes, any machine:
+# budgets are stored next to the reference kernel throughput of the same run, see harness.py)
+
+SERVICES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+SERVICES = ["aa-service", "credit-engine", "loan-matching"]
+
+
+def main(args):
+    failed = []
+    for service in SERVICES:
+        service_dir = os.path.join(SERVICES_DIR, service)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([SERVICES_DIR, service_dir]))
+        print(f"== {service}", flush=True)
+        result = subprocess.run([sys.executable, os.path.join("bench", "kernels.py"), *args], cwd=service_dir, env=env)
+        if result.returncode:
+            failed.append(service)
+    if failed:
+        print(f"regressions in: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,124 @@
+import argparse, datetime, math, os, shutil, statistics, sys, tempfile, time
+
+# encode time and bytes per response of /get-analytics (user-service), /get-matched-offers
+# (loan-matching) and /get-risk-data (credit-engine) for every wire format in
+# common/serialization.py: FastAPI's default JSON encoding, orjson and MessagePack. The
+# analytics come from aa-service's build_analytics over a generated FI payload, so they
+# have the real monthly_data / rolling / category layout. The analytics of an account
+# without transactions, NaNs and all (as documents stored before to_native turned them into
+# None), check that every format still encodes those
+# cd services && python common/bench/serialization.py --months 24 --offers 20
+
+SERVICES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, SERVICES_DIR)
+sys.path.insert(0, os.path.join(SERVICES_DIR, "aa-service"))
+
+from common.bench.fi_payload import transactions  # noqa: E402
+from common.serialization import encode_json, encode_msgpack, msgpack, orjson, to_native  # noqa: E402
+
+
+def analytics_response(months, per_month):
+    from app.analytics import new_state, fold_columns, build_analytics
+    from app.txn_archive import TransactionArchive
+
+    root = tempfile.mkdtemp(prefix="serialization-bench-")
+    try:
+        archive = TransactionArchive(root)
+        archive.append("user", "account", transactions(0, months * per_month, months=months))
+        state = new_state()
+        for segment in archive.segments("user", "account"):
+            fold_columns(state, segment)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    analytics = build_analytics(state)
+    # what user-service reads back: no _id / user_id, updated_at as a naive utc datetime
+    analytics["updated_at"] = datetime.datetime(2025, 12, 31, 12, 30, 15, 123000)
+    return analytics
+
+
+def empty_analytics_response():
+    from app.analytics import new_state, build_analytics
+
+    analytics = build_analytics(new_state())
+    analytics["updated_at"] = datetime.datetime(2025, 12, 31, 12, 30, 15, 123000)
+    return analytics
+
+
+def offers_response(n):
+    return [
+        {
+            "name": f"Working capital loan {i}",
+            "description": "Unsecured working capital for MSMEs with GST registration",
+            "interest_rate": 10.5 + i % 8 * 0.25,
+            "max_amount": 500000 + 100000 * i,
+            "max_tenure_months": 12 + 6 * (i % 5),
+            "processing_fee": 1.5,
+            "lender": f"Lender {i % 4}",
+        }
+        for i in range(n)
+    ]
+
+
+def risk_response():
+    return {"credit_score": 742, "credit_limit": 612340.75, "risk_category": "Medium Risk", "model_version": "v2"}
+
+
+def non_finite(value):
+    if isinstance(value, dict):
+        return sum(non_finite(item) for item in value.values())
+    if isinstance(value, list):
+        return sum(non_finite(item) for item in value)
+    return isinstance(value, float) and not math.isfinite(value)
+
+
+def measure(encode, value, min_time):
+    encode(value)
+    timings = []
+    deadline = time.perf_counter() + min_time
+    while time.perf_counter() < deadline or len(timings) < 5:
+        start = time.perf_counter()
+        body = encode(value)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), len(body)
+
+
+def main(args):
+    encoders = [("fastapi json", lambda value: encode_json(value, fast=False))]
+    if orjson is not None:
+        encoders.append(("orjson", lambda value: encode_json(value, fast=True)))
+    if msgpack is not None:
+        encoders.append(("msgpack", encode_msgpack))
+    missing = [name for name, module in (("orjson", orjson), ("msgpack", msgpack)) if module is None]
+    if missing:
+        print(f"not installed, skipped: {', '.join(missing)}")
+
+    sparse = empty_analytics_response()
+    assert non_finite(sparse), "analytics without transactions should have NaN statistics"
+    assert not non_finite(to_native(sparse)), "to_native left NaN in the analytics"
+    responses = [
+        (f"get-analytics ({args.months} months)", analytics_response(args.months, args.transactions_per_month)),
+        (f"get-analytics (empty, {non_finite(sparse)} NaN)", sparse),
+        (f"get-matched-offers ({args.offers})", offers_response(args.offers)),
+        ("get-risk-data", risk_response()),
+    ]
+    print(f"{'response':<30} {'format':<14} {'encode':>10} {'bytes':>9} {'vs json':>8}")
+    for label, value in responses:
+        if orjson is not None:
+            assert encode_json(value, fast=True) == encode_json(value, fast=False), f"orjson and json differ for {label}"
+        baseline = None
+        for name, encode in encoders:
+            seconds, size = measure(encode, value, args.min_time)
+            baseline = baseline or (seconds, size)
+            print(
+                f"{label:<30} {name:<14} {seconds * 1e6:>8.1f}us {size:>9,} "
+                f"{baseline[0] / seconds:>6.1f}x  {size / baseline[1]:>4.0%} of the bytes"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="encode time and size of the dashboard responses")
+    parser.add_argument("--months", type=int, default=24, help="months of history in the analytics")
+    parser.add_argument("--transactions-per-month", type=int, default=300)
+    parser.add_argument("--offers", type=int, default=20)
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds of timed encodes per format")
+    main(parser.parse_args())
@@ -0,0 +1,135 @@
+import argparse, asyncio, os, statistics, sys, time
+
+# dashboard bursts against the single-flight lookups (common/singleflight.py): for every user
+# BURST identical requests arrive together (the dashboard firing its calls, retries and
+# refreshes), for /get-risk-data in credit-engine or /get-matched-offers in loan-matching.
+# The users have never been looked up, so without coalescing every request of a burst reads
+# the user's documents and scores / matches on its own. Reports mongo round trips and CPU per
+# user and request latency with single flight off and on; each phase gets its own users.
+# The service runs in process on mongomock with an artificial delay per round trip
+# cd services && python common/bench/single_flight.py --service credit-engine --users 200 --burst 8
+
+SERVICES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+
+class CountingCollection:
+    def __init__(self, collection, delay, counter):
+        self.collection = collection
+        self.delay = delay
+        self.counter = counter
+
+    async def _trip(self):
+        self.counter["round_trips"] += 1
+        await asyncio.sleep(self.delay)
+
+    async def find_one(self, *args, **kwargs):
+        await self._trip()
+        return await self.collection.find_one(*args, **kwargs)
+
+    async def bulk_write(self, *args, **kwargs):
+        await self._trip()
+        return await self.collection.bulk_write(*args, **kwargs)
+
+    def find(self, *args, **kwargs):
+        return CountingCursor(self, self.collection.find(*args, **kwargs))
+
+
+class CountingCursor:
+    def __init__(self, collection, cursor):
+        self.collection = collection
+        self.cursor = cursor
+
+    async def to_list(self, length=None):
+        await self.collection._trip()
+        return await self.cursor.to_list(length=length)
+
+
+async def seed_credit_engine(main, n_users, counter, delay):
+    from app.batch_scoring import synthetic_analytics
+
+    docs = synthetic_analytics(n_users)
+    await main.bank_analytics.insert_many(docs)
+    main.risk_materializer.bank_analytics = CountingCollection(main.bank_analytics, delay, counter)
+    main.risk_materializer.risk_data_list = CountingCollection(main.risk_data_list, delay, counter)
+    return [f"/get-risk-data/{doc['user_id']}" for doc in docs], main.risk_flight
+
+
+async def seed_loan_matching(main, n_users, counter, delay):
+    from bson import ObjectId  # type: ignore
+
+    products = [{"_id": ObjectId(), "name": f"product-{i}", "interest_rate": 8.0 + i % 16} for i in range(200)]
+    await main.loan_products_list.insert_many(products)
+    await main.loan_product_params.insert_many([
+        {"loan_product_id": p["_id"], "min_credit_score": 300 + 5 * i, "min_monthly_inflow": 1000.0 * i}
+        for i, p in enumerate(products)
+    ])
+    await main.matching_engine.load()
+    user_ids = [ObjectId() for _ in range(n_users)]
+    await main.bank_analytics_list.insert_many([
+        {"user_id": u, "average_monthly_inflow": 1000.0 * (i % 300), "average_maintained_balance": 20000.0}
+        for i, u in enumerate(user_ids)
+    ])
+    await main.risk_data_list.insert_many([{"user_id": u, "credit_score": 300 + i % 600} for i, u in enumerate(user_ids)])
+    main.bank_analytics_list = CountingCollection(main.bank_analytics_list, delay, counter)
+    main.risk_data_list = CountingCollection(main.risk_data_list, delay, counter)
+    return [f"/get-matched-offers/{u}" for u in user_ids], main.offers_flight
+
+
+async def phase(label, client, paths, counter, args):
+    counter["round_trips"] = 0
+    latencies = []
+
+    async def request(path):
+        start = time.perf_counter()
+        res = await client.get(path)
+        latencies.append(time.perf_counter() - start)
+        assert res.status_code == 200 and "error" not in res.json(), res.text
+
+    cpu = time.process_time()
+    start = time.perf_counter()
+    # --concurrent-users bursts in flight at a time
+    for i in range(0, len(paths), args.concurrent_users):
+        await asyncio.gather(*(request(path) for path in paths[i:i + args.concurrent_users] for _ in range(args.burst)))
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    latencies.sort()
+    print(
+        f"{label:<18} mongo {counter['round_trips'] / len(paths):>6.1f} round trips/user   cpu {cpu / len(paths) * 1000:>6.2f} ms/user"
+        f"   p50 {statistics.median(latencies) * 1000:>7.2f} ms   p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:>7.2f} ms"
+        f"   {len(latencies) / elapsed:>7.0f} req/s"
+    )
+
+
+async def main(args):
+    import httpx  # type: ignore
+    from mongomock_motor import AsyncMongoMockClient  # type: ignore
+    import app.main as main
+
+    main.db._client = AsyncMongoMockClient()
+    counter = {"round_trips": 0}
+    seed = seed_credit_engine if args.service == "credit-engine" else seed_loan_matching
+    paths, flight = await seed(main, args.users * 2, counter, args.round_trip_ms / 1000)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url=f"http://{args.service}") as client:
+        flight.enabled = False
+        await phase("single flight off", client, paths[:args.users], counter, args)
+        flight.enabled = True
+        await phase("single flight on", client, paths[args.users:], counter, args)
+        print({flight.name: flight.get_metrics()})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="identical concurrent lookups with and without single flight")
+    parser.add_argument("--service", choices=["credit-engine", "loan-matching"], default="credit-engine")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--burst", type=int, default=8, help="identical requests per user arriving together")
+    parser.add_argument("--concurrent-users", type=int, default=10)
+    parser.add_argument("--round-trip-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DB_NAME", "single_flight_bench")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, SERVICES_DIR)
+    sys.path.insert(0, os.path.join(SERVICES_DIR, args.service))
+    asyncio.run(main(args))
@@ -0,0 +1,141 @@
+import argparse, json, os, socket, statistics, subprocess, sys, tempfile, time, urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common.bench.harness import BUDGETS_PATH, DEFAULT_TOLERANCE, load_budgets  # noqa: E402
+
+# cold start of the four python services: every run starts a fresh interpreter the way a new
+# container or a restarted worker does, and reports how long `import app.main` took and the
+# time from spawning the process to the first 200 from GET /metrics (imports, startup hooks,
+# uvicorn bind). Medians of --runs are compared with the "startup" section of
+# common/bench/budgets.json and a service that got slower than its budget allows is reported
+# as a regression (non-zero exit). Without --mongo-uri the services start on mongomock
+# cd services && python common/bench/startup.py --runs 5
+# cd services && python common/bench/startup.py --update-budgets   (on the reference box)
+
+SERVICES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+SERVICES = ["aa-service", "credit-engine", "loan-matching", "user-service"]
+FIRST_REQUEST_TIMEOUT_SECONDS = 60
+
+
+def child(service, port):
+    # runs in the spawned interpreter: import the app, time it, then serve it
+    sys.path.insert(0, os.path.join(SERVICES_DIR, service))
+    start = time.perf_counter()
+    import app.main as main
+    import_ms = (time.perf_counter() - start) * 1000
+    print(json.dumps({"import_ms": import_ms}), flush=True)
+    import uvicorn  # type: ignore
+
+    if not os.getenv("MONGO_URI"):
+        from mongomock_motor import AsyncMongoMockClient  # type: ignore
+
+        main.db._client = AsyncMongoMockClient()
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_200(url, process):
+    deadline = time.perf_counter() + FIRST_REQUEST_TIMEOUT_SECONDS
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"exited with {process.returncode} before serving {url}")
+        try:
+            with urllib.request.urlopen(url, timeout=1) as res:
+                if res.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"no 200 from {url} within {FIRST_REQUEST_TIMEOUT_SECONDS}s")
+
+
+def measure(service, args):
+    port = free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": SERVICES_DIR,
+        "DB_NAME": "startup_bench",
+        "LOG_LEVEL": "WARNING",
+        # keeps aa-service's transaction archive out of the source tree
+        "TXN_ARCHIVE_DIR": os.path.join(tempfile.gettempdir(), "startup-bench-archive"),
+    }
+    if args.mongo_uri:
+        env["MONGO_URI"] = args.mongo_uri
+    command = [sys.executable, os.path.abspath(__file__), "--child", service, "--port", str(port)]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=os.path.join(SERVICES_DIR, service), env=env, stdout=subprocess.PIPE, text=True)
+    try:
+        import_ms = json.loads(process.stdout.readline())["import_ms"]
+        wait_for_200(f"http://127.0.0.1:{port}/metrics", process)
+        first_200_ms = (time.perf_counter() - start) * 1000
+    finally:
+        process.terminate()
+        process.wait()
+    return import_ms, first_200_ms
+
+
+def check(service, result, budgets, tolerance):
+    budget = budgets.get("startup", {}).get(service)
+    if not budget:
+        return []
+    return [
+        f"{service}/{field}: {result[field]:.0f}ms, budget {budget[field]:.0f}ms"
+        for field in ("import_ms", "first_200_ms")
+        if result[field] > budget[field] * (1 + tolerance)
+    ]
+
+
+def main(args):
+    budgets = load_budgets(args.budgets)
+    tolerance = args.tolerance if args.tolerance is not None else budgets.get("tolerance", DEFAULT_TOLERANCE)
+    services = args.services.split(",") if args.services else SERVICES
+    results = {}
+    print(f"{'service':<16} {'runs':>4} {'import':>10} {'first 200':>11}")
+    for service in services:
+        runs = [measure(service, args) for _ in range(args.runs)]
+        results[service] = {
+            "import_ms": statistics.median(import_ms for import_ms, _ in runs),
+            "first_200_ms": statistics.median(first_200_ms for _, first_200_ms in runs),
+        }
+        print(f"{service:<16} {args.runs:>4} {results[service]['import_ms']:>8.0f}ms {results[service]['first_200_ms']:>9.0f}ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"startup": results}, f, indent=2)
+    if args.update_budgets:
+        startup = budgets.setdefault("startup", {})
+        for service, result in results.items():
+            startup[service] = {field: round(value, 1) for field, value in result.items()}
+        budgets["startup"] = dict(sorted(startup.items()))
+        with open(args.budgets, "w") as f:
+            json.dump(budgets, f, indent=2)
+            f.write("\n")
+        print(f"budgets updated in {args.budgets}")
+        return 0
+    failures = [failure for service, result in results.items() for failure in check(service, result, budgets, tolerance)]
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="cold start time of the python services")
+    parser.add_argument("--services", help="comma separated, default all four")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per service, the median is reported")
+    parser.add_argument("--mongo-uri", help="start against this mongod instead of mongomock")
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--budgets", default=BUDGETS_PATH)
+    parser.add_argument("--tolerance", type=float)
+    parser.add_argument("--update-budgets", action="store_true", help="record these results as the new budgets")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.port)
+    else:
+        sys.exit(main(args))
@@ -0,0 +1,205 @@
+import asyncio, hashlib, logging, os, time
+from collections import OrderedDict
+from fastapi.responses import Response  # type: ignore
+from pymongo.errors import PyMongoError  # type: ignore
+from common.observability import metrics
+from common.serialization import JSON, MSGPACK, encode, negotiate
+
+logger = logging.getLogger(__name__)
+
+# read-through cache for GET endpoints whose documents rarely change after onboarding
+# (profile, analytics, offers). Bodies are cached already serialized, with a strong ETag,
+# and a request whose If-None-Match matches gets a 304 without the body being sent.
+# Entries live in an in-process LRU with a ttl, and also in redis when CACHE_REDIS_URL is set
+# (shared by the replicas, needs the redis package). CacheInvalidator follows a change stream
+# on the collections the endpoints read and drops entries as their documents change;
+# without a replica set the ttl alone bounds staleness. A body is cached per wire format
+# (common/serialization.py), JSON under the key itself and MessagePack next to it
+
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", 10000))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", 60))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+FORMAT_SUFFIXES = {JSON: "", MSGPACK: ":msgpack"}
+# CacheInvalidator re-opens a failed change stream after this long, doubling up to the max
+# (a standalone mongod never has one, a replica set election breaks it for a moment)
+WATCH_RETRY_SECONDS = float(os.getenv("CACHE_WATCH_RETRY_SECONDS", 1))
+WATCH_RETRY_MAX_SECONDS = float(os.getenv("CACHE_WATCH_RETRY_MAX_SECONDS", 300))
+
+
+def etag_matches(if_none_match, etag):
+    # If-None-Match compares weakly: W/"x" matches "x"
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+class CachedResponse:
+    def __init__(self, body, etag=None):
+        self.body = body
+        self.etag = etag or '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+class ResponseCache:
+    def __init__(self, name, maxsize=CACHE_SIZE, ttl=CACHE_TTL_SECONDS, redis_url=CACHE_REDIS_URL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.redis_url = redis_url
+        self._entries = OrderedDict()
+        self._redis = None
+        # bumped by every invalidation, a load that overlapped one is not cached
+        self._generation = 0
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0, "redis_errors": 0}
+
+    @property
+    def redis(self):
+        if self._redis is None and self.redis_url:
+            import redis.asyncio as redis  # type: ignore
+
+            self._redis = redis.from_url(self.redis_url)
+        return self._redis
+
+    def _redis_key(self, key):
+        return f"cache:{self.name}:{key}"
+
+    def _get_local(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    def _put_local(self, key, response, ttl):
+        self._entries[key] = (time.monotonic() + ttl, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def _call_redis(self, method, *args):
+        # redis is a second tier, when it is down requests fall through to mongo
+        try:
+            return await getattr(self.redis, method)(*args)
+        except Exception as e:
+            self.stats["redis_errors"] += 1
+            logger.warning("cache redis error", extra={"cache": self.name, "error": str(e)})
+            return None
+
+    async def get(self, key):
+        response = self._get_local(key)
+        if response is None and self.redis_url:
+            value = await self._call_redis("get", self._redis_key(key))
+            if value:
+                etag, body = value.split(b"\n", 1)
+                response = CachedResponse(body, etag.decode())
+                self._put_local(key, response, self.ttl)
+        return response
+
+    async def set(self, key, response):
+        self._put_local(key, response, self.ttl)
+        if self.redis_url:
+            await self._call_redis("set", self._redis_key(key), response.etag.encode() + b"\n" + response.body, "EX", int(self.ttl))
+
+    async def invalidate(self, key):
+        self._generation += 1
+        self.stats["invalidations"] += 1
+        variants = [key + suffix for suffix in FORMAT_SUFFIXES.values()]
+        for variant in variants:
+            self._entries.pop(variant, None)
+        if self.redis_url:
+            await self._call_redis("delete", *(self._redis_key(variant) for variant in variants))
+
+    async def clear(self):
+        self._generation += 1
+        self.stats["invalidations"] += 1
+        self._entries.clear()
+        if self.redis_url:
+            keys = await self._call_redis("keys", self._redis_key("*"))
+            if keys:
+                await self._call_redis("delete", *keys)
+
+    def _count(self, result):
+        self.stats[result] += 1
+        metrics.inc("cache_requests_total", cache=self.name, result=result)
+
+    async def respond(self, request, key, load):
+        # load() returns the document to send, or None when there is nothing to cache (the
+        # endpoint then answers as it did before); a hit skips load entirely
+        media_type = negotiate(request)
+        key += FORMAT_SUFFIXES[media_type]
+        response = await self.get(key)
+        if response is None:
+            self._count("misses")
+            generation = self._generation
+            value = await load()
+            if value is None:
+                return None
+            response = CachedResponse(encode(value, media_type))
+            if generation == self._generation:
+                await self.set(key, response)
+        else:
+            self._count("hits")
+        # no-cache: browsers keep the body but revalidate it with If-None-Match every time
+        headers = {"ETag": response.etag, "Cache-Control": "private, no-cache", "Vary": "Accept"}
+        if etag_matches(request.headers.get("if-none-match"), response.etag):
+            self._count("not_modified")
+            return Response(status_code=304, headers=headers)
+        return Response(response.body, media_type=media_type, headers=headers)
+
+    def get_metrics(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": self.stats["hits"] / lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "redis": bool(self.redis_url),
+        }
+
+
+class CacheInvalidator:
+    # rules maps a collection name to an async callback(change) that drops the entries the
+    # changed document feeds, e.g. the profile of the user whose document changed
+    def __init__(self, database, rules):
+        self.database = database
+        self.rules = rules
+        self._task = None
+
+    async def _apply(self, change):
+        collection = (change.get("ns") or {}).get("coll")
+        try:
+            await self.rules[collection](change)
+        except Exception:
+            # a failing rule (or redis being away) costs that entry its invalidation, it still
+            # expires by ttl; the stream carries on for every other change
+            logger.exception("cache invalidation failed", extra={"collection": collection})
+
+    async def _watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": list(self.rules)}}}]
+        delay = WATCH_RETRY_SECONDS
+        while True:
+            try:
+                # updateLookup so updates carry the whole document, callbacks may need other fields
+                async with self.database.db.watch(pipeline, full_document="updateLookup") as stream:
+                    async for change in stream:
+                        # the stream works again, the next failure starts the backoff over
+                        delay = WATCH_RETRY_SECONDS
+                        await self._apply(change)
+            except PyMongoError as e:
+                logger.info(
+                    "change stream unavailable, cached responses expire by ttl",
+                    extra={"error": str(e), "retry_in": delay},
+                )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WATCH_RETRY_MAX_SECONDS)
+
+    def start(self):
+        self._task = asyncio.create_task(self._watch())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
@@ -0,0 +1,171 @@
+import logging, os, threading
+from pymongo import ASCENDING, DESCENDING, monitoring  # type: ignore
+from pymongo.errors import PyMongoError  # type: ignore
+from common.observability import record_mongo
+
+logger = logging.getLogger(__name__)
+
+# shared mongo access for the python services: the motor client is built lazily (on FastAPI
+# startup, or on first use from a script), pool sizes come from the environment, the indexes
+# every hot filter relies on are declared once here, and every command is timed. motor itself
+# is imported when the client is built, not when a service imports this module
+
+# collection -> [(keys, options)]
+INDEXES = {
+    "user_profiles": [
+        # one profile per holder (aa-service get_or_create_user); profiles keyed by mobile are
+        # the ones without a PAN, another holder with a PAN may share the number
+        ([("pan", ASCENDING)], {"unique": True, "partialFilterExpression": {"pan": {"$gt": ""}}}),
+        ([("mobile", ASCENDING)], {"unique": True, "partialFilterExpression": {"keyed_by": "mobile"}}),
+    ],
+    "bank_analytics": [
+        ([("user_id", ASCENDING)], {}),
+        ([("updated_at", ASCENDING)], {}),
+    ],
+    "bank_analytics_state": [
+        ([("user_id", ASCENDING), ("account_key", ASCENDING)], {"unique": True}),
+    ],
+    "risk_data_list": [
+        ([("user_id", ASCENDING)], {"unique": True}),
+        ([("analytics_updated_at", DESCENDING)], {}),
+    ],
+    "loanapplications": [
+        # one application per user and product, enforced for concurrent submissions too
+        ([("user_id", ASCENDING), ("loan_product_id", ASCENDING)], {"unique": True}),
+    ],
+    "product_eligible_users": [
+        ([("loan_product_id", ASCENDING), ("run_id", ASCENDING), ("chunk", ASCENDING)], {}),
+    ],
+    "loanproducts": [
+        ([("name", ASCENDING)], {}),
+    ],
+    "lenderparamsandproducts": [
+        ([("loan_product_id", ASCENDING)], {}),
+    ],
+    "fetch_jobs": [
+        ([("session_id", ASCENDING), ("status", ASCENDING)], {}),
+        # one active (queued, waiting or processing) job per data session, see FetchJobQueue.submit
+        ([("session_id", ASCENDING), ("active", ASCENDING)], {"unique": True, "partialFilterExpression": {"active": True}}),
+        ([("status", ASCENDING), ("created_at", ASCENDING)], {}),
+        # FetchJobQueue.renew_leases, the active jobs of one process
+        ([("owner", ASCENDING)], {"partialFilterExpression": {"active": True}}),
+    ],
+    "consents": [
+        ([("session_id", ASCENDING)], {"sparse": True}),
+    ],
+    "notification_outbox": [
+        ([("status", ASCENDING), ("next_attempt_at", ASCENDING)], {}),
+    ],
+}
+
+
+class QueryTimer(monitoring.CommandListener):
+    def __init__(self, slow_query_ms):
+        self.slow_query_ms = slow_query_ms
+        self.stats = {}
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        key = f"{event.command_name}:{collection}" if isinstance(collection, str) else event.command_name
+        self._started[event.request_id] = key
+
+    def _record(self, event, failed):
+        key = self._started.pop(event.request_id, event.command_name)
+        ms = event.duration_micros / 1000
+        record_mongo(key, ms / 1000)
+        with self._lock:
+            stat = self.stats.setdefault(key, {"count": 0, "failed": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stat["count"] += 1
+            stat["failed"] += failed
+            stat["total_ms"] += ms
+            stat["max_ms"] = max(stat["max_ms"], ms)
+        if ms >= self.slow_query_ms:
+            logger.warning("slow mongo command", extra={"command": key, "ms": round(ms, 1)})
+
+    def succeeded(self, event):
+        self._record(event, 0)
+
+    def failed(self, event):
+        self._record(event, 1)
+
+
+class LazyCollection:
+    # stands in for a motor collection at import time and resolves it once the client exists
+    def __init__(self, database, name):
+        self._database = database
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._database.db[self.name], attr)
+
+
+class Database:
+    def __init__(self, uri=None, db_name=None, appname=None):
+        self.uri = uri
+        self.db_name = db_name
+        self.appname = appname
+        self.timer = QueryTimer(float(os.getenv("MONGO_SLOW_QUERY_MS", 100)))
+        self.collections = {}
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import motor.motor_asyncio  # type: ignore
+
+            self._client = motor.motor_asyncio.AsyncIOMotorClient(
+                self.uri or os.getenv("MONGO_URI"),
+                appname=self.appname,
+                maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", 50)),
+                minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", 5)),
+                maxIdleTimeMS=int(os.getenv("MONGO_MAX_IDLE_MS", 60000)),
+                serverSelectionTimeoutMS=int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)),
+                event_listeners=[self.timer],
+            )
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name or os.getenv("DB_NAME")]
+
+    def collection(self, name):
+        return self.collections.setdefault(name, LazyCollection(self, name))
+
+    async def ensure_indexes(self):
+        # only for the collections this service uses; create_index is a no-op when it exists
+        for name in self.collections:
+            for keys, options in INDEXES.get(name, []):
+                try:
+                    await self.db[name].create_index(keys, **options)
+                except PyMongoError as e:
+                    logger.error("could not create index", extra={"collection": name, "keys": keys, "error": str(e)})
+
+    async def connect(self):
+        await self.ensure_indexes()
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def query_stats(self):
+        return {
+            key: {**stat, "avg_ms": stat["total_ms"] / stat["count"] if stat["count"] else 0.0}
+            for key, stat in self.timer.stats.items()
+        }
+
+    def install(self, app):
+        # register before any other startup hook that touches a collection
+        @app.on_event("startup")
+        async def connect_db():
+            await self.connect()
+
+        @app.on_event("shutdown")
+        async def close_db():
+            self.close()
+
+        @app.get("/db-stats")
+        async def get_db_stats():
+            return self.query_stats()
@@ -0,0 +1,238 @@
+import contextvars, hmac, json, logging, os, random, threading, time
+from contextlib import contextmanager
+from collections import deque
+from fastapi import Request  # type: ignore
+from fastapi.responses import JSONResponse, PlainTextResponse  # type: ignore
+
+# request metrics, structured logging and an opt-in profiler shared by the python services.
+# install_observability(app, "service-name") adds the middleware and the /metrics endpoint;
+# common/db.py, the httpx event hooks and timed() feed the same registry
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+# per-request counters; the dict is mutated in place so motor's executor threads, which run
+# in a copy of the request context, update the same object
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def render(self):
+        # prometheus text exposition format
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+metrics = Metrics()
+
+
+def record_mongo(command, seconds):
+    metrics.observe("mongo_command_duration_seconds", seconds, command=command)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats["mongo_calls"] += 1
+        stats["mongo_seconds"] += seconds
+
+
+@contextmanager
+def timed(section):
+    # wraps CPU-heavy work (analytics, scoring, matching) so it shows up per section
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe("compute_duration_seconds", seconds, section=section)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats["compute_seconds"] += seconds
+
+
+async def _on_httpx_request(request):
+    request.extensions["start_time"] = time.perf_counter()
+
+
+async def _on_httpx_response(response):
+    seconds = time.perf_counter() - response.request.extensions.get("start_time", time.perf_counter())
+    metrics.observe("http_client_duration_seconds", seconds, host=response.request.url.host, status=response.status_code)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats["http_calls"] += 1
+        stats["http_seconds"] += seconds
+
+
+def httpx_event_hooks():
+    return {"request": [_on_httpx_request], "response": [_on_httpx_response]}
+
+
+class JsonFormatter(logging.Formatter):
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in self.RESERVED})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging():
+    root = logging.getLogger()
+    if any(isinstance(h.formatter, JsonFormatter) for h in root.handlers):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    root.addHandler(handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+
+class Profiler:
+    # opt-in: PROFILE_SAMPLE_RATE of requests (or a request whose X-Profile header carries
+    # PROFILE_TOKEN) run under a profiler, and the report is kept when the request took longer
+    # than PROFILE_SLOW_REQUEST_MS. Uses pyinstrument (sampling) when installed, else cProfile.
+    # One request is profiled at a time, the profiler sees the whole event loop thread.
+    # Without PROFILE_TOKEN the header is ignored and /debug/profiles is not mounted
+    def __init__(self):
+        self.token = os.getenv("PROFILE_TOKEN")
+        self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+        self.slow_request_seconds = float(os.getenv("PROFILE_SLOW_REQUEST_MS", 500)) / 1000
+        self.reports = deque(maxlen=int(os.getenv("PROFILE_KEEP", 20)))
+        self.busy = False
+
+    def authorized(self, request):
+        header = request.headers.get("x-profile")
+        return bool(self.token) and header is not None and hmac.compare_digest(header, self.token)
+
+    def wants(self, request):
+        if self.busy:
+            return False
+        return (self.sample_rate > 0 and random.random() < self.sample_rate) or self.authorized(request)
+
+    def start(self):
+        self.busy = True
+        try:
+            from pyinstrument import Profiler as SamplingProfiler  # type: ignore
+
+            profiler = SamplingProfiler(async_mode="enabled")
+            profiler.start()
+        except ImportError:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def stop(self, profiler, route, seconds):
+        self.busy = False
+        if hasattr(profiler, "output_text"):
+            profiler.stop()
+            report = profiler.output_text() if seconds >= self.slow_request_seconds else None
+        else:
+            import io, pstats
+
+            profiler.disable()
+            report = None
+            if seconds >= self.slow_request_seconds:
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+                report = out.getvalue()
+        if report:
+            self.reports.append({"route": route, "seconds": seconds, "at": time.time(), "report": report})
+
+
+def install_observability(app, service):
+    configure_logging()
+    logger = logging.getLogger(service)
+    profiler = Profiler()
+
+    @app.middleware("http")
+    async def observe_request(request: Request, call_next):
+        stats = {"mongo_calls": 0, "mongo_seconds": 0.0, "http_calls": 0, "http_seconds": 0.0, "compute_seconds": 0.0}
+        token = _request_stats.set(stats)
+        active_profiler = profiler.start() if profiler.wants(request) else None
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            seconds = time.perf_counter() - start
+            _request_stats.reset(token)
+            # the route template, not the raw path, so ids do not explode the label set
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            metrics.observe("http_request_duration_seconds", seconds, service=service, route=route, method=request.method, status=status)
+            metrics.observe("mongo_calls_per_request", stats["mongo_calls"], buckets=COUNT_BUCKETS, service=service, route=route)
+            if active_profiler is not None:
+                profiler.stop(active_profiler, route, seconds)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("request", extra={"route": route, "status": status, "seconds": round(seconds, 6), **stats})
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def get_metrics():
+        return metrics.render()
+
+    if profiler.token:
+        @app.get("/debug/profiles")
+        async def get_profiles(request: Request):
+            if not profiler.authorized(request):
+                return JSONResponse(status_code=401, content={"error": "Unauthorized"})
+            return list(profiler.reports)
+
+    return logger
@@ -0,0 +1,85 @@
+import datetime, json, math, os
+from bson import ObjectId  # type: ignore
+from fastapi.encoders import jsonable_encoder  # type: ignore
+from fastapi.responses import Response  # type: ignore
+
+# response encoding shared by the python services. JSON goes through orjson when
+# FAST_JSON_ENABLED is set and the orjson package is installed, otherwise through the same
+# json.dumps FastAPI's JSONResponse uses; both give the same bytes for the documents these
+# services send, NaN and infinities included, which both write as null. Callers
+# that send "Accept: application/msgpack" get MessagePack instead (needs the msgpack
+# package). ObjectIds are sent as strings and datetimes as ISO 8601 in every format, any other
+# type JSON cannot hold is an error rather than some str() of it
+
+FAST_JSON_ENABLED = os.getenv("FAST_JSON_ENABLED", "false").lower() == "true"
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack  # type: ignore
+except ImportError:
+    msgpack = None
+
+
+def to_native(value):
+    # numpy scalars and arrays (e.g. float64 left over from array code) as python values,
+    # so a document is stored, and later read back, with plain bson types. NaN and
+    # infinities (a statistic over too few months) become None, JSON has no such numbers
+    if isinstance(value, dict):
+        return {key: to_native(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_native(item) for item in value]
+    if type(value).__module__ == "numpy":
+        return to_native(value.tolist())
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def _default(value):
+    # what orjson and msgpack cannot encode themselves (orjson hands dates and times over
+    # too, see OPT_PASSTHROUGH_DATETIME)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    if type(value).__module__ == "numpy":
+        return value.tolist()
+    raise TypeError(f"Type is not serializable: {type(value).__name__}")
+
+
+def encode_json(value, fast=None):
+    fast = FAST_JSON_ENABLED if fast is None else fast
+    if fast and orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME)
+    # the same bytes FastAPI's JSONResponse would send for the value, except that documents
+    # stored before to_native dropped NaN still have some, which are sent as null like orjson
+    # does rather than failing the response
+    return json.dumps(
+        to_native(jsonable_encoder(value, custom_encoder={ObjectId: str})), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def encode_msgpack(value):
+    return msgpack.packb(value, default=_default, datetime=False)
+
+
+def negotiate(request):
+    # MSGPACK when the caller asks for it and it can be produced, JSON otherwise
+    if msgpack is not None and MSGPACK in request.headers.get("accept", ""):
+        return MSGPACK
+    return JSON
+
+
+def encode(value, media_type=JSON):
+    return encode_msgpack(value) if media_type == MSGPACK else encode_json(value)
+
+
+def respond(request, value, headers=None):
+    media_type = negotiate(request)
+    return Response(encode(value, media_type), media_type=media_type, headers={"Vary": "Accept", **(headers or {})})
@@ -0,0 +1,101 @@
+import asyncio, os, time
+from common.observability import metrics
+
+# request coalescing: concurrent calls for the same key share one in-flight computation and
+# its result, and the result is kept for SINGLE_FLIGHT_MEMO_SECONDS so a burst of retries
+# and refreshes right after it does not start another one. The computation runs as its own
+# task, a caller that gives up (client disconnect) does not cancel it for the others.
+# Results are shared between callers and must not be mutated
+
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+SINGLE_FLIGHT_MEMO_SECONDS = float(os.getenv("SINGLE_FLIGHT_MEMO_SECONDS", 1))
+
+
+class SingleFlight:
+    def __init__(self, name, memo_seconds=SINGLE_FLIGHT_MEMO_SECONDS, enabled=SINGLE_FLIGHT_ENABLED):
+        self.name = name
+        self.memo_seconds = memo_seconds
+        self.enabled = enabled
+        self._inflight = {}
+        self._memo = {}
+        # bumped by forget(), a computation that overlapped one is not memoized
+        self._generation = 0
+        self.stats = {"leaders": 0, "coalesced": 0, "memo_hits": 0, "errors": 0}
+
+    def _count(self, result):
+        self.stats[result] += 1
+        metrics.inc("single_flight_calls_total", flight=self.name, result=result)
+
+    def _memoized(self, key):
+        entry = self._memo.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._memo[key]
+            return None
+        return entry
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in self._memo.items() if expires_at < now]:
+            del self._memo[key]
+
+    async def _run(self, key, fn):
+        generation = self._generation
+        try:
+            value = await fn()
+        except Exception:
+            self._count("errors")
+            raise
+        if self.memo_seconds > 0 and generation == self._generation:
+            if len(self._memo) > 10000:
+                self._prune()
+            self._memo[key] = (time.monotonic() + self.memo_seconds, value)
+        return value
+
+    async def do(self, key, fn):
+        # fn() is awaited at most once per key at a time; everyone gets its result (or error)
+        if not self.enabled:
+            return await fn()
+        entry = self._memoized(key)
+        if entry is not None:
+            self._count("memo_hits")
+            return entry[1]
+        task = self._inflight.get(key)
+        if task is None:
+            self._count("leaders")
+            task = self._inflight[key] = asyncio.ensure_future(self._run(key, fn))
+            task.add_done_callback(lambda done: self._done(key, done))
+        else:
+            self._count("coalesced")
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        # forget() may already have replaced it with a newer computation
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # marks an error as retrieved, when every caller gave up nobody else awaits it
+            task.exception()
+
+    def forget(self, key):
+        # the data behind key changed: later calls compute again instead of sharing the
+        # running computation or its memoized result
+        self._generation += 1
+        self._memo.pop(key, None)
+        self._inflight.pop(key, None)
+
+    def clear(self):
+        self._generation += 1
+        self._memo.clear()
+        self._inflight.clear()
+
+    def get_metrics(self):
+        calls = self.stats["leaders"] + self.stats["coalesced"] + self.stats["memo_hits"]
+        return {
+            **self.stats,
+            "computations_per_call": self.stats["leaders"] / calls if calls else 0.0,
+            "inflight": len(self._inflight),
+            "memoized": len(self._memo),
+        }
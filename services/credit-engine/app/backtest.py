@@ -0,0 +1,324 @@
+import numpy as np  # type: ignore
+import argparse, asyncio, json, os, time
+from concurrent.futures import ProcessPoolExecutor
+from app.batch_scoring import SCORE_FIELDS, SCORE_WINDOW, analytics_to_frame, score_frame, synthetic_analytics
+
+# what-if backtesting of credit policies: a policy is a declarative rule set (the same shape
+# as cal_credit_score / cal_credit_limit / risk_category, but data instead of code), every
+# stored bank_analytics document is streamed in batches and each batch is scored under all
+# candidate policies at once in a worker process. Workers only return aggregates (score
+# histogram, category counts, migrations against the baseline and limit exposure), so the
+# report costs the same memory for a thousand users as for a million
+#
+# policy = {
+#     "name": "baseline",
+#     "base_score": 300, "min_score": 300, "max_score": 900,
+#     # each rule is an if/elif chain on one field: the first matching [op, value, points] applies
+#     "rules": [{"field": "total_credit", "when": [[">", 500000, 100]]}, ...],
+#     # highest min_score first, the last category takes every remaining score
+#     "categories": [{"name": "Low Risk", "min_score": 750, "limit_multiplier": 5}, ...],
+# }
+
+OPS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+POLICY_FIELDS = [*SCORE_FIELDS, "monthly_positive_cashflow", "minimum_maintained_balance"]
+# scores are integers, one histogram bin per point gives exact percentiles
+SCORE_BINS = 1001
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", os.cpu_count() or 1))
+BACKTEST_BATCH_SIZE = int(os.getenv("BACKTEST_BATCH_SIZE", 10000))
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# mirrors cal_credit_score / cal_credit_limit / risk_category in main.py
+BASELINE_POLICY = {
+    "name": "baseline",
+    "base_score": 300,
+    "min_score": 300,
+    "max_score": 900,
+    "rules": [
+        {"field": "total_credit", "when": [[">", 500000, 100]]},
+        {"field": "total_debit", "when": [[">", 500000, -50]]},
+        {"field": "debit_to_credit_ratio", "when": [["<", 1, 100], ["<", 0.75, 50], [">", 1, -50]]},
+        {"field": "average_tx_amount", "when": [[">", 10000, 50], ["<", 1000, -50]]},
+        {"field": "cash_flow_stability", "when": [[">", 0.7, 100], ["<", 0.5, -100]]},
+        {"field": "balance_voltality", "when": [["<", 0.7, 150], [">", 1, -50]]},
+        {"field": "monthly_positive_cashflow", "when": [[">", 6, 150]]},
+        {"field": "minimum_maintained_balance", "when": [["<", 1000, -50]]},
+    ],
+    "categories": [
+        {"name": "Low Risk", "min_score": 750, "limit_multiplier": 5},
+        {"name": "Medium Risk", "min_score": 600, "limit_multiplier": 3},
+        {"name": "High Risk", "min_score": 300, "limit_multiplier": 1.5},
+    ],
+}
+
+
+def load_policy(spec):
+    # fills defaults from the baseline and rejects anything the evaluator cannot run,
+    # so a typo fails before the portfolio is streamed rather than halfway through
+    policy = {key: spec.get(key, BASELINE_POLICY[key]) for key in BASELINE_POLICY}
+    if "name" not in spec:
+        raise ValueError("policy needs a name")
+    for rule in policy["rules"]:
+        if rule.get("field") not in POLICY_FIELDS:
+            raise ValueError(f"{policy['name']}: unknown field {rule.get('field')!r}, expected one of {POLICY_FIELDS}")
+        for op, _, _ in rule["when"]:
+            if op not in OPS:
+                raise ValueError(f"{policy['name']}: unknown operator {op!r} on {rule['field']}")
+    if not policy["categories"]:
+        raise ValueError(f"{policy['name']}: needs at least one category")
+    policy["categories"] = sorted(policy["categories"], key=lambda c: c["min_score"], reverse=True)
+    return policy
+
+
+def load_policies(specs):
+    policies = [load_policy(spec) for spec in specs]
+    names = [policy["name"] for policy in policies]
+    if len(set(names)) != len(names):
+        raise ValueError("policy names must be unique")
+    return policies
+
+
+def policy_scores(columns, policy):
+    n = len(columns["average_maintained_balance"])
+    score = np.full(n, policy["base_score"], dtype=np.int64)
+    for rule in policy["rules"]:
+        values = columns[rule["field"]]
+        # missing values compare false everywhere and add nothing, as in cal_credit_scores
+        conditions = [OPS[op](values, threshold) for op, threshold, _ in rule["when"]]
+        score += np.select(conditions, [int(points) for _, _, points in rule["when"]], 0)
+    return np.clip(score, policy["min_score"], policy["max_score"])
+
+
+def policy_categories(scores, policy):
+    categories = policy["categories"]
+    if len(categories) == 1:
+        return np.zeros(len(scores), dtype=np.int64)
+    return np.select(
+        [scores >= category["min_score"] for category in categories[:-1]],
+        list(range(len(categories) - 1)),
+        len(categories) - 1,
+    )
+
+
+def evaluate(columns, policy):
+    scores = policy_scores(columns, policy)
+    categories = policy_categories(scores, policy)
+    multipliers = np.array([category["limit_multiplier"] for category in policy["categories"]], dtype=float)
+    limits = columns["average_maintained_balance"] * multipliers[categories]
+    return scores, categories, limits
+
+
+def new_summary(policy, baseline):
+    n_categories = len(policy["categories"])
+    return {
+        "users": 0,
+        "score_hist": np.zeros(SCORE_BINS, dtype=np.int64),
+        "category_counts": np.zeros(n_categories, dtype=np.int64),
+        "exposure": np.zeros(n_categories, dtype=float),
+        "migration": np.zeros((len(baseline["categories"]), n_categories), dtype=np.int64),
+    }
+
+
+_policies = None
+
+
+def _init_worker(policies):
+    global _policies
+    _policies = policies
+
+
+def evaluate_batch(columns, policies=None):
+    # runs in a worker process; returns one partial summary per policy, the baseline is the
+    # first policy and every migration matrix is counted against it
+    policies = policies or _policies
+    baseline = policies[0]
+    _, baseline_categories, _ = evaluate(columns, baseline)
+    summaries = []
+    for policy in policies:
+        scores, categories, limits = evaluate(columns, policy)
+        summary = new_summary(policy, baseline)
+        summary["users"] = len(scores)
+        summary["score_hist"] += np.bincount(np.clip(scores, 0, SCORE_BINS - 1), minlength=SCORE_BINS)
+        summary["category_counts"] += np.bincount(categories, minlength=len(policy["categories"]))
+        summary["exposure"] += np.bincount(categories, weights=np.nan_to_num(limits), minlength=len(policy["categories"]))
+        np.add.at(summary["migration"], (baseline_categories, categories), 1)
+        summaries.append(summary)
+    return summaries
+
+
+def merge_summaries(totals, partials):
+    for total, partial in zip(totals, partials):
+        for key in total:
+            total[key] += partial[key]
+    return totals
+
+
+def frame_to_columns(df, fields):
+    return {field: np.asarray(df[field], dtype=float) for field in fields}
+
+
+def columns_needed(policies):
+    fields = {rule["field"] for policy in policies for rule in policy["rules"]}
+    return sorted(fields | {"average_maintained_balance"})
+
+
+def percentile(hist, q):
+    cumulative = np.cumsum(hist)
+    if not cumulative[-1]:
+        return None
+    return int(np.searchsorted(cumulative, cumulative[-1] * q / 100))
+
+
+def build_report(policies, totals, elapsed):
+    baseline = policies[0]
+    report = {"users": int(totals[0]["users"]), "seconds": round(elapsed, 3), "baseline": baseline["name"], "policies": []}
+    for policy, total in zip(policies, totals):
+        hist = total["score_hist"]
+        users = int(total["users"])
+        names = [category["name"] for category in policy["categories"]]
+        report["policies"].append({
+            "name": policy["name"],
+            "score": {
+                "mean": float((hist * np.arange(SCORE_BINS)).sum() / users) if users else None,
+                **{f"p{q}": percentile(hist, q) for q in PERCENTILES},
+            },
+            "categories": {name: int(count) for name, count in zip(names, total["category_counts"])},
+            "limit_exposure": {
+                "total": float(total["exposure"].sum()),
+                **{name: float(exposure) for name, exposure in zip(names, total["exposure"])},
+            },
+            "migration_from_baseline": {
+                from_category["name"]: {name: int(count) for name, count in zip(names, row) if count}
+                for from_category, row in zip(baseline["categories"], total["migration"])
+            },
+        })
+    return report
+
+
+async def run_backtest(batches, policies, workers=BACKTEST_WORKERS):
+    # batches is an async iterator of column dicts; at most two batches per worker are in
+    # flight so a fast cursor cannot pile the whole portfolio up in memory
+    loop = asyncio.get_running_loop()
+    baseline = policies[0]
+    totals = [new_summary(policy, baseline) for policy in policies]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(policies,)) as pool:
+        in_flight = set()
+        async for columns in batches:
+            if len(in_flight) >= workers * 2:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    merge_summaries(totals, future.result())
+            in_flight.add(loop.run_in_executor(pool, evaluate_batch, columns))
+        for partials in await asyncio.gather(*in_flight):
+            merge_summaries(totals, partials)
+    return build_report(policies, totals, time.perf_counter() - start)
+
+
+async def analytics_batches(bank_analytics, fields, batch_size=BACKTEST_BATCH_SIZE):
+    projection = {field: 1 for field in SCORE_FIELDS}
+    projection.update({
+        "user_id": 1, "minmum_maintained_balance": 1, f"rolling.{SCORE_WINDOW}": 1,
+        "monthly_data.monthly_inflow": 1, "monthly_data.monthly_outflow": 1,
+    })
+    batch = []
+    async for analytics in bank_analytics.find({}, projection).batch_size(batch_size):
+        batch.append(analytics)
+        if len(batch) >= batch_size:
+            yield frame_to_columns(analytics_to_frame(batch), fields)
+            batch = []
+    if batch:
+        yield frame_to_columns(analytics_to_frame(batch), fields)
+
+
+def synthetic_columns(n, seed=0):
+    # column-level stand-in for a stored portfolio, building a million documents in python
+    # would measure the generator instead of the backtest
+    rng = np.random.default_rng(seed)
+    return {
+        "total_credit": rng.uniform(0, 2400000, n),
+        "total_debit": rng.uniform(0, 2400000, n),
+        "debit_to_credit_ratio": rng.uniform(0, 2, n),
+        "average_tx_amount": rng.uniform(0, 20000, n),
+        "cash_flow_stability": rng.uniform(-1, 1, n),
+        "balance_voltality": rng.uniform(0, 2, n),
+        "average_maintained_balance": rng.uniform(0, 100000, n),
+        "monthly_positive_cashflow": rng.integers(0, 13, n).astype(float),
+        "minimum_maintained_balance": rng.uniform(0, 5000, n),
+    }
+
+
+async def synthetic_batches(n, fields, batch_size=BACKTEST_BATCH_SIZE):
+    for offset in range(0, n, batch_size):
+        columns = synthetic_columns(min(batch_size, n - offset), seed=offset)
+        yield {field: columns[field] for field in fields}
+
+
+def check_baseline(n=10000):
+    # the baseline policy has to score exactly like the live path
+    docs = synthetic_analytics(n)
+    df = analytics_to_frame(docs)
+    expected = score_frame(df)
+    scores, categories, limits = evaluate(frame_to_columns(df, POLICY_FIELDS), load_policy(BASELINE_POLICY))
+    names = np.array([category["name"] for category in BASELINE_POLICY["categories"]])
+    assert (scores == expected["credit_score"]).all(), "baseline policy scores differ from cal_credit_scores"
+    assert (names[categories] == expected["risk_category"]).all(), "baseline policy categories differ"
+    assert np.allclose(limits, np.asarray(expected["credit_limit"], dtype=float)), "baseline policy limits differ"
+
+
+def read_policies(path):
+    specs = json.load(open(path)) if path else []
+    if isinstance(specs, dict):
+        specs = [specs]
+    # the baseline always comes first so migrations are measured against what is live today
+    if not any(spec.get("name") == BASELINE_POLICY["name"] for spec in specs):
+        specs = [BASELINE_POLICY, *specs]
+    else:
+        specs = sorted(specs, key=lambda spec: spec.get("name") != BASELINE_POLICY["name"])
+    return load_policies(specs)
+
+
+async def backtest_portfolio(policies, workers, batch_size):
+    from dotenv import load_dotenv  # type: ignore
+    from common.db import Database
+
+    load_dotenv()
+    db = Database(appname="credit-engine-backtest")
+    try:
+        batches = analytics_batches(db.collection("bank_analytics"), columns_needed(policies), batch_size)
+        return await run_backtest(batches, policies, workers)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    # python -m app.backtest policies.json                -> backtest against every stored bank_analytics
+    # python -m app.backtest policies.json --synthetic 1000000 -> same report over generated users
+    parser = argparse.ArgumentParser(description="What-if backtesting of credit policies")
+    parser.add_argument("policies", nargs="?", help="JSON file with one policy or a list of policies")
+    parser.add_argument("--workers", type=int, default=BACKTEST_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=BACKTEST_BATCH_SIZE)
+    parser.add_argument("--synthetic", type=int, help="score this many generated users instead of mongo")
+    parser.add_argument("--out", help="write the report here instead of stdout")
+    args = parser.parse_args()
+
+    policies = read_policies(args.policies)
+    if args.synthetic:
+        check_baseline()
+        batches = synthetic_batches(args.synthetic, columns_needed(policies), args.batch_size)
+        report = asyncio.run(run_backtest(batches, policies, args.workers))
+    else:
+        report = asyncio.run(backtest_portfolio(policies, args.workers, args.batch_size))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"backtested {report['users']} users x {len(policies)} policies in {report['seconds']}s -> {args.out}")
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,262 @@
+import numpy as np  # type: ignore
+import argparse, asyncio, itertools, operator, time
+from bson import ObjectId  # type: ignore
+
+# vectorized versions of cal_credit_score / cal_credit_limit / risk_category in main.py
+# every rule has to stay in sync with the per-user path so both return the same result.
+# A "frame" here is a dict of equally long numpy columns, the scoring only needs columns
+# and pandas alone took longer to import than the rest of the service
+
+SCORE_FIELDS = [
+    "total_credit",
+    "total_debit",
+    "debit_to_credit_ratio",
+    "average_tx_amount",
+    "cash_flow_stability",
+    "balance_voltality",
+    "average_maintained_balance",
+]
+FEATURE_FIELDS = [*SCORE_FIELDS, "monthly_positive_cashflow", "minimum_maintained_balance"]
+BATCH_SIZE = 1000
+# aa-service precomputes rolling windows of the cash-flow features (analytics["rolling"]);
+# the score looks at the trailing year, however much history the analytics cover
+SCORE_WINDOW = "12m"
+# FEATURE_FIELDS as named in a rolling window of aa-service (analytics["rolling"][SCORE_WINDOW])
+window_row = operator.itemgetter(
+    "inflow",
+    "outflow",
+    "debit_to_credit_ratio",
+    "average_tx_amount",
+    "cash_flow_stability",
+    "balance_volatility",
+    "balance_mean",
+    "positive_cashflow_months",
+    "balance_min",
+)
+
+
+def feature_row(analytics):
+    # the inputs of cal_credit_score for one bank_analytics document, in FEATURE_FIELDS
+    # order. Analytics written before the rolling windows existed fall back to the
+    # whole-range fields, where the minimum balance is stored as "minmum_maintained_balance"
+    window = (analytics.get("rolling") or {}).get(SCORE_WINDOW)
+    if window:
+        return window_row(window)
+    positive_months = sum(
+        1 for month in analytics.get("monthly_data", [])
+        if month["monthly_inflow"] - month["monthly_outflow"] > 0
+    )
+    return (*(analytics.get(field) for field in SCORE_FIELDS), positive_months, analytics.get("minmum_maintained_balance"))
+
+
+def score_features(analytics):
+    # statistics aa-service could not compute are stored as None (NaN before that), every
+    # comparison against NaN is False like in the batch path
+    return {field: np.nan if value is None else value for field, value in zip(FEATURE_FIELDS, feature_row(analytics))}
+
+
+def analytics_to_frame(analytics_docs):
+    # one tuple per document straight out of its rolling window, and one float array of all
+    # of them; per-field lists or a dict per row cost more than the scoring itself
+    rows = [feature_row(analytics) for analytics in analytics_docs]
+    try:
+        values = np.fromiter(itertools.chain.from_iterable(rows), dtype=float, count=len(rows) * len(FEATURE_FIELDS))
+    except TypeError:
+        # some statistic is None, np.array makes those NaN (fromiter cannot)
+        values = np.array(rows, dtype=float)
+    values = values.reshape(len(rows), len(FEATURE_FIELDS)).T.copy()
+    frame = dict(zip(FEATURE_FIELDS, values))
+    frame["user_id"] = np.empty(len(analytics_docs), dtype=object)
+    frame["user_id"][:] = [analytics.get("user_id") for analytics in analytics_docs]
+    return frame
+
+
+def cal_credit_scores(df):
+    score = np.full(len(df["user_id"]), 300, dtype=np.int64)
+
+    score += np.where(df["total_credit"] > 500000, 100, 0)
+    score -= np.where(df["total_debit"] > 500000, 50, 0)
+
+    # the "< 0.75" branch of cal_credit_score is unreachable behind "< 1", so it is left out here
+    ratio = df["debit_to_credit_ratio"]
+    score += np.select([ratio < 1, ratio > 1], [100, -50], 0)
+
+    avg_tx = df["average_tx_amount"]
+    score += np.select([avg_tx > 10000, avg_tx < 1000], [50, -50], 0)
+
+    stability = df["cash_flow_stability"]
+    score += np.select([stability > 0.7, stability < 0.5], [100, -100], 0)
+
+    volatility = df["balance_voltality"]
+    score += np.select([volatility < 0.7, volatility > 1], [150, -50], 0)
+
+    score += np.where(df["monthly_positive_cashflow"] > 6, 150, 0)
+    score -= np.where(df["minimum_maintained_balance"] < 1000, 50, 0)
+
+    return np.clip(score, 300, 900)
+
+
+def cal_credit_limits(scores, balances):
+    balances = np.asarray(balances, dtype=float)
+    return np.select([scores >= 750, scores >= 600], [balances * 5, balances * 3], balances * 1.5)
+
+
+def risk_categories(scores):
+    return np.select([scores >= 750, scores >= 600], ["Low Risk", "Medium Risk"], "High Risk")
+
+
+def score_frame(df):
+    scores = cal_credit_scores(df)
+    return {
+        "user_id": df["user_id"],
+        "credit_score": scores,
+        "credit_limit": cal_credit_limits(scores, df["average_maintained_balance"]),
+        "risk_category": risk_categories(scores),
+    }
+
+
+def frame_to_risk_data(result):
+    # tolist() gives native python types so the result can go straight into JSON / mongo
+    return [
+        {
+            "user_id": str(user_id),
+            "credit_score": score,
+            "credit_limit": limit,
+            "risk_category": category,
+        }
+        for user_id, score, limit, category in zip(
+            result["user_id"].tolist(),
+            result["credit_score"].tolist(),
+            result["credit_limit"].astype(float).tolist(),
+            result["risk_category"].tolist(),
+        )
+    ]
+
+
+def newer(analytics, current):
+    if current.get("updated_at") is None:
+        return True
+    return analytics.get("updated_at") is not None and analytics["updated_at"] > current["updated_at"]
+
+
+async def score_users(bank_analytics, user_ids):
+    # one result per distinct user id, in the order they were asked for, and the ids without
+    # analytics under "missing". A malformed id raises bson's InvalidId
+    user_obj_ids = list(dict.fromkeys(ObjectId(user_id) for user_id in user_ids))
+    analytics_by_user = {}
+    async for analytics in bank_analytics.find({"user_id": {"$in": user_obj_ids}}):
+        # users from before the one-document-per-user upsert can have several, the newest counts
+        current = analytics_by_user.get(analytics["user_id"])
+        if current is None or newer(analytics, current):
+            analytics_by_user[analytics["user_id"]] = analytics
+    found = [analytics_by_user[user_id] for user_id in user_obj_ids if user_id in analytics_by_user]
+    return {
+        "results": frame_to_risk_data(score_frame(analytics_to_frame(found))),
+        "missing": [str(user_id) for user_id in user_obj_ids if user_id not in analytics_by_user],
+    }
+
+
+async def score_cursor(bank_analytics, query=None, batch_size=BATCH_SIZE):
+    cursor = bank_analytics.find(query or {}).batch_size(batch_size)
+    batch = []
+    async for analytics in cursor:
+        batch.append(analytics)
+        if len(batch) >= batch_size:
+            yield frame_to_risk_data(score_frame(analytics_to_frame(batch)))
+            batch = []
+    if batch:
+        yield frame_to_risk_data(score_frame(analytics_to_frame(batch)))
+
+
+def synthetic_analytics(n, seed=0):
+    rng = np.random.default_rng(seed)
+    docs = []
+    for i in range(n):
+        inflow = rng.uniform(0, 200000, 12)
+        outflow = rng.uniform(0, 200000, 12)
+        doc = {
+            "user_id": ObjectId(),
+            "total_credit": float(inflow.sum()),
+            "total_debit": float(outflow.sum()),
+            "debit_to_credit_ratio": float(outflow.sum() / inflow.sum()),
+            "average_tx_amount": float(rng.uniform(0, 20000)),
+            "cash_flow_stability": float(rng.uniform(-1, 1)),
+            "balance_voltality": float(rng.uniform(0, 2)),
+            "average_maintained_balance": float(rng.uniform(0, 100000)),
+            "minmum_maintained_balance": float(rng.uniform(0, 5000)),
+            "monthly_data": [
+                {"monthly_inflow": float(a), "monthly_outflow": float(b)} for a, b in zip(inflow, outflow)
+            ],
+        }
+        # a year of history, so the trailing window holds the same numbers as the whole range
+        doc["rolling"] = {SCORE_WINDOW: {
+            "inflow": doc["total_credit"],
+            "outflow": doc["total_debit"],
+            "debit_to_credit_ratio": doc["debit_to_credit_ratio"],
+            "average_tx_amount": doc["average_tx_amount"],
+            "cash_flow_stability": doc["cash_flow_stability"],
+            "balance_volatility": doc["balance_voltality"],
+            "balance_mean": doc["average_maintained_balance"],
+            "positive_cashflow_months": int((inflow - outflow > 0).sum()),
+            "balance_min": doc["minmum_maintained_balance"],
+        }}
+        docs.append(doc)
+    return docs
+
+
+def benchmark(sizes=(1000, 10000, 100000)):
+    from app.main import cal_credit_score, cal_credit_limit, risk_category
+
+    for n in sizes:
+        docs = synthetic_analytics(n)
+
+        # both paths produce the same risk data documents
+        start = time.perf_counter()
+        expected = []
+        for analytics in docs:
+            score = cal_credit_score(analytics)
+            expected.append({
+                "user_id": str(analytics["user_id"]),
+                "credit_score": score,
+                "credit_limit": cal_credit_limit(score, analytics["average_maintained_balance"]),
+                "risk_category": risk_category(score),
+            })
+        per_user = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = frame_to_risk_data(score_frame(analytics_to_frame(docs)))
+        batched = time.perf_counter() - start
+
+        assert result == expected, "batch scoring does not match cal_credit_score"
+        print(f"{n:>7} users | per-user {n / per_user:>12,.0f} users/s | batch {n / batched:>12,.0f} users/s")
+
+
+async def rescore_all(batch_size):
+    from dotenv import load_dotenv  # type: ignore
+    from common.db import Database
+
+    load_dotenv()
+    db = Database(appname="credit-engine-batch")
+    bank_analytics = db.collection("bank_analytics")
+    total = 0
+    start = time.perf_counter()
+    async for risk_data in score_cursor(bank_analytics, batch_size=batch_size):
+        for row in risk_data:
+            print(row)
+        total += len(risk_data)
+    elapsed = time.perf_counter() - start
+    print(f"scored {total} users in {elapsed:.2f}s")
+    db.close()
+
+
+if __name__ == "__main__":
+    # python -m app.batch_scoring            -> re-score every stored bank_analytics document
+    # python -m app.batch_scoring --benchmark -> users/second at 1k, 10k and 100k users
+    parser = argparse.ArgumentParser(description="Batch credit scoring over bank_analytics")
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark()
+    else:
+        asyncio.run(rescore_all(args.batch_size))
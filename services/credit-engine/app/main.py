@@ -1,18 +1,25 @@
-from fastapi import FastAPI # type: ignore
+from fastapi import FastAPI, Request # type: ignore
 from fastapi.middleware.cors import CORSMiddleware # type: ignore
 import os
 from dotenv import load_dotenv # type: ignore
-import motor.motor_asyncio  # type: ignore
 from bson import ObjectId # type: ignore
+from bson.errors import InvalidId # type: ignore
+from fastapi.responses import JSONResponse # type: ignore
+from pydantic import BaseModel # type: ignore
+from app.batch_scoring import score_features, score_users
+from app.risk_store import RiskMaterializer
+from common.db import Database
+from common.observability import install_observability
+from common.serialization import respond
+from common.singleflight import SingleFlight
 
 load_dotenv()
 URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME")
-client = motor.motor_asyncio.AsyncIOMotorClient(URI)
-db = client[DB_NAME]
-user_profiles = db["user_profiles"]
-bank_analytics = db["bank_analytics"]
-risk_data_list = db["risk_data_list"]
+db = Database(URI, DB_NAME, appname="credit-engine")
+user_profiles = db.collection("user_profiles")
+bank_analytics = db.collection("bank_analytics")
+risk_data_list = db.collection("risk_data_list")
 
 app = FastAPI()
 app.add_middleware(
@@ -21,8 +28,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+db.install(app)
+install_observability(app, "credit-engine")
 
 def cal_credit_score(analytics):
+    # trailing 12-month features when aa-service has them, see score_features
+    analytics = score_features(analytics)
     score = 300
 
     if analytics['total_credit'] > 500000: score += 100
@@ -41,13 +52,9 @@ def cal_credit_score(analytics):
     if analytics['balance_voltality'] < 0.7: score += 150
     elif analytics['balance_voltality'] > 1: score -= 50
 
-    monthly_positive_cashflow = sum(
-        1 for month in analytics['monthly_data'] 
-        if month['monthly_inflow'] - month['monthly_outflow'] > 0
-    )
-    if monthly_positive_cashflow > 6: score += 150
+    if analytics['monthly_positive_cashflow'] > 6: score += 150
 
-    if analytics.get('minimum_maintained_balance', 0) < 1000: 
+    if analytics['minimum_maintained_balance'] < 1000: 
         score -= 50
 
     return min(900, max(300, score))
@@ -63,13 +70,49 @@ def risk_category(score):
         elif score >= 600: return "Medium Risk"
         else: return "High Risk"  
  
+# a dashboard load, its retries and refreshes ask for the same user's risk data together,
+# they share one lookup (and on a miss one scoring); rescored users are dropped from the memo
+risk_flight = SingleFlight("risk")
+
+def forget_risk(user_ids):
+    for user_id in user_ids:
+        risk_flight.forget(str(user_id))
+
+risk_materializer = RiskMaterializer(bank_analytics, risk_data_list, on_recomputed=forget_risk)
+
+@app.on_event("startup")
+async def start_risk_materializer():
+    risk_materializer.start()
+
+@app.on_event("shutdown")
+async def stop_risk_materializer():
+    risk_materializer.stop()
+
+@app.get("/single-flight-metrics")
+async def get_single_flight_metrics():
+    return {"risk": risk_flight.get_metrics()}
+
 @app.get("/get-risk-data/{user_id}")
-async def get_risk_data(user_id : str):
+async def get_risk_data(user_id : str, request : Request):
+            # served from the materialized risk_data_list document, recomputed on bank_analytics writes
+            stored = await risk_flight.do(user_id, lambda: risk_materializer.get(ObjectId(user_id)))
+            if not stored:
+                return {"error": "Analytics data not found"}
             risk_data = {}
-            analytics = await bank_analytics.find_one({"user_id": ObjectId(user_id)})
-            print(analytics)
-            risk_data['credit_score'] = cal_credit_score(analytics)
-            risk_data['credit_limit'] = cal_credit_limit(risk_data['credit_score'],analytics['average_maintained_balance'])
-            risk_data['risk_category'] = risk_category(risk_data['credit_score'])
-            return risk_data
+            risk_data['credit_score'] = stored['credit_score']
+            risk_data['credit_limit'] = stored['credit_limit']
+            risk_data['risk_category'] = stored['risk_category']
+            risk_data['model_version'] = stored['model_version']
+            # JSON, or MessagePack for internal callers that ask for it
+            return respond(request, risk_data)
+
+class BatchRiskInput(BaseModel):
+    user_ids: list[str]
 
+@app.post("/get-risk-data/batch")
+async def get_risk_data_batch(data : BatchRiskInput):
+            # one $in query for the whole batch, scored column-wise in app/batch_scoring.py
+            try:
+                return await score_users(bank_analytics, data.user_ids)
+            except InvalidId as e:
+                return JSONResponse(status_code=400, content={"error": str(e)})
@@ -0,0 +1,152 @@
+import asyncio, logging, os
+from datetime import datetime, timezone
+from pymongo import UpdateOne  # type: ignore
+from pymongo.errors import PyMongoError  # type: ignore
+from app.batch_scoring import analytics_to_frame, score_frame
+from common.observability import timed
+
+logger = logging.getLogger(__name__)
+
+# materialized risk data: one document per user in risk_data_list, recomputed whenever the
+# user's bank_analytics document is written. Reads are a single indexed lookup and
+# loan-matching reads the same collection directly
+
+# bump when cal_credit_score / cal_credit_limit / risk_category change, stored documents
+# with another tag are treated as missing and recomputed on read
+SCORE_MODEL_VERSION = "v3"
+RECOMPUTE_BATCH_SIZE = int(os.getenv("RISK_RECOMPUTE_BATCH_SIZE", 500))
+POLL_INTERVAL_SECONDS = float(os.getenv("RISK_POLL_INTERVAL_SECONDS", 5))
+
+
+async def recompute(bank_analytics, risk_data_list, user_ids):
+    analytics_docs = await bank_analytics.find({"user_id": {"$in": list(user_ids)}}).to_list(length=None)
+    if not analytics_docs:
+        return []
+    with timed("scoring"):
+        result = score_frame(analytics_to_frame(analytics_docs))
+    now = datetime.now(timezone.utc)
+    updated_at = {doc["user_id"]: doc.get("updated_at") for doc in analytics_docs}
+    risk_docs = [
+        {
+            "user_id": user_id,
+            "credit_score": score,
+            "credit_limit": limit,
+            "risk_category": category,
+            "model_version": SCORE_MODEL_VERSION,
+            "analytics_updated_at": updated_at[user_id],
+            "computed_at": now,
+        }
+        for user_id, score, limit, category in zip(
+            result["user_id"].tolist(),
+            result["credit_score"].tolist(),
+            result["credit_limit"].astype(float).tolist(),
+            result["risk_category"].tolist(),
+        )
+    ]
+    await risk_data_list.bulk_write(
+        [UpdateOne({"user_id": doc["user_id"]}, {"$set": doc}, upsert=True) for doc in risk_docs],
+        ordered=False,
+    )
+    return risk_docs
+
+
+class RiskMaterializer:
+    def __init__(self, bank_analytics, risk_data_list, on_recomputed=None):
+        self.bank_analytics = bank_analytics
+        self.risk_data_list = risk_data_list
+        # called with the user ids of every recomputed batch
+        self.on_recomputed = on_recomputed
+        self.pending = set()
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self.recomputed = 0
+        self.dropped = 0
+
+    def enqueue(self, user_id):
+        self.pending.add(user_id)
+        self._wakeup.set()
+
+    async def get(self, user_id):
+        risk_data = await self.risk_data_list.find_one({"user_id": user_id, "model_version": SCORE_MODEL_VERSION})
+        if risk_data:
+            return risk_data
+        # not materialized yet (or scored by an older model), compute and store it now
+        risk_docs = await recompute(self.bank_analytics, self.risk_data_list, [user_id])
+        return risk_docs[0] if risk_docs else None
+
+    async def _drain(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self.pending:
+                batch = [self.pending.pop() for _ in range(min(RECOMPUTE_BATCH_SIZE, len(self.pending)))]
+                try:
+                    await self._recompute(batch)
+                except PyMongoError as e:
+                    logger.error("error recomputing risk data", extra={"error": str(e), "users": len(batch)})
+                    self.pending.update(batch)
+                    await asyncio.sleep(POLL_INTERVAL_SECONDS)
+                except Exception:
+                    # bad analytics rather than the database, scoring them again fails the same
+                    # way. Score the batch user by user so only the offending ones are dropped
+                    logger.exception("error scoring risk data", extra={"users": len(batch)})
+                    await self._recompute_each(batch)
+
+    async def _recompute(self, batch):
+        await recompute(self.bank_analytics, self.risk_data_list, batch)
+        self.recomputed += len(batch)
+        if self.on_recomputed:
+            self.on_recomputed(batch)
+
+    async def _recompute_each(self, batch):
+        for user_id in batch:
+            try:
+                await self._recompute([user_id])
+            except PyMongoError as e:
+                logger.error("error recomputing risk data", extra={"error": str(e), "users": 1})
+                self.pending.add(user_id)
+            except Exception:
+                # recomputed on read (get) or when the user's analytics are written again
+                logger.exception("dropping risk recompute", extra={"user_id": str(user_id)})
+                self.dropped += 1
+
+    async def _watch_changes(self):
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "replace", "update"]}}}]
+        async with self.bank_analytics.watch(pipeline, full_document="updateLookup") as stream:
+            async for change in stream:
+                full_document = change.get("fullDocument") or {}
+                if full_document.get("user_id"):
+                    self.enqueue(full_document["user_id"])
+
+    async def _poll_changes(self):
+        # change streams need a replica set; against a standalone mongod look for analytics
+        # written after the newest one already materialized
+        watermark = None
+        while True:
+            try:
+                if watermark is None:
+                    latest = await self.risk_data_list.find_one(
+                        {"analytics_updated_at": {"$ne": None}}, sort=[("analytics_updated_at", -1)]
+                    )
+                    watermark = latest["analytics_updated_at"] if latest else datetime.min
+                async for doc in self.bank_analytics.find({"updated_at": {"$gt": watermark}}, {"user_id": 1, "updated_at": 1}):
+                    self.enqueue(doc["user_id"])
+                    watermark = max(watermark, doc["updated_at"])
+            except Exception as e:
+                logger.error("error polling bank analytics", extra={"error": str(e)})
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+    async def _watch(self):
+        try:
+            await self._watch_changes()
+        except Exception as e:
+            # no change streams (standalone mongod) or the stream broke, poll from here on
+            logger.warning("watching bank analytics failed, polling instead", extra={"error": str(e)})
+            await self._poll_changes()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._drain()), asyncio.create_task(self._watch())]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
@@ -0,0 +1,42 @@
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from common.bench.harness import Benchmark, run  # noqa: E402
+from app.batch_scoring import analytics_to_frame, score_frame, synthetic_analytics  # noqa: E402
+from app.main import cal_credit_score, cal_credit_limit, risk_category  # noqa: E402
+
+# scoring kernels of credit-engine, sized by users (bank_analytics documents); generating a
+# million analytics documents takes longer than scoring them, so the default stops at 100k
+# cd services/credit-engine && PYTHONPATH=..:. python bench/kernels.py --sizes 100,1000,10000
+
+SIZES = (100, 1_000, 10_000, 100_000)
+
+
+def setup_users(size):
+    return synthetic_analytics(size, seed=size)
+
+
+def run_cal_credit_score(docs):
+    # the per-user path behind /get-risk-data when nothing is materialized
+    for analytics in docs:
+        score = cal_credit_score(analytics)
+        cal_credit_limit(score, analytics["average_maintained_balance"])
+        risk_category(score)
+
+
+def run_score_frame(docs):
+    # the batch path used by the materializer and /get-risk-data/batch
+    return score_frame(analytics_to_frame(docs))
+
+
+BENCHMARKS = [
+    Benchmark("cal_credit_score", setup_users, run_cal_credit_score, "users", sizes=SIZES),
+    Benchmark("score_frame", setup_users, run_score_frame, "users", sizes=SIZES),
+]
+
+
+if __name__ == "__main__":
+    run("credit-engine", BENCHMARKS)
@@ -1,20 +1,25 @@
-from fastapi import FastAPI # type: ignore
+from fastapi import FastAPI, Request # type: ignore
 from fastapi.middleware.cors import CORSMiddleware # type: ignore
 import os
 from dotenv import load_dotenv # type: ignore
-import motor.motor_asyncio  # type: ignore
 from bson import ObjectId # type: ignore
+from app.matching_engine import MatchingEngine
+from app.reverse_matching import ReverseMatcher
+from common.cache import ResponseCache, CacheInvalidator
+from common.db import Database
+from common.observability import install_observability, timed
+from common.singleflight import SingleFlight
 
 load_dotenv()
 URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME")
-client = motor.motor_asyncio.AsyncIOMotorClient(URI)
-db = client[DB_NAME]
-user_profiles = db["user_profiles"]
-bank_analytics_list = db["bank_analytics"]
-risk_data_list = db["risk_data_list"]
-loan_products_list = db["loanproducts"]
-loan_product_params = db["lenderparamsandproducts"]
+db = Database(URI, DB_NAME, appname="loan-matching")
+user_profiles = db.collection("user_profiles")
+bank_analytics_list = db.collection("bank_analytics")
+risk_data_list = db.collection("risk_data_list")
+loan_products_list = db.collection("loanproducts")
+loan_product_params = db.collection("lenderparamsandproducts")
+eligible_users = db.collection("product_eligible_users")
 
 app = FastAPI()
 app.add_middleware(
@@ -23,39 +28,90 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+db.install(app)
+logger = install_observability(app, "loan-matching")
 
-async def match(loan_id,user_id):
-    # loan_params = await loan_product_params.find_one({"loan_product_id":loan_id})
-    # bank_analytics = await bank_analytics_list.find_one({"user_id":user_id})
-    match_score = 2 
-
-    # rule - base matching logic 
-    # match_score= 0 
-    # if loan_params['min_maintained_balance'] <= bank_analytics['average_maintained_balance']:
-    #     match_score+=1
-    # if bank_analytics['debit_to_credit_ratio'] <= loan_params['max_debit_to_credit_ratio']:
-    #     match_score+=1
-    # if loan_params['min_monthly_inflow'] <= bank_analytics['average_monthly_inflow']:
-    #     match_score+=1
-    # if loan_params['min_recommended_limit'] <= risk_data['credit_limit'] and risk_data['credit_limit'] <= loan_params['max_recommended_limit']:
-    #     match_score+=1
-    # if loan_params['min_credit_score'] <= risk_data.credit_score and risk_data['credit_score'] <= loan_params['max_credit_score']:
-    #     match_score+=
-    if match_score>=2:
-        return True
-    return False
+# a product that is published or whose lender params change is matched against every user
+reverse_matcher = ReverseMatcher(bank_analytics_list, risk_data_list, loan_products_list, loan_product_params, eligible_users)
+matching_engine = MatchingEngine(loan_products_list, loan_product_params, on_change=reverse_matcher.submit)
+
+# matched offers per user. A change to the user's analytics or risk data drops the entry;
+# a product change reloads the matching engine, whose version is part of the key
+offers_cache = ResponseCache("offers")
+# concurrent misses for the same user (the dashboard, its retries and refreshes) share one
+# read of the user's documents and one matching pass
+offers_flight = SingleFlight("offers")
+
+async def drop_user_offers(change):
+    user_id = (change.get("fullDocument") or {}).get("user_id")
+    if user_id is None:
+        # deletes only carry the _id
+        offers_flight.clear()
+        await offers_cache.clear()
+    else:
+        offers_flight.forget(f"{matching_engine.version}:{user_id}")
+        await offers_cache.invalidate(f"{matching_engine.version}:{user_id}")
+
+cache_invalidator = CacheInvalidator(db, {"bank_analytics": drop_user_offers, "risk_data_list": drop_user_offers})
+
+@app.on_event("startup")
+async def start_matching_engine():
+    reverse_matcher.start()
+    await matching_engine.start()
+    cache_invalidator.start()
+
+@app.on_event("shutdown")
+async def stop_matching_engine():
+    await matching_engine.stop()
+    cache_invalidator.stop()
+    reverse_matcher.stop()
+
+@app.get("/cache-metrics")
+async def get_cache_metrics():
+    return {"offers": offers_cache.get_metrics()}
+
+@app.get("/single-flight-metrics")
+async def get_single_flight_metrics():
+    return {"offers": offers_flight.get_metrics()}
 
 @app.get("/get-matched-offers/{user_id}")
-async def get_matched_offers(user_id : str):
-    matched_loans = list()
-    loan_products = await loan_products_list.find({}).to_list(length=None)
-    for loan_product in loan_products:
-        loan_product_id = loan_product["_id"]
-        match_result = await match(loan_id=loan_product_id,user_id=ObjectId(user_id))
-        if match_result:
-            loan_product.pop("_id",None)
-            loan_product.pop("admin_id",None)
-            print(loan_product)
-            matched_loans.append(loan_product)
-    print(matched_loans)
-    return matched_loans
+async def get_matched_offers(user_id : str, request : Request):
+    user_obj_id = ObjectId(user_id)
+
+    async def load():
+        bank_analytics = await bank_analytics_list.find_one({"user_id": user_obj_id})
+        risk_data = await risk_data_list.find_one({"user_id": user_obj_id})
+        # every product is scored against the user in one pass over the in-memory lender params
+        with timed("matching"):
+            matched_loans = matching_engine.match(bank_analytics, risk_data)
+        logger.debug("matched loans: %s", matched_loans)
+        return matched_loans
+
+    key = f"{matching_engine.version}:{user_id}"
+    return await offers_cache.respond(request, key, lambda: offers_flight.do(key, load))
+
+@app.post("/reverse-match/{loan_product_id}")
+async def reverse_match(loan_product_id : str):
+    # runs now instead of waiting for the matching engine to pick the product up
+    summary = await reverse_matcher.run(loan_product_id)
+    if summary is None:
+        return {"error": "Loan product not found"}
+    return summary
+
+@app.get("/eligible-users/{loan_product_id}")
+async def get_eligible_users(loan_product_id : str, chunk : int = 0):
+    doc = await reverse_matcher.get_chunk(loan_product_id, chunk)
+    if not doc:
+        return {"error": "No eligible users computed for this product"}
+    return {
+        "loan_product_id": loan_product_id,
+        "chunk": doc["chunk"],
+        "chunks": doc["chunks"],
+        "eligible": doc["eligible"],
+        "user_ids": [str(user_id) for user_id in doc["user_ids"]],
+        "computed_at": doc["computed_at"],
+    }
+
+@app.get("/reverse-match-metrics")
+async def get_reverse_match_metrics():
+    return reverse_matcher.get_metrics()
@@ -0,0 +1,173 @@
+import numpy as np  # type: ignore
+import asyncio, logging
+
+logger = logging.getLogger(__name__)
+
+# loan products and their lender params are kept in memory as one numpy column per rule,
+# so matching a user is a handful of array comparisons no matter how big the catalogue is.
+# A product matches a user when every rule it configures holds: a rule is configured when
+# the lender params set a (finite) bound of it, a product without lender params matches
+# everybody. A bound that is null or not a number holds for nobody, so a product with one
+# matches no user until the param is fixed (it is logged whenever the index is built)
+
+REFRESH_INTERVAL_SECONDS = 30
+
+# (user feature, lender param of the lower bound, lender param of the upper bound)
+MATCH_RULES = [
+    ("average_maintained_balance", "min_maintained_balance", None),
+    ("debit_to_credit_ratio", None, "max_outflow_ratio"),
+    ("average_monthly_inflow", "min_monthly_inflow", None),
+    ("credit_limit", "min_recommended_limit", "max_recommended_limit"),
+    ("credit_score", "min_credit_score", "max_credit_score"),
+]
+ANALYTICS_FEATURES = ["average_maintained_balance", "debit_to_credit_ratio", "average_monthly_inflow"]
+RISK_FEATURES = ["credit_limit", "credit_score"]
+
+
+def param_bound(params, field, default):
+    # a lender param as a float bound: default when it is not set, NaN (the rule holds for
+    # nobody) when it is null or not a number, e.g. a string typed into the admin by hand
+    if not field or field not in params:
+        return default
+    value = params[field]
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        logger.warning("invalid loan product param", extra={"loan_product_id": str(params.get("loan_product_id")), "param": field, "value": repr(value)})
+        return np.nan
+
+
+def rule_bounds(params, low_param, high_param):
+    # (low, high) of a rule the product configures, None when it sets no bound (or only
+    # infinite ones, which constrain nothing either)
+    if not params:
+        return None
+    low, high = param_bound(params, low_param, -np.inf), param_bound(params, high_param, np.inf)
+    if low == -np.inf and high == np.inf:
+        return None
+    return low, high
+
+
+def feature(doc, field):
+    value = doc.get(field) if doc else None
+    return np.nan if value is None else float(value)
+
+
+class ProductIndex:
+    def __init__(self, products, product_params):
+        self.products = products
+        n = len(products)
+        # per rule the bounds of every product, as rule_bounds gives them (with the float
+        # conversion of param_bound inlined); a rule a product leaves unconfigured keeps
+        # infinite bounds and holds for every user, rules no product configures are left out
+        # (a side no lender param sets stays a scalar)
+        lows = [np.full(n, -np.inf) if low_param else -np.inf for _, low_param, _ in MATCH_RULES]
+        highs = [np.full(n, np.inf) if high_param else np.inf for _, _, high_param in MATCH_RULES]
+        slots = [
+            (column, param)
+            for r, (_, low_param, high_param) in enumerate(MATCH_RULES)
+            for column, param in ((lows[r], low_param), (highs[r], high_param))
+            if param
+        ]
+        for i, params in enumerate(product_params):
+            if not params:
+                continue
+            for column, param in slots:
+                if param in params:
+                    try:
+                        column[i] = float(params[param])
+                    except (TypeError, ValueError):
+                        column[i] = param_bound(params, param, np.nan)
+        self.rules = []
+        for (field, _, _), low, high in zip(MATCH_RULES, lows, highs):
+            unconfigured = (low == -np.inf) & (high == np.inf)
+            if not unconfigured.all():
+                self.rules.append((field, unconfigured, low, high))
+
+    def matches(self, analytics, risk_data):
+        # one bool per product. Missing user features (absent, or None where aa-service had
+        # too little data) become NaN, every comparison against NaN is False, so they fail
+        # the rules that need them
+        matched = np.ones(len(self.products), dtype=bool)
+        for field, unconfigured, low, high in self.rules:
+            value = feature(risk_data if field in RISK_FEATURES else analytics, field)
+            matched &= unconfigured | ((low <= value) & (value <= high))
+        return matched
+
+    def match(self, analytics, risk_data):
+        return [dict(self.products[i]) for i in np.flatnonzero(self.matches(analytics, risk_data))]
+
+
+class MatchingEngine:
+    def __init__(self, loan_products_list, loan_product_params, refresh_interval=REFRESH_INTERVAL_SECONDS, on_change=None):
+        self.loan_products_list = loan_products_list
+        self.loan_product_params = loan_product_params
+        self.refresh_interval = refresh_interval
+        # called with the ids of products that are new or whose lender params changed
+        self.on_change = on_change
+        self.index = ProductIndex([], [])
+        # bumped on every reload, cached offers are keyed by it
+        self.version = 0
+        self._product_params = []
+        # None until the first load, which is the existing catalogue and not newly published products
+        self._params_by_product = None
+        self._watch_task = None
+
+    async def load(self):
+        loan_products = await self.loan_products_list.find({}).to_list(length=None)
+        params = await self.loan_product_params.find({}).to_list(length=None)
+        params_by_product = {p["loan_product_id"]: p for p in params}
+        product_params = [params_by_product.get(loan_product["_id"]) for loan_product in loan_products]
+        product_ids = [loan_product["_id"] for loan_product in loan_products]
+        for loan_product in loan_products:
+            loan_product.pop("_id", None)
+            loan_product.pop("admin_id", None)
+        if self._params_by_product is not None and loan_products == self.index.products and product_params == self._product_params:
+            # the polling fallback reloads every refresh_interval, keep the version when nothing changed
+            return
+        self.index = ProductIndex(loan_products, product_params)
+        self._product_params = product_params
+        previous = self._params_by_product
+        self._params_by_product = dict(zip(product_ids, product_params))
+        self.version += 1
+        if self.on_change and previous is not None:
+            changed = [
+                product_id for product_id, params in self._params_by_product.items()
+                if product_id not in previous or previous[product_id] != params
+            ]
+            if changed:
+                self.on_change(changed)
+
+    def match(self, analytics, risk_data):
+        return self.index.match(analytics, risk_data)
+
+    async def _watch_changes(self):
+        # change streams need a replica set, a standalone mongod falls back to polling
+        pipeline = [{"$match": {"ns.coll": {"$in": [self.loan_products_list.name, self.loan_product_params.name]}}}]
+        async with self.loan_products_list.database.watch(pipeline) as stream:
+            async for _ in stream:
+                await self.load()
+
+    async def _poll_changes(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error("error refreshing loan products", extra={"error": str(e)})
+
+    async def _watch(self):
+        try:
+            await self._watch_changes()
+        except Exception as e:
+            # no change streams (standalone mongod) or the stream broke, poll from here on
+            logger.warning("watching loan products failed, polling instead", extra={"error": str(e)})
+            await self._poll_changes()
+
+    async def start(self):
+        await self.load()
+        self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watch_task:
+            self._watch_task.cancel()
@@ -0,0 +1,188 @@
+import numpy as np  # type: ignore
+import asyncio, logging, os, time
+from datetime import datetime, timezone
+from bson import ObjectId  # type: ignore
+from pymongo.errors import PyMongoError  # type: ignore
+from app.matching_engine import ANALYTICS_FEATURES, MATCH_RULES, RISK_FEATURES, rule_bounds
+from common.observability import timed
+
+logger = logging.getLogger(__name__)
+
+# reverse matching: which users does a loan product match? Every rule in MATCH_RULES is a
+# range on a single user feature, so the users' features are kept as one sorted array per
+# feature and each rule is two binary searches plus a slice. A product matches a user when
+# every rule it configures holds, exactly as in the pull path (ProductIndex.matches).
+# The eligible users are written to product_eligible_users in chunks of user ids. Chunk 0
+# of a run is written last, it marks the run as complete: readers only see runs that have it
+
+USER_INDEX_MAX_AGE_SECONDS = float(os.getenv("USER_INDEX_MAX_AGE_SECONDS", 300))
+ELIGIBLE_CHUNK_SIZE = int(os.getenv("ELIGIBLE_CHUNK_SIZE", 10000))
+LOAD_BATCH_SIZE = 10000
+
+
+
+class UserFeatureIndex:
+    def __init__(self, user_ids, features):
+        # user_ids: array of ObjectIds, features: {feature: float array, NaN when missing}
+        self.user_ids = np.asarray(user_ids, dtype=object)
+        self.sorted = {}
+        for feature, values in features.items():
+            values = np.asarray(values, dtype=float)
+            # NaNs sort last and never match, like the comparisons in ProductIndex.matches
+            order = np.argsort(values, kind="stable")[: np.count_nonzero(~np.isnan(values))]
+            self.sorted[feature] = (order, values[order])
+        self.built_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def eligible(self, params):
+        # positions of the users every configured rule holds for: each rule counts the users
+        # in its range, the eligible ones are counted by all of them. A product that
+        # configures no rule (or has no lender params) matches everyone
+        counts = np.zeros(len(self.user_ids), dtype=np.int8)
+        configured = 0
+        for feature, low_param, high_param in MATCH_RULES:
+            bounds = rule_bounds(params, low_param, high_param)
+            if bounds is None:
+                continue
+            low, high = bounds
+            if np.isnan(low) or np.isnan(high):
+                # a null or invalid bound holds for nobody, like in ProductIndex
+                return np.flatnonzero(np.zeros(len(self.user_ids), dtype=bool))
+            configured += 1
+            order, values = self.sorted[feature]
+            start = np.searchsorted(values, low, side="left")
+            end = np.searchsorted(values, high, side="right")
+            counts[order[start:end]] += 1
+        if not configured:
+            return np.arange(len(self.user_ids))
+        return np.flatnonzero(counts == configured)
+
+
+async def load_user_index(bank_analytics_list, risk_data_list, batch_size=LOAD_BATCH_SIZE):
+    # one pass over each collection with a projection, joined on user_id
+    rows = {}
+    user_ids = []
+    columns = {feature: [] for feature in ANALYTICS_FEATURES + RISK_FEATURES}
+
+    def row(user_id):
+        i = rows.get(user_id)
+        if i is None:
+            i = rows[user_id] = len(user_ids)
+            user_ids.append(user_id)
+            for values in columns.values():
+                values.append(np.nan)
+        return i
+
+    projection = {"_id": 0, "user_id": 1, **{feature: 1 for feature in ANALYTICS_FEATURES}}
+    async for doc in bank_analytics_list.find({}, projection).batch_size(batch_size):
+        i = row(doc["user_id"])
+        for feature in ANALYTICS_FEATURES:
+            columns[feature][i] = doc.get(feature, np.nan)
+    projection = {"_id": 0, "user_id": 1, **{feature: 1 for feature in RISK_FEATURES}}
+    async for doc in risk_data_list.find({}, projection).batch_size(batch_size):
+        i = row(doc["user_id"])
+        for feature in RISK_FEATURES:
+            columns[feature][i] = doc.get(feature, np.nan)
+    return UserFeatureIndex(user_ids, columns)
+
+
+def eligibility_chunks(product_id, run_id, user_ids, computed_at, chunk_size=ELIGIBLE_CHUNK_SIZE):
+    # always at least one chunk, so a product nobody is eligible for still has a result
+    n_chunks = max(1, -(-len(user_ids) // chunk_size))
+    return [
+        {
+            "loan_product_id": product_id,
+            "run_id": run_id,
+            "chunk": i,
+            "chunks": n_chunks,
+            "eligible": len(user_ids),
+            "user_ids": user_ids[i * chunk_size:(i + 1) * chunk_size],
+            "computed_at": computed_at,
+        }
+        for i in range(n_chunks)
+    ]
+
+
+class ReverseMatcher:
+    def __init__(self, bank_analytics_list, risk_data_list, loan_products_list, loan_product_params, eligible_users):
+        self.bank_analytics_list = bank_analytics_list
+        self.risk_data_list = risk_data_list
+        self.loan_products_list = loan_products_list
+        self.loan_product_params = loan_product_params
+        self.eligible_users = eligible_users
+        self.index = None
+        self._index_lock = asyncio.Lock()
+        self._queue = asyncio.Queue()
+        self._task = None
+        self.metrics = {"runs": 0, "failed": 0, "index_loads": 0, "last_run_seconds": None, "last_index_load_seconds": None}
+
+    async def user_index(self):
+        # shared by consecutive runs, a batch of new products loads the users once
+        async with self._index_lock:
+            if self.index is None or time.monotonic() - self.index.built_at > USER_INDEX_MAX_AGE_SECONDS:
+                start = time.perf_counter()
+                self.index = await load_user_index(self.bank_analytics_list, self.risk_data_list)
+                self.metrics["index_loads"] += 1
+                self.metrics["last_index_load_seconds"] = round(time.perf_counter() - start, 3)
+            return self.index
+
+    async def run(self, product_id):
+        product_id = ObjectId(product_id)
+        if not await self.loan_products_list.find_one({"_id": product_id}, {"_id": 1}):
+            return None
+        start = time.perf_counter()
+        params = await self.loan_product_params.find_one({"loan_product_id": product_id})
+        index = await self.user_index()
+        with timed("reverse_matching"):
+            user_ids = index.user_ids[index.eligible(params)].tolist()
+        run_id = ObjectId()
+        chunks = eligibility_chunks(product_id, run_id, user_ids, datetime.now(timezone.utc))
+        if len(chunks) > 1:
+            await self.eligible_users.insert_many(chunks[1:], ordered=False)
+        await self.eligible_users.insert_one(chunks[0])
+        # readers only look at the newest complete run, older ones (and chunks of runs that
+        # failed halfway) are dropped now. A newer run of a concurrent call is left alone
+        await self.eligible_users.delete_many({"loan_product_id": product_id, "run_id": {"$lt": run_id}})
+        seconds = time.perf_counter() - start
+        self.metrics["runs"] += 1
+        self.metrics["last_run_seconds"] = round(seconds, 3)
+        logger.info("reverse match done", extra={"loan_product_id": str(product_id), "eligible": len(user_ids), "users": len(index), "seconds": round(seconds, 3)})
+        return {"loan_product_id": str(product_id), "eligible": len(user_ids), "users": len(index), "chunks": len(chunks), "seconds": round(seconds, 3)}
+
+    async def get_chunk(self, product_id, chunk=0):
+        latest = await self.eligible_users.find_one(
+            {"loan_product_id": ObjectId(product_id), "chunk": 0}, {"run_id": 1}, sort=[("run_id", -1)]
+        )
+        if not latest:
+            return None
+        return await self.eligible_users.find_one({"loan_product_id": ObjectId(product_id), "run_id": latest["run_id"], "chunk": chunk})
+
+    def submit(self, product_ids):
+        for product_id in product_ids:
+            self._queue.put_nowait(product_id)
+
+    async def _worker(self):
+        while True:
+            product_id = await self._queue.get()
+            try:
+                await self.run(product_id)
+            except PyMongoError as e:
+                self.metrics["failed"] += 1
+                logger.error("reverse match failed", extra={"loan_product_id": str(product_id), "error": str(e)})
+            except Exception:
+                # e.g. an invalid product id or params the index cannot compare, the worker
+                # has to keep serving the rest of the queue
+                self.metrics["failed"] += 1
+                logger.exception("reverse match failed", extra={"loan_product_id": str(product_id)})
+
+    def get_metrics(self):
+        return {**self.metrics, "queued": self._queue.qsize(), "indexed_users": len(self.index) if self.index else 0}
+
+    def start(self):
+        self._task = asyncio.create_task(self._worker())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
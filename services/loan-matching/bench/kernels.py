@@ -0,0 +1,125 @@
+import numpy as np  # type: ignore
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from common.bench.harness import Benchmark, run  # noqa: E402
+from app.matching_engine import ProductIndex  # noqa: E402
+from app.reverse_matching import UserFeatureIndex  # noqa: E402
+
+# matching kernels of loan-matching. match and build_index are sized by loan products in the
+# catalogue, every call matches the same USERS users against the whole catalogue; the reverse
+# kernels are sized by users, every call matches PRODUCTS products against all of them
+# cd services/loan-matching && PYTHONPATH=..:. python bench/kernels.py --sizes 100,1000,10000
+
+USERS = 100
+PRODUCTS = 10
+SIZES = (100, 1_000, 10_000, 100_000)
+USER_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+
+def catalogue(size):
+    rng = np.random.default_rng(size)
+    products = [{"name": f"product-{i}", "interest_rate": float(rng.uniform(8, 24))} for i in range(size)]
+    params = []
+    for i in range(size):
+        # roughly one product in ten has no lender params and matches everyone
+        if i % 10 == 0:
+            params.append(None)
+            continue
+        low_score = int(rng.integers(300, 750))
+        low_limit = float(rng.uniform(0, 500000))
+        params.append({
+            "min_maintained_balance": float(rng.uniform(0, 50000)),
+            "max_outflow_ratio": float(rng.uniform(0.5, 1.5)),
+            "min_monthly_inflow": float(rng.uniform(0, 200000)),
+            "min_recommended_limit": low_limit,
+            "max_recommended_limit": low_limit + float(rng.uniform(0, 1000000)),
+            "min_credit_score": low_score,
+            "max_credit_score": low_score + int(rng.integers(50, 300)),
+        })
+    return products, params
+
+
+def users(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        (
+            {
+                "average_maintained_balance": float(rng.uniform(0, 100000)),
+                "debit_to_credit_ratio": float(rng.uniform(0, 2)),
+                "average_monthly_inflow": float(rng.uniform(0, 300000)),
+            },
+            {"credit_limit": float(rng.uniform(0, 1000000)), "credit_score": int(rng.integers(300, 900))},
+        )
+        for _ in range(n)
+    ]
+
+
+def setup_match(size):
+    return {"index": ProductIndex(*catalogue(size)), "users": users(USERS)}
+
+
+def run_match(inputs):
+    index = inputs["index"]
+    for analytics, risk_data in inputs["users"]:
+        index.match(analytics, risk_data)
+
+
+def setup_build_index(size):
+    return catalogue(size)
+
+
+def run_build_index(inputs):
+    # what every catalogue refresh pays
+    return ProductIndex(*inputs)
+
+
+def user_columns(n, seed=0):
+    # the same distributions as users(), as the columns load_user_index builds
+    rng = np.random.default_rng(seed)
+    user_ids = np.arange(n).astype(object)
+    features = {
+        "average_maintained_balance": rng.uniform(0, 100000, n),
+        "debit_to_credit_ratio": rng.uniform(0, 2, n),
+        "average_monthly_inflow": rng.uniform(0, 300000, n),
+        "credit_limit": rng.uniform(0, 1000000, n),
+        "credit_score": rng.integers(300, 900, n).astype(float),
+    }
+    return user_ids, features
+
+
+def setup_build_user_index(size):
+    return user_columns(size)
+
+
+def run_build_user_index(inputs):
+    # what every reload of the users pays, once per USER_INDEX_MAX_AGE_SECONDS
+    return UserFeatureIndex(*inputs)
+
+
+def setup_reverse_match(size):
+    _, params = catalogue(PRODUCTS + 1)
+    return {"index": UserFeatureIndex(*user_columns(size)), "params": [p for p in params if p][:PRODUCTS]}
+
+
+def run_reverse_match(inputs):
+    index = inputs["index"]
+    for params in inputs["params"]:
+        index.user_ids[index.eligible(params)]
+
+
+BENCHMARKS = [
+    # throughput counts every (user, product) pair checked
+    Benchmark("match", setup_match, run_match, "pairs", sizes=SIZES, scale=USERS),
+    Benchmark("build_index", setup_build_index, run_build_index, "products", sizes=SIZES),
+    # throughput counts every (product, user) pair checked
+    Benchmark("reverse_match", setup_reverse_match, run_reverse_match, "pairs", sizes=USER_SIZES, scale=PRODUCTS),
+    Benchmark("build_user_index", setup_build_user_index, run_build_user_index, "users", sizes=USER_SIZES),
+]
+
+
+if __name__ == "__main__":
+    run("loan-matching", BENCHMARKS)
@@ -0,0 +1,97 @@
+import argparse, asyncio, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# publishing a loan product end to end on mongomock: users are seeded into bank_analytics and
+# risk_data_list, a product is inserted and picked up by the matching engine, the reverse
+# matcher writes its eligible users and the bench reads them back through /eligible-users.
+# The eligible set is checked against the pull path (ProductIndex.matches) user by user.
+# Reading the users out of mongomock gets superlinear past a few 10k documents, the first run
+# (which loads them) is not representative; bench/kernels.py times the index at 1M users
+# cd services/loan-matching && python bench/reverse_match.py --users 20000
+
+
+def product_params(rng):
+    low_score = rng.randint(300, 750)
+    return {
+        "min_maintained_balance": rng.uniform(0, 50000),
+        "max_outflow_ratio": rng.uniform(0.5, 1.5),
+        "min_monthly_inflow": rng.uniform(0, 200000),
+        "min_credit_score": low_score,
+        "max_credit_score": low_score + rng.randint(50, 300),
+    }
+
+
+async def seed_users(main, n_users, rng):
+    from bson import ObjectId  # type: ignore
+
+    analytics, risk = [], []
+    for i in range(n_users):
+        user_id = ObjectId()
+        # a few users have no risk data yet, their risk features are missing
+        analytics.append({
+            "user_id": user_id,
+            "average_maintained_balance": rng.uniform(0, 100000),
+            "debit_to_credit_ratio": rng.uniform(0, 2),
+            "average_monthly_inflow": rng.uniform(0, 300000),
+        })
+        if i % 50:
+            risk.append({"user_id": user_id, "credit_limit": rng.uniform(0, 1000000), "credit_score": rng.randint(300, 900)})
+    await main.bank_analytics_list.insert_many(analytics)
+    await main.risk_data_list.insert_many(risk)
+    return analytics, {r["user_id"]: r for r in risk}
+
+
+async def main(args):
+    import httpx  # type: ignore
+    from mongomock_motor import AsyncMongoMockClient  # type: ignore
+    import app.main as main
+    from app.matching_engine import ProductIndex
+
+    main.db._client = AsyncMongoMockClient()
+    rng = random.Random(0)
+    start = time.perf_counter()
+    analytics, risk = await seed_users(main, args.users, rng)
+    print(f"seeded {args.users:,} users in {time.perf_counter() - start:.1f}s")
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app), httpx.AsyncClient(transport=transport, base_url="http://loan-matching") as client:
+        for n in range(args.products):
+            product = {"name": f"new-product-{n}", "interest_rate": 12.0}
+            await main.loan_products_list.insert_one(product)
+            params = product_params(rng)
+            await main.loan_product_params.insert_one({"loan_product_id": product["_id"], **params})
+            # what the change stream (or the polling fallback) does on publish
+            await main.matching_engine.load()
+            while main.reverse_matcher._queue.qsize() or main.reverse_matcher.metrics["runs"] < n + 1:
+                await asyncio.sleep(0.01)
+
+            eligible = set()
+            first = (await client.get(f"/eligible-users/{product['_id']}")).json()
+            for chunk in range(first["chunks"]):
+                doc = (await client.get(f"/eligible-users/{product['_id']}", params={"chunk": chunk})).json()
+                eligible.update(doc["user_ids"])
+            assert len(eligible) == first["eligible"], (len(eligible), first["eligible"])
+
+            index = ProductIndex([product], [params])
+            for doc in rng.sample(analytics, min(args.check, len(analytics))):
+                expected = index.matches(doc, risk.get(doc["user_id"]))[0]
+                assert expected == (str(doc["user_id"]) in eligible), doc
+            print(
+                f"{product['name']:<16} eligible {first['eligible']:>9,} / {args.users:,}   chunks {first['chunks']:>4}"
+                f"   run {main.reverse_matcher.metrics['last_run_seconds']:.3f}s"
+            )
+        print((await client.get("/reverse-match-metrics")).json())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="reverse matching of newly published products")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--products", type=int, default=3)
+    parser.add_argument("--check", type=int, default=2000, help="users checked against the pull path per product")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DB_NAME", "reverse_match_bench")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    asyncio.run(main(args))
@@ -0,0 +1,156 @@
+import logging, os
+from datetime import datetime, timezone
+from bson import ObjectId  # type: ignore
+from bson.errors import InvalidId  # type: ignore
+from pymongo.errors import BulkWriteError  # type: ignore
+from app.notifications import notification_doc
+
+logger = logging.getLogger(__name__)
+
+# loan application intake, one submission or a partner's bulk upload. Profiles, products and
+# admins are resolved with one $in query each, the applications are written with one
+# unordered insert_many and the unique (user_id, loan_product_id) index in common/db.py turns
+# a repeated or concurrent submission into a duplicate key error instead of a second document
+
+APPLICATION_BATCH_MAX = int(os.getenv("APPLICATION_BATCH_MAX", 1000))
+DUPLICATE_KEY = 11000
+
+CREATED = "created"
+EXISTS = "exists"
+INVALID = "invalid"
+FAILED = "failed"
+
+
+# fields build_application and admin_email read, an item whose profile or product lacks one
+# is reported invalid on its own instead of failing the whole batch
+PROFILE_FIELDS = ["name", "email"]
+PRODUCT_FIELDS = ["name", "max_amount", "max_tenure_months"]
+
+
+def application_error(user_profile, loan_product):
+    missing = [field for field in PROFILE_FIELDS if not user_profile.get(field)]
+    if missing:
+        return f"User profile has no {', '.join(missing)}"
+    missing = [field for field in PRODUCT_FIELDS if loan_product.get(field) is None]
+    if missing:
+        return f"Loan product has no {', '.join(missing)}"
+    if parse_id(loan_product.get("admin_id")) is None:
+        return "Loan product has no valid admin_id"
+    return None
+
+
+def build_application(user_profile, loan_product, now):
+    return {
+        "user_id": user_profile["_id"],
+        "loan_product_id": loan_product["_id"],
+        "admin_id": ObjectId(loan_product["admin_id"]),
+        "limit": loan_product["max_amount"],
+        "tenure_months": loan_product["max_tenure_months"],
+        "application_status": "pending",
+        "main_matched_rules": {"credit_score_match": True, "business_age_match": True},
+        "disbursement": False,
+        "applied": now,
+        "created": now,
+        "processed_at": now,
+        "processed_by": loan_product["admin_id"],
+        "name": user_profile["name"],
+        "email": user_profile["email"],
+    }
+
+
+def admin_email(admin, user_profile, loan_product, now, default_email):
+    admin = admin or {}
+    subject = f"New Loan Application Received - {loan_product['name']}"
+    body = f"""
+        Dear {admin.get('name', 'Admin')},
+
+        A new loan application has been submitted:
+
+        Applicant: {user_profile.get('name', 'Customer')}
+        Loan Product: {loan_product['name']}
+        Amount: {loan_product['max_amount']}
+        Tenure: {loan_product['max_tenure_months']} months
+        Applied At: {now.strftime('%Y-%m-%d %H:%M:%S')}
+
+        Please review the application at your earliest convenience.
+        """
+    return admin.get("email", default_email), subject, body
+
+
+def parse_id(value):
+    # ObjectId(None) would make up a new id
+    if value is None:
+        return None
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+class ApplicationIntake:
+    def __init__(self, user_profiles_list, loan_product_list, admin_collection, loan_application_list, notification_outbox, default_admin_email):
+        self.user_profiles_list = user_profiles_list
+        self.loan_product_list = loan_product_list
+        self.admin_collection = admin_collection
+        self.loan_application_list = loan_application_list
+        self.notification_outbox = notification_outbox
+        self.default_admin_email = default_admin_email
+
+    async def _by(self, collection, field, values):
+        docs = await collection.find({field: {"$in": list(values)}}).to_list(length=None)
+        return {doc[field]: doc for doc in docs}
+
+    async def submit(self, items):
+        # items: [{"user_id", "loan_name"}]; returns one result per item, in order
+        results = [None] * len(items)
+        user_ids = [parse_id(item.get("user_id")) for item in items]
+        profiles = await self._by(self.user_profiles_list, "_id", {u for u in user_ids if u})
+        # names are not unique, the first product with the name is used as find_one did
+        products = {}
+        for product in await self.loan_product_list.find({"name": {"$in": list({item.get("loan_name") for item in items})}}).to_list(length=None):
+            products.setdefault(product["name"], product)
+
+        now = datetime.now(timezone.utc)
+        pending = []
+        for i, (item, user_id) in enumerate(zip(items, user_ids)):
+            profile = profiles.get(user_id)
+            product = products.get(item.get("loan_name"))
+            if profile is None:
+                results[i] = {"status": INVALID, "error": "User profile not found"}
+            elif product is None:
+                results[i] = {"status": INVALID, "error": "Loan product not found"}
+            elif error := application_error(profile, product):
+                results[i] = {"status": INVALID, "error": error}
+            else:
+                pending.append((i, profile, product, build_application(profile, product, now)))
+        if not pending:
+            return results
+
+        failed = {}
+        try:
+            await self.loan_application_list.insert_many([doc for _, _, _, doc in pending], ordered=False)
+        except BulkWriteError as e:
+            # ordered=False writes every other document, the errors carry their batch position
+            for error in e.details["writeErrors"]:
+                failed[error["index"]] = error
+        created = []
+        for n, (i, profile, product, doc) in enumerate(pending):
+            error = failed.get(n)
+            if error is None:
+                results[i] = {"status": CREATED, "application_id": str(doc["_id"])}
+                created.append((profile, product))
+            elif error["code"] == DUPLICATE_KEY:
+                results[i] = {"status": EXISTS, "error": "Application already exists"}
+            else:
+                results[i] = {"status": FAILED, "error": error.get("errmsg", "write failed")}
+                logger.error("application write failed", extra={"user_id": str(profile["_id"]), "error": error.get("errmsg")})
+
+        if created:
+            admins = await self._by(self.admin_collection, "_id", {ObjectId(product["admin_id"]) for _, product in created})
+            # queued for the notification worker in one write
+            await self.notification_outbox.insert_many([
+                notification_doc(*admin_email(admins.get(ObjectId(product["admin_id"])), profile, product, now, self.default_admin_email))
+                for profile, product in created
+            ])
+        logger.info("applications submitted", extra={"items": len(items), "created": len(created)})
+        return results
@@ -1,13 +1,16 @@
-from fastapi import FastAPI, Request  # type: ignore
+from fastapi import FastAPI, Request, Response  # type: ignore
 from fastapi.middleware.cors import CORSMiddleware  # type: ignore
 import os
 from dotenv import load_dotenv  # type: ignore
-import motor.motor_asyncio  # type: ignore
 from bson import ObjectId  # type: ignore
-from datetime import datetime, timezone
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from typing import Optional
+from pydantic import BaseModel  # type: ignore
+from app.applications import APPLICATION_BATCH_MAX, CREATED, ApplicationIntake
+from app.notifications import NotificationWorker, SMTPSender
+from app.product_cache import ProductCache
+from common.cache import ResponseCache, CacheInvalidator
+from common.db import Database
+from common.observability import install_observability
 
 app = FastAPI()
 app.add_middleware(
@@ -15,6 +18,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 load_dotenv()
@@ -24,62 +28,109 @@ SMTP_SERVER = os.getenv("SMTP_SERVER")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
 SMTP_USERNAME = os.getenv("SMTP_USERNAME")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
 ADMIN_EMAIL = os.getenv("ADMIN_EMAIL", "admin@lender.com")  # Default to your admin email
 
-client = motor.motor_asyncio.AsyncIOMotorClient(URI)
-db = client[DB_NAME]
-user_profiles_list = db["user_profiles"]
-bank_analytics = db["bank_analytics"]
-loan_application_list = db["loanapplications"]
-loan_product_list = db["loanproducts"]
-admin_collection = db["admins"]  # Assuming you have an admins collection
-
-async def send_email(to_email: str, subject: str, body: str):
-    try:
-        message = MIMEMultipart()
-        message["From"] = SMTP_USERNAME
-        message["To"] = to_email
-        message["Subject"] = subject
-
-        message.attach(MIMEText(body, "plain"))
-        print('=================================')
-        print('Sending email to:', to_email)
-        print('=================================')
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.send_message(message)
-        return True
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        return False
+db = Database(URI, DB_NAME, appname="user-service")
+user_profiles_list = db.collection("user_profiles")
+bank_analytics = db.collection("bank_analytics")
+loan_application_list = db.collection("loanapplications")
+loan_product_list = db.collection("loanproducts")
+admin_collection = db.collection("admins")  # Assuming you have an admins collection
+notification_outbox = db.collection("notification_outbox")
+db.install(app)
+logger = install_observability(app, "user-service")
+
+notification_worker = NotificationWorker(
+    notification_outbox,
+    SMTPSender(SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, starttls=SMTP_STARTTLS),
+)
+
+product_cache = ProductCache(loan_product_list)
+
+application_intake = ApplicationIntake(
+    user_profiles_list, loan_product_list, admin_collection, loan_application_list, notification_outbox, ADMIN_EMAIL,
+)
+
+# profile and analytics bodies, keyed by the id in the url, dropped when the document changes
+profile_cache = ResponseCache("profile")
+analytics_cache = ResponseCache("analytics")
+
+async def drop_profile(change):
+    await profile_cache.invalidate(str(change["documentKey"]["_id"]))
+
+async def drop_analytics(change):
+    await analytics_cache.invalidate(str(change["documentKey"]["_id"]))
+
+cache_invalidator = CacheInvalidator(db, {"user_profiles": drop_profile, "bank_analytics": drop_analytics})
+
+@app.on_event("startup")
+async def start_notification_worker():
+    notification_worker.start()
+    product_cache.start()
+    cache_invalidator.start()
+
+@app.on_event("shutdown")
+async def stop_notification_worker():
+    await notification_worker.stop()
+    product_cache.stop()
+    cache_invalidator.stop()
+
+@app.get('/cache-metrics')
+async def get_cache_metrics():
+    return {"profile": profile_cache.get_metrics(), "analytics": analytics_cache.get_metrics()}
+
+@app.get('/notification-metrics')
+async def get_notification_metrics():
+    return await notification_worker.get_metrics()
 
 @app.get('/get-analytics/{analytics_id}')
-async def get_analytics(analytics_id: str):
+async def get_analytics(analytics_id: str, request: Request):
     analytics_obj_id = ObjectId(analytics_id)
-    analytics = await bank_analytics.find_one({"_id": analytics_obj_id}, {"_id": 0, "user_id": 0})
-    if not analytics:
+
+    async def load():
+        analytics = await bank_analytics.find_one({"_id": analytics_obj_id}, {"_id": 0, "user_id": 0})
+        logger.debug("analytics: %s", analytics)
+        return analytics
+
+    response = await analytics_cache.respond(request, analytics_id, load)
+    if response is None:
         return {"error": "Analytics data not found"}
-    print(analytics)
-    return analytics
+    return response
 
 @app.get('/get-profile/{user_id}')
-async def get_profile(user_id: str):
+async def get_profile(user_id: str, request: Request):
     user_obj_id = ObjectId(user_id)
-    user_profile = await user_profiles_list.find_one({"_id": user_obj_id},{"_id":0})
-    if not user_profile:
+
+    async def load():
+        user_profile = await user_profiles_list.find_one({"_id": user_obj_id},{"_id":0})
+        logger.debug("user profile: %s", user_profile)
+        return user_profile
+
+    response = await profile_cache.respond(request, user_id, load)
+    if response is None:
         return {"error": "User profile not found"}
-    print(user_profile)
-    return user_profile
+    return response
+
+APPLICATION_FIELDS = {"loan_product_id": 1, "applied": 1, "processed_at": 1, "application_status": 1}
 
 @app.get('/get-applications/{user_id}')
-async def get_applications(user_id: str):
+async def get_applications(user_id: str, response: Response, limit: Optional[int] = None, after: Optional[str] = None):
     user_obj_id = ObjectId(user_id)
     res_list = list()
-    loan_applications = await loan_application_list.find({"user_id": user_obj_id}).to_list(length=None)
+    # optional cursor pagination on _id, the next cursor comes back in X-Next-Cursor
+    query = {"user_id": user_obj_id}
+    if after:
+        query["_id"] = {"$gt": ObjectId(after)}
+    cursor = loan_application_list.find(query, APPLICATION_FIELDS).sort("_id", 1)
+    if limit:
+        cursor = cursor.limit(limit)
+    loan_applications = await cursor.to_list(length=None)
+    # one $in query for the products that are not cached yet, instead of one find_one per application
+    loan_products = await product_cache.get_many([a["loan_product_id"] for a in loan_applications])
     for loan_application in loan_applications:
         l = {}
-        loan_product = await loan_product_list.find_one({"_id": loan_application["loan_product_id"]})
+        loan_product = loan_products[loan_application["loan_product_id"]]
         l['name'] = loan_product['name']
         l['description'] = loan_product['description']
         l['tenure'] = loan_product['max_tenure_months']
@@ -89,71 +140,37 @@ async def get_applications(user_id: str):
         l['updated'] = loan_application['processed_at']
         l['status'] = loan_application['application_status']
         res_list.append(l)
+    if limit and len(loan_applications) == limit:
+        response.headers["X-Next-Cursor"] = str(loan_applications[-1]["_id"])
 
-    print(res_list)
+    logger.debug("applications: %s", res_list)
     return res_list
 
 @app.post('/add-application')
 async def add_application(request: Request):
     data = await request.json()
-    user_id=ObjectId(data['user_id'])
-    user_profile = await user_profiles_list.find_one({"_id":user_id})
-    loan_product = await loan_product_list.find_one({"name":data["loan_name"]})
-    loan_product_id= ObjectId(loan_product['_id'])
-    current_loan_application = await loan_application_list.find_one({"user_id":user_id,"loan_product_id":loan_product_id})
-    if not current_loan_application :
-        loan_application = {}
-        main_matched_rules = {}
-        loan_application['user_id'] = user_id
-        loan_application['loan_product_id'] = loan_product_id
-        loan_application['admin_id'] = ObjectId(loan_product['admin_id'])
-        loan_application['limit'] = loan_product['max_amount']
-        loan_application['tenure_months'] = loan_product['max_tenure_months']
-        loan_application['application_status'] = 'pending'
-        main_matched_rules["credit_score_match"] = True
-        main_matched_rules['business_age_match'] = True
-        loan_application['main_matched_rules'] = main_matched_rules
-        loan_application['disbursement'] = False
-        loan_application['applied'] = datetime.now(timezone.utc)
-        loan_application['created'] = datetime.now(timezone.utc)
-        loan_application['processed_at'] = datetime.now(timezone.utc)
-        loan_application['processed_by'] = loan_product['admin_id']
-        loan_application['name'] = user_profile["name"]
-        loan_application['email'] = user_profile["email"]
-        print(loan_application)
-        res = await loan_application_list.insert_one(loan_application)
-        print(res)
-        
-        # Get admin details
-        admin = await admin_collection.find_one({"_id": ObjectId(loan_product['admin_id'])})
-        admin_email = admin.get('email', ADMIN_EMAIL)
-        admin_name = admin.get('name', 'Admin')
-        
-        user_name = user_profile.get('name', 'Customer')
-        
-        # Prepare email
-        subject = f"New Loan Application Received - {loan_product['name']}"
-        body = f"""
-        Dear {admin_name},
-        
-        A new loan application has been submitted:
-        
-        Applicant: {user_name}
-        Loan Product: {loan_product['name']}
-        Amount: {loan_product['max_amount']}
-        Tenure: {loan_product['max_tenure_months']} months
-        Applied At: {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')}
-        
-        Please review the application at your earliest convenience.
-        """
-        
-        # Send email
-        email_sent = await send_email(admin_email, subject, body)
-        if not email_sent:
-            print("Failed to send email notification")
-        
+    # a batch of one, the unique index makes a repeated submission a no-op
+    result, = await application_intake.submit([data])
+    if result["status"] == CREATED:
+        logger.info("application stored", extra={"application_id": result["application_id"]})
         return {"status": "success", "message": "Application submitted successfully"}
-    else:
-        print("Application already exists")
-        print(current_loan_application)
-        return {"error": "Application already exists"}
\ No newline at end of file
+    return {"error": result["error"]}
+
+class ApplicationItem(BaseModel):
+    user_id: str
+    loan_name: str
+
+class ApplicationBatch(BaseModel):
+    applications: list[ApplicationItem]
+
+@app.post('/add-applications')
+async def add_applications(data: ApplicationBatch):
+    # partner bulk uploads: one result per application, in order, with status created,
+    # exists (already applied, also on a retried upload), invalid or failed
+    if len(data.applications) > APPLICATION_BATCH_MAX:
+        return {"error": f"At most {APPLICATION_BATCH_MAX} applications per request"}
+    results = await application_intake.submit([item.model_dump() for item in data.applications])
+    return {
+        "results": results,
+        "created": sum(1 for result in results if result["status"] == CREATED),
+    }
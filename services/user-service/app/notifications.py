@@ -0,0 +1,196 @@
+import asyncio, logging, os, smtplib
+from datetime import datetime, timedelta, timezone
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from pymongo import ReturnDocument  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# admin notifications go through a mongo outbox: application intake only inserts a record,
+# and a background worker drains it over one persistent SMTP connection, sending one
+# email per admin per batch and retrying failures with exponential backoff
+
+BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", 50))
+POLL_INTERVAL_SECONDS = float(os.getenv("NOTIFY_POLL_INTERVAL_SECONDS", 2))
+MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", 6))
+BACKOFF_BASE_SECONDS = float(os.getenv("NOTIFY_BACKOFF_BASE_SECONDS", 30))
+BACKOFF_MAX_SECONDS = float(os.getenv("NOTIFY_BACKOFF_MAX_SECONDS", 3600))
+# a record stuck in "sending" this long belongs to a worker that died, it is picked up again
+LEASE_SECONDS = float(os.getenv("NOTIFY_LEASE_SECONDS", 300))
+
+
+def notification_doc(to_email, subject, body):
+    now = datetime.now(timezone.utc)
+    return {
+        "to_email": to_email,
+        "subject": subject,
+        "body": body,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+    }
+
+
+class SMTPSender:
+    # blocking smtplib calls, always run through asyncio.to_thread by the worker
+    def __init__(self, server, port, username=None, password=None, starttls=True):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self._smtp = None
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.server, self.port)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        return smtp
+
+    def _connection(self):
+        # reuse the open connection while the server still answers NOOP
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except smtplib.SMTPException:
+                pass
+            self.close()
+        self._smtp = self._connect()
+        return self._smtp
+
+    def send(self, to_email, subject, body):
+        message = MIMEMultipart()
+        message["From"] = self.username or "noreply@quickcredit"
+        message["To"] = to_email
+        message["Subject"] = subject
+        message.attach(MIMEText(body, "plain"))
+        try:
+            self._connection().send_message(message)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # dropped between the NOOP and the send, one fresh connection before giving up
+            self.close()
+            self._connection().send_message(message)
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+
+def digest(notifications):
+    if len(notifications) == 1:
+        return notifications[0]["subject"], notifications[0]["body"]
+    subject = f"{len(notifications)} New Loan Applications Received"
+    body = "\n\n".join(n["body"].strip() for n in notifications)
+    return subject, body
+
+
+class NotificationWorker:
+    def __init__(self, outbox, sender):
+        self.outbox = outbox
+        self.sender = sender
+        self.metrics = {
+            "pending": 0,
+            "sent": 0,
+            "emails_sent": 0,
+            "retried": 0,
+            "failed": 0,
+            "last_error": None,
+            "last_batch_seconds": 0.0,
+        }
+        self._task = None
+
+    async def claim_batch(self):
+        now = datetime.now(timezone.utc)
+        claimed = []
+        for _ in range(BATCH_SIZE):
+            doc = await self.outbox.find_one_and_update(
+                {"$or": [
+                    {"status": "pending", "next_attempt_at": {"$lte": now}},
+                    {"status": "sending", "claimed_at": {"$lte": now - timedelta(seconds=LEASE_SECONDS)}},
+                ]},
+                {"$set": {"status": "sending", "claimed_at": now}},
+                sort=[("next_attempt_at", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if not doc:
+                break
+            claimed.append(doc)
+        return claimed
+
+    async def deliver(self, to_email, notifications):
+        ids = [n["_id"] for n in notifications]
+        subject, body = digest(notifications)
+        try:
+            await asyncio.to_thread(self.sender.send, to_email, subject, body)
+        except Exception as e:
+            self.metrics["last_error"] = str(e)
+            logger.warning("error sending email", extra={"to_email": to_email, "error": str(e), "notifications": len(ids)})
+            await self.reschedule(notifications, str(e))
+            return
+        await self.outbox.update_many(
+            {"_id": {"$in": ids}},
+            {"$set": {"status": "sent", "sent_at": datetime.now(timezone.utc)}, "$inc": {"attempts": 1}},
+        )
+        self.metrics["sent"] += len(ids)
+        self.metrics["emails_sent"] += 1
+
+    async def reschedule(self, notifications, error):
+        now = datetime.now(timezone.utc)
+        for n in notifications:
+            attempts = n["attempts"] + 1
+            if attempts >= MAX_ATTEMPTS:
+                update = {"status": "failed", "attempts": attempts, "last_error": error}
+                self.metrics["failed"] += 1
+            else:
+                delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+                update = {
+                    "status": "pending",
+                    "attempts": attempts,
+                    "last_error": error,
+                    "next_attempt_at": now + timedelta(seconds=delay),
+                }
+                self.metrics["retried"] += 1
+            await self.outbox.update_one({"_id": n["_id"]}, {"$set": update})
+
+    async def drain_once(self):
+        start = datetime.now(timezone.utc)
+        batch = await self.claim_batch()
+        by_admin = {}
+        for n in batch:
+            by_admin.setdefault(n["to_email"], []).append(n)
+        for to_email, notifications in by_admin.items():
+            await self.deliver(to_email, notifications)
+        if batch:
+            self.metrics["last_batch_seconds"] = (datetime.now(timezone.utc) - start).total_seconds()
+        return len(batch)
+
+    async def run(self):
+        while True:
+            try:
+                drained = await self.drain_once()
+            except Exception as e:
+                self.metrics["last_error"] = str(e)
+                logger.error("error draining notification outbox", extra={"error": str(e)})
+                drained = 0
+            if drained < BATCH_SIZE:
+                await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+    async def get_metrics(self):
+        self.metrics["pending"] = await self.outbox.count_documents({"status": {"$in": ["pending", "sending"]}})
+        return self.metrics
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        await asyncio.to_thread(self.sender.close)
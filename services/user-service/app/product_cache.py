@@ -0,0 +1,80 @@
+import asyncio, logging, os, time
+from collections import OrderedDict
+from pymongo.errors import PyMongoError  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# in-process LRU of loan product documents with a ttl. Misses are fetched with a single
+# $in query, and a change stream on loanproducts drops entries as soon as a product
+# changes (without a replica set the ttl alone bounds staleness)
+
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", 1024))
+PRODUCT_CACHE_TTL_SECONDS = float(os.getenv("PRODUCT_CACHE_TTL_SECONDS", 300))
+PRODUCT_FIELDS = {"name": 1, "description": 1, "max_tenure_months": 1, "max_amount": 1, "interest_rate": 1}
+
+
+class ProductCache:
+    def __init__(self, loan_product_list, maxsize=PRODUCT_CACHE_SIZE, ttl=PRODUCT_CACHE_TTL_SECONDS, projection=PRODUCT_FIELDS):
+        self.loan_product_list = loan_product_list
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.projection = projection
+        self._entries = OrderedDict()
+        self._watch_task = None
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, product_id):
+        entry = self._entries.get(product_id)
+        if entry is None:
+            return None
+        expires_at, product = entry
+        if expires_at < time.monotonic():
+            del self._entries[product_id]
+            return None
+        self._entries.move_to_end(product_id)
+        return product
+
+    def _put(self, product_id, product):
+        self._entries[product_id] = (time.monotonic() + self.ttl, product)
+        self._entries.move_to_end(product_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, product_id=None):
+        if product_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(product_id, None)
+
+    async def get_many(self, product_ids):
+        found = {}
+        missing = []
+        for product_id in set(product_ids):
+            product = self._get(product_id)
+            if product is None:
+                missing.append(product_id)
+            else:
+                found[product_id] = product
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            async for product in self.loan_product_list.find({"_id": {"$in": missing}}, self.projection):
+                self._put(product["_id"], product)
+                found[product["_id"]] = product
+        return found
+
+    async def _watch(self):
+        try:
+            async with self.loan_product_list.watch() as stream:
+                async for change in stream:
+                    self.invalidate(change.get("documentKey", {}).get("_id"))
+        except PyMongoError as e:
+            logger.info("loan product change stream unavailable, relying on ttl", extra={"error": str(e)})
+
+    def start(self):
+        self._watch_task = asyncio.create_task(self._watch())
+
+    def stop(self):
+        if self._watch_task:
+            self._watch_task.cancel()
@@ -0,0 +1,149 @@
+import argparse, asyncio, os, sys, time
+from bson import ObjectId  # type: ignore
+from mongomock_motor import AsyncMongoMockClient  # type: ignore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.applications import ApplicationIntake, build_application  # noqa: E402
+from app.notifications import notification_doc  # noqa: E402
+
+# a partner upload of loan applications on mongomock with an artificial per-round-trip delay:
+# the old add_application flow (profile, product by name, existing check, insert, admin,
+# outbox, each its own round trip) with concurrent requests, versus ApplicationIntake in
+# batches. Then the same application submitted concurrently, to show the old check-then-insert
+# race and the unique index closing it. mongomock checks a unique index by scanning the
+# collection on every insert, so the batch throughput here is bound by that, not by mongo
+# python bench/add_applications.py --applications 2000 --round-trip-ms 1
+
+
+class CountingCollection:
+    def __init__(self, collection, delay, counter):
+        self.collection = collection
+        self.delay = delay
+        self.counter = counter
+
+    async def _trip(self, method, *args, **kwargs):
+        self.counter["round_trips"] += 1
+        await asyncio.sleep(self.delay)
+        return await getattr(self.collection, method)(*args, **kwargs)
+
+    async def find_one(self, *args, **kwargs):
+        return await self._trip("find_one", *args, **kwargs)
+
+    async def insert_one(self, *args, **kwargs):
+        return await self._trip("insert_one", *args, **kwargs)
+
+    async def insert_many(self, *args, **kwargs):
+        return await self._trip("insert_many", *args, **kwargs)
+
+    def find(self, *args, **kwargs):
+        return DelayedCursor(self, self.collection.find(*args, **kwargs))
+
+
+class DelayedCursor:
+    def __init__(self, collection, cursor):
+        self.collection = collection
+        self.cursor = cursor
+
+    async def to_list(self, length=None):
+        self.collection.counter["round_trips"] += 1
+        await asyncio.sleep(self.collection.delay)
+        return await self.cursor.to_list(length=length)
+
+
+async def old_add_application(c, data, now):
+    user_id = ObjectId(data["user_id"])
+    user_profile = await c["profiles"].find_one({"_id": user_id})
+    loan_product = await c["products"].find_one({"name": data["loan_name"]})
+    if await c["applications"].find_one({"user_id": user_id, "loan_product_id": loan_product["_id"]}):
+        return False
+    await c["applications"].insert_one(build_application(user_profile, loan_product, now))
+    admin = await c["admins"].find_one({"_id": ObjectId(loan_product["admin_id"])})
+    await c["outbox"].insert_one(notification_doc(admin["email"], "subject", "body"))
+    return True
+
+
+async def seed(db, n_users, n_products):
+    admins = [{"_id": ObjectId(), "name": f"admin {i}", "email": f"admin{i}@lender.com"} for i in range(10)]
+    profiles = [{"_id": ObjectId(), "name": f"user {i}", "email": f"user{i}@example.com"} for i in range(n_users)]
+    products = [
+        {"_id": ObjectId(), "name": f"product-{i}", "admin_id": str(admins[i % 10]["_id"]), "max_amount": 100000, "max_tenure_months": 12}
+        for i in range(n_products)
+    ]
+    await db.admins.insert_many(admins)
+    await db.user_profiles.insert_many(profiles)
+    await db.loanproducts.insert_many(products)
+    return profiles, products
+
+
+def collections(db, delay, counter):
+    return {
+        name: CountingCollection(db[coll], delay, counter)
+        for name, coll in [("profiles", "user_profiles"), ("products", "loanproducts"), ("applications", "loanapplications"), ("admins", "admins"), ("outbox", "notification_outbox")]
+    }
+
+
+def intake(c):
+    return ApplicationIntake(c["profiles"], c["products"], c["admins"], c["applications"], c["outbox"], "admin@lender.com")
+
+
+async def upload(args):
+    counter = {"round_trips": 0}
+    db = AsyncMongoMockClient()["old"]
+    profiles, products = await seed(db, args.applications, 20)
+    items = [{"user_id": str(p["_id"]), "loan_name": products[i % 20]["name"]} for i, p in enumerate(profiles)]
+    c = collections(db, args.round_trip_ms / 1000, counter)
+    queue = list(items)
+
+    async def client():
+        while queue:
+            await old_add_application(c, queue.pop(), time.time())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    report("add_application", len(items), counter, time.perf_counter() - start, await db.loanapplications.count_documents({}))
+
+    counter["round_trips"] = 0
+    db = AsyncMongoMockClient()["new"]
+    await db.loanapplications.create_index([("user_id", 1), ("loan_product_id", 1)], unique=True)
+    profiles, products = await seed(db, args.applications, 20)
+    items = [{"user_id": str(p["_id"]), "loan_name": products[i % 20]["name"]} for i, p in enumerate(profiles)]
+    c = collections(db, args.round_trip_ms / 1000, counter)
+    start = time.perf_counter()
+    for i in range(0, len(items), args.batch):
+        await intake(c).submit(items[i:i + args.batch])
+    report(f"add-applications x{args.batch}", len(items), counter, time.perf_counter() - start, await db.loanapplications.count_documents({}))
+    # a retried upload writes nothing new
+    results = await intake(c).submit(items[:args.batch])
+    print(f"{'retried batch':<24} {sum(r['status'] == 'exists' for r in results)} of {len(results)} reported as exists")
+
+
+def report(label, n, counter, elapsed, stored):
+    print(f"{label:<24} {n / elapsed:>8.0f} applications/s   {counter['round_trips'] / n:>5.2f} round trips each   stored {stored}")
+
+
+async def race(args):
+    # the same application submitted by concurrent requests, e.g. a double click and a retry
+    for label, unique in (("find_one + insert_one", False), ("unique index", True)):
+        db = AsyncMongoMockClient()["race"]
+        if unique:
+            await db.loanapplications.create_index([("user_id", 1), ("loan_product_id", 1)], unique=True)
+        profiles, products = await seed(db, 1, 1)
+        c = collections(db, args.round_trip_ms / 1000, {"round_trips": 0})
+        data = {"user_id": str(profiles[0]["_id"]), "loan_name": products[0]["name"]}
+        if unique:
+            await asyncio.gather(*(intake(c).submit([data]) for _ in range(args.duplicates)))
+        else:
+            await asyncio.gather(*(old_add_application(c, data, time.time()) for _ in range(args.duplicates)))
+        print(f"{label:<24} {args.duplicates} concurrent submissions stored {await db.loanapplications.count_documents({})} applications")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--applications", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent add_application requests of the old flow")
+    parser.add_argument("--duplicates", type=int, default=20)
+    parser.add_argument("--round-trip-ms", type=float, default=1.0)
+    args = parser.parse_args()
+    asyncio.run(upload(args))
+    asyncio.run(race(args))
@@ -0,0 +1,103 @@
+import argparse, asyncio, os, statistics, sys, time
+from bson import ObjectId  # type: ignore
+from mongomock_motor import AsyncMongoMockClient  # type: ignore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.product_cache import ProductCache  # noqa: E402
+
+# round trips and latency per /get-applications request, old N+1 loop versus the $in +
+# product cache path, on mongomock with an artificial per-round-trip delay
+# python bench/get_applications.py --applications 50 --round-trip-ms 1
+
+
+class CountingCollection:
+    def __init__(self, collection, delay):
+        self.collection = collection
+        self.delay = delay
+        self.round_trips = 0
+
+    async def find_one(self, *args, **kwargs):
+        self.round_trips += 1
+        await asyncio.sleep(self.delay)
+        return await self.collection.find_one(*args, **kwargs)
+
+    def find(self, *args, **kwargs):
+        self.round_trips += 1
+        return DelayedCursor(self.collection.find(*args, **kwargs), self.delay)
+
+
+class DelayedCursor:
+    def __init__(self, cursor, delay):
+        self.cursor = cursor
+        self.delay = delay
+
+    def sort(self, *args):
+        self.cursor = self.cursor.sort(*args)
+        return self
+
+    def limit(self, n):
+        self.cursor = self.cursor.limit(n)
+        return self
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(self.delay)
+        return await self.cursor.to_list(length=length)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await asyncio.sleep(self.delay)
+        async for doc in self.cursor:
+            yield doc
+
+
+async def old_path(applications, products, user_id):
+    loan_applications = await applications.find({"user_id": user_id}).to_list(length=None)
+    for loan_application in loan_applications:
+        await products.find_one({"_id": loan_application["loan_product_id"]})
+
+
+async def new_path(applications, cache, user_id):
+    loan_applications = await applications.find({"user_id": user_id}, {"loan_product_id": 1}).sort("_id", 1).to_list(length=None)
+    await cache.get_many([a["loan_product_id"] for a in loan_applications])
+
+
+async def measure(label, call, counters, requests):
+    for counter in counters:
+        counter.round_trips = 0
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - start)
+    trips = sum(c.round_trips for c in counters) / requests
+    print(f"{label:<22} {trips:>6.1f} round trips/request   p50 {statistics.median(latencies) * 1000:>7.2f} ms")
+
+
+async def main(n_applications, delay, requests):
+    db = AsyncMongoMockClient()["bench"]
+    user_id = ObjectId()
+    product_ids = [ObjectId() for _ in range(max(1, n_applications // 2))]
+    await db.loanproducts.insert_many([
+        {"_id": pid, "name": f"p{i}", "description": "", "max_tenure_months": 12, "max_amount": 1e5, "interest_rate": 12}
+        for i, pid in enumerate(product_ids)
+    ])
+    await db.loanapplications.insert_many([
+        {"user_id": user_id, "loan_product_id": product_ids[i % len(product_ids)]} for i in range(n_applications)
+    ])
+    applications = CountingCollection(db.loanapplications, delay)
+    products = CountingCollection(db.loanproducts, delay)
+    cache = ProductCache(products)
+
+    await measure("find_one per row", lambda: old_path(applications, products, user_id), [applications, products], requests)
+    await measure("$in + product cache", lambda: new_path(applications, cache, user_id), [applications, products], requests)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--applications", type=int, default=50)
+    parser.add_argument("--round-trip-ms", type=float, default=1.0)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.applications, args.round_trip_ms / 1000, args.requests))
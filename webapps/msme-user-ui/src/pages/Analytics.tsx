@@ -9,6 +9,10 @@ import { bank_analytics, BankAnalytics, risk_data } from "@/types/loan";
 import { useNavigate } from "react-router-dom";
 import { LineChart, Line, BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from "recharts";
 
+// statistics aa-service had too little data for come back as null
+const formatStat = (value: number | null, format: (value: number) => string) =>
+  value == null ? "—" : format(value);
+
 const Analytics = () => {
   const [analytics, setAnalytics] = useState<bank_analytics| null>(null);
   const [risk_data, setRiskData] = useState<risk_data|null>(null);
@@ -31,34 +35,11 @@ const Analytics = () => {
       // solution 
       console.log(bankAnalytics)
       await new Promise(resolve => setTimeout(resolve, 1000));
-// Step 1: Get the current month number (0-indexed)
-const currentDate = new Date();
-const currentMonthNumber = currentDate.getMonth();
-
-// Step 2: Define an array of month names in chronological order
-const allMonths = [
-  "January", "February", "March", "April", "May", "June",
-  "July", "August", "September", "October", "November", "December"
-];
-
-// Step 3: Sort the monthly_data array
-const sortedMonthlyData = [...bankAnalytics.monthly_data].sort((a, b) => {
-  const monthAIndex = allMonths.indexOf(a.month_name);
-  const monthBIndex = allMonths.indexOf(b.month_name);
-
-  // If month A is the current month, it should come last (return 1)
-  if (monthAIndex === currentMonthNumber) {
-    return 1;
-  }
-  // If month B is the current month, it should come last (return -1)
-  if (monthBIndex === currentMonthNumber) {
-    return -1;
-  }
-  // Otherwise, sort in chronological order
-  return monthAIndex - monthBIndex;
-});
+// monthly_data comes back in chronological order, one entry per calendar year-month;
+// analytics stored before the year-month buckets have no month and keep their order up front
+const sortedMonthlyData = [...(bankAnalytics.monthly_data ?? [])].sort((a, b) => (a.month ?? "").localeCompare(b.month ?? ""));
 
-// Step 4: Update the bankAnalytics object with the sorted data
+// keep the sorted data on the analytics object
 const updatedBankAnalytics = { ...bankAnalytics, monthly_data: sortedMonthlyData };
 console.log(updatedBankAnalytics);
       // step-2 fetch credit risk data from the mongodb 
@@ -69,7 +50,7 @@ console.log(updatedBankAnalytics);
       const risk_data = await risk_res.json()
       console.log(risk_data)
       setRiskData(risk_data)
-      setAnalytics(bankAnalytics);
+      setAnalytics(updatedBankAnalytics);
       setIsLoading(false);
     };
     
@@ -121,19 +102,19 @@ console.log(updatedBankAnalytics);
         <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-4 gap-4">
           <StatCard 
             title="Average Monthly Inflow" 
-            value={`₹${analytics.average_monthly_inflow.toLocaleString()}`} 
+            value={formatStat(analytics.average_monthly_inflow, (value) => `₹${value.toLocaleString()}`)} 
             icon={<TrendingUp className="h-5 w-5 text-finance-primary" />}
             // change={{ value: 5.2, isPositive: true }}
           />
           <StatCard 
             title="Average Monthly Outflow" 
-            value={`₹${analytics.average_monthly_outflow.toLocaleString()}`}
+            value={formatStat(analytics.average_monthly_outflow, (value) => `₹${value.toLocaleString()}`)}
             icon={<Wallet className="h-5 w-5 text-finance-primary" />}
             // change={{ value: 3.1, isPositive: false }}
           />
           <StatCard 
             title="Cash Flow Stability" 
-            value={`${analytics.cash_flow_stability.toLocaleString()}%`}
+            value={formatStat(analytics.cash_flow_stability, (value) => `${value.toLocaleString()}%`)}
             icon={<BarChart3 className="h-5 w-5 text-finance-primary" />}
             // change={{ value: 2.5, isPositive: true }}
           />
@@ -199,7 +180,7 @@ console.log(updatedBankAnalytics);
         <div className="grid grid-cols-1 md:grid-cols-3 gap-4">
           <StatCard 
             title="Average Maintained Balance" 
-            value={`₹${analytics.average_maintained_balance.toLocaleString()}`}
+            value={formatStat(analytics.average_maintained_balance, (value) => `₹${value.toLocaleString()}`)}
           />
           <StatCard 
             title="Total Debited Amount" 
@@ -211,11 +192,11 @@ console.log(updatedBankAnalytics);
           />
           <StatCard 
             title="Balance Voltality" 
-            value={`${(analytics.balance_voltality * 100).toLocaleString()} %`}
+            value={formatStat(analytics.balance_voltality, (value) => `${(value * 100).toLocaleString()} %`)}
           />
           <StatCard 
             title="Cash transaction ratio" 
-            value={`${(analytics.cash_tx_ratio * 100).toLocaleString()} %`}
+            value={formatStat(analytics.cash_tx_ratio, (value) => `${(value * 100).toLocaleString()} %`)}
           />
           <StatCard 
             title="Available Credit Limit" 
@@ -51,37 +51,48 @@ const Index = () => {
           {
             console.log("URL not Found")
           }
-          // step-2 poll consent status 
-          async function startPolling() {
-            while(true)
+          // step-2 wait on the consent: aa-service opens the data session and fetches the
+          // data itself once the consent is approved, each long-poll returns on the next change
+          let res
+          let wait_res
+          let version = 0
+          while(true)
+          {
+            wait_res = await fetch(
+              `${import.meta.env.VITE_AA_SERVICE}/consents/${res_consent.id}/wait?version=${version}`)
+            res = await wait_res.json()
+            console.log(res)
+            if(!wait_res.ok)
+            {
+              break;
+            }
+            version = res.version
+            if(res.job_status=="done" || res.job_status=="failed" || ["REJECTED", "REVOKED", "EXPIRED"].includes(res.status))
             {
-              const poll_res = await fetch(
-                `${import.meta.env.VITE_AA_SERVICE}/get-consent-status/${res_consent.id}`)
-              const res_poll = await poll_res.json()
-              console.log(res_poll)
-              if(res_poll.status=="ACTIVE")
-              {
-                break;
-              }
-              await new Promise(resolve => setTimeout(resolve, 3000));
+              break;
             }
           }
-          await startPolling();
-          
-          console.log("Polling completed...")
-          // step-3 if status==approved create session 
-          const session_create_res = await fetch(
-            `${import.meta.env.VITE_AA_SERVICE}/create-session/${res_consent.id}`
-          )
-          const session_res = await session_create_res.json()
-          console.log(session_res)
-          // step-4 init fetch data
-          console.log("time delay started....")
-          await new Promise(resolve => setTimeout(resolve, 10000));
-          const FI_msg = await fetch(
-            `${import.meta.env.VITE_AA_SERVICE}/fetch-data/${session_res.id}`
-          )
-          const res = await FI_msg.json()
+
+          // only a finished fetch has ids, anything else ends the flow with an error
+          if(res.job_status!="done" || !res.ids)
+          {
+            setIsLoading(false);
+            let description = "Could not fetch your bank data, please try again"
+            if(["REJECTED", "REVOKED", "EXPIRED"].includes(res.status))
+            {
+              description = `Account aggregator consent ${res.status.toLowerCase()}, please try again`
+            }
+            else if(!wait_res.ok)
+            {
+              description = res.error || description
+            }
+            toast({
+              title: "Account linking failed",
+              description: description,
+              variant: "destructive",
+            });
+            return;
+          }
 
           localStorage.setItem("user_id",res.ids.user_id)
           localStorage.setItem("bank_analytics_id",res.ids.bank_analytics_id)
@@ -57,21 +57,24 @@ export interface bank_analytics {
    total_credit : number;
    total_debit : number;
    debit_to_credit_ratio : number;
-   average_tx_amount : number;
+   // null where aa-service had too little data (no transactions, a single month)
+   average_tx_amount : number | null;
    monthly_data : {
+    // "YYYY-MM", missing on analytics stored before the year-month buckets
+    month? : string;
     month_name : string;
     monthly_inflow : number;
     monthly_outflow : number;
     monthly_balance : number;
    }[];
-   average_monthly_inflow : number;
-   average_monthly_outflow : number;
-   average_monthly_cashflow : number;
-   cash_flow_stability : number;
-   minmum_maintained_balance : number;
-   average_maintained_balance : number;
-   balance_voltality : number;
-   cash_tx_ratio : number;
+   average_monthly_inflow : number | null;
+   average_monthly_outflow : number | null;
+   average_monthly_cashflow : number | null;
+   cash_flow_stability : number | null;
+   minmum_maintained_balance : number | null;
+   average_maintained_balance : number | null;
+   balance_voltality : number | null;
+   cash_tx_ratio : number | null;
 
 }
 